@@ -34,6 +34,30 @@ class ImageProperties:
         self.number_of_components_per_pixel = image.GetNumberOfComponentsPerPixel()
         self.pixel_id = image.GetPixelID()
 
+    @classmethod
+    def from_file(cls, file_path: str) -> 'ImageProperties':
+        """Gets the image properties of an image file by reading the image header only (i.e. without the voxel data).
+
+        Args:
+            file_path (str): The path to the image file.
+
+        Returns:
+            ImageProperties: The image properties.
+        """
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(file_path)
+        reader.ReadImageInformation()
+
+        properties = cls.__new__(cls)
+        properties.size = reader.GetSize()
+        properties.origin = reader.GetOrigin()
+        properties.spacing = reader.GetSpacing()
+        properties.direction = reader.GetDirection()
+        properties.dimensions = reader.GetDimension()
+        properties.number_of_components_per_pixel = reader.GetNumberOfComponents()
+        properties.pixel_id = reader.GetPixelID()
+        return properties
+
     def is_two_dimensional(self) -> bool:
         """Determines whether the image is two-dimensional.
 
@@ -1,5 +1,11 @@
-from .callback import (Callback, WriteDataCallback, WriteFilesCallback, WriteNamesCallback, WriteSubjectCallback,
-                       WriteImageInformationCallback, ComposeCallback, get_default_callbacks)
-from .fileloader import (Load, LoadDefault)
-from .writer import (Hdf5Writer, Writer, get_writer)
-from .traverser import (SubjectFileTraverser, Traverser)
+from .callback import (Callback, BufferedWriteCallback, WriteDataCallback, WriteFilesCallback, WriteNamesCallback,
+                       WriteSubjectCallback, WriteImageInformationCallback, WriteBuildManifestCallback,
+                       WriteStatisticsCallback, WriteForegroundCallback, WritePyramidCallback, ProfileCallback,
+                       ComposeCallback, get_default_callbacks, quantize, downsample,
+                       write_image_information)
+from .fileloader import (Load, LoadDefault, CachedLoad, load_subject_properties, check_subject_properties)
+from .manifest import BuildManifest
+from .sharding import (create_sharded_dataset, get_shard_paths)
+from .writer import (Hdf5Writer, DirectoryStoreWriter, NpyMemmapWriter, Writer, StorageLayout, ChunkedLayout,
+                     get_writer)
+from .traverser import (SubjectFileTraverser, ParallelSubjectFileTraverser, PrefetchSubjectFileTraverser, Traverser)
@@ -1,4 +1,7 @@
+import json
 import os
+import time
+import typing as t
 
 import numpy as np
 
@@ -6,9 +9,41 @@ import pymia.data.indexexpression as expr
 import pymia.data.conversion as conv
 import pymia.data.subjectfile as subj
 import pymia.data.definition as df
+import pymia.data.statistics as stat
+from . import fileloader as ldr
 from . import writer as wr
 
 
+def get_subject_index_str(subject_index: int, subject_count: int) -> str:
+    """Get the name of a subject's data entry, i.e. the zero-padded subject index.
+
+    Args:
+        subject_index (int): The subject index.
+        subject_count (int): The number of subjects in the dataset.
+
+    Returns:
+        str: The subject index padded with zeros to the number of digits of the subject count.
+    """
+    max_digits = len(str(subject_count))
+    return '{{:0{}}}'.format(max_digits).format(subject_index)
+
+
+def rename_subject_entries(writer: wr.Writer, group: str, subject_index_offset: int, subject_count: int):
+    """Renames the per-subject entries of a group when appending subjects increases the number of digits.
+
+    Args:
+        writer (Writer): The writer.
+        group (str): The group containing one entry per subject named by :func:`get_subject_index_str`.
+        subject_index_offset (int): The number of existing subjects.
+        subject_count (int): The number of subjects after appending.
+    """
+    if subject_index_offset == 0 or len(str(subject_count)) == len(str(subject_index_offset)):
+        return
+    for subject_index in range(subject_index_offset):
+        writer.move('{}/{}'.format(group, get_subject_index_str(subject_index, subject_index_offset)),
+                    '{}/{}'.format(group, get_subject_index_str(subject_index, subject_count)))
+
+
 class Callback:
 
     def on_start(self, params: dict):
@@ -39,62 +74,306 @@ class ComposeCallback(Callback):
             c.on_subject(params)
 
 
-class WriteDataCallback(Callback):
+class BufferedWriteCallback(Callback):
+    """Represents a callback accumulating per-subject rows of meta entries and writing them in bulk.
 
-    def __init__(self, writer: wr.Writer) -> None:
+    The rows of consecutive subjects are written with one :meth:`Writer.fill` per entry, at the end of the traversal
+    or every `flush_interval` subjects.
+    """
+
+    def __init__(self, writer: wr.Writer, flush_interval: int=None) -> None:
+        """Initializes a new instance of the BufferedWriteCallback class.
+
+        Args:
+            writer (Writer): The writer.
+            flush_interval (int): The number of subjects after which the buffered rows are written. If None, the rows
+                are written at the end of the traversal only.
+        """
+        if flush_interval is not None and flush_interval < 1:
+            raise ValueError('flush_interval must be at least 1')
         self.writer = writer
+        self.flush_interval = flush_interval
+        self.buffer_start = None
+        self.buffer = {}
 
-    def on_subject(self, params: dict):
-        subject_files = params['subject_files']
-        subject_index = params['subject_index']
+    def on_end(self, params: dict):
+        self.flush()
+
+    def buffer_rows(self, subject_index: int, rows: dict):
+        """Buffers the rows of a subject.
+
+        Args:
+            subject_index (int): The subject index, i.e. the row index of the entries.
+            rows (dict): The row of each entry.
+        """
+        if self.buffer_start is not None and subject_index != self.buffer_start + self._buffer_length():
+            self.flush()  # not consecutive
+        if self.buffer_start is None:
+            self.buffer_start = subject_index
+        for entry, row in rows.items():
+            self.buffer.setdefault(entry, []).append(row)
+
+        if self.flush_interval is not None and self._buffer_length() >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows."""
+        if self.buffer_start is None:
+            return
+        index_expr = expr.IndexExpression((self.buffer_start, self.buffer_start + self._buffer_length()))
+        for entry, rows in self.buffer.items():
+            self.writer.fill(entry, rows, index_expr)
+        self.buffer_start = None
+        self.buffer = {}
+
+    def _buffer_length(self) -> int:
+        return len(next(iter(self.buffer.values()))) if self.buffer else 0
+
+
+class WriteDataCallback(BufferedWriteCallback):
+    """Writes the data of the subjects.
+
+    Additionally, the names and shapes of the subject entries of each category are written to
+    :data:`definition.DATA_ENTRIES_PLACEHOLDER` and :data:`definition.DATA_SHAPES_PLACEHOLDER`, such that readers can
+    get them without accessing each entry (see :meth:`Reader.get_all_shapes`).
+    """
+
+    def __init__(self, writer: wr.Writer, dtypes: dict=None, flush_interval: int=None) -> None:
+        """Initializes a new instance of the WriteDataCallback class.
+
+        Args:
+            writer (Writer): The writer.
+            dtypes (dict): The storage dtype of the categories, e.g. {'images': np.int16, 'labels': np.uint8}.
+                The data of categories not in `dtypes` is stored as is. See :func:`quantize` for integer dtypes.
+                Data copied from a previous build of the same dtype (see :meth:`BuildManifest.load_previous`) is
+                stored with its scale and offset, i.e. not quantized again.
+            flush_interval (int): The number of subjects after which the buffered quantization scales and offsets,
+                and entry names and shapes are written.
+        """
+        super().__init__(writer, flush_interval)
+        self.dtypes = {} if dtypes is None else {k: np.dtype(v) for k, v in dtypes.items()}
+        self.shape_categories = set()  # the categories whose entry names and shapes are written
+        self.unreserved_shapes = set()  # the categories whose shape entry is reserved at the first subject
+        self.quantized_categories = set()  # the categories whose quantization scales and offsets are written
+        self.existing_dtypes = {}  # the dtype of the categories with data when appending
+
+    def on_start(self, params: dict):
+        subject_index_offset = params['subject_index_offset']
+        subject_count = params['subject_count']
+
+        self.shape_categories = set()
+        self.unreserved_shapes = set()
+        self.quantized_categories = set()
+        self.existing_dtypes = {}
+        for category in params['categories']:
+            first_entry = '{}/{}'.format(df.DATA_PLACEHOLDER.format(category),
+                                         get_subject_index_str(0, subject_index_offset))
+            if subject_index_offset > 0 and self.writer.has(first_entry):
+                self.existing_dtypes[category] = self.writer.read(first_entry, expr.IndexExpression(0)).dtype
+                if category in self.dtypes and self.dtypes[category] != self.existing_dtypes[category]:
+                    raise ValueError('cannot append {} as {}, the existing data is stored as {}'
+                                     .format(category, self.dtypes[category], self.existing_dtypes[category]))
 
-        max_digits = len(str(len(subject_files)))
-        index_str = '{{:0{}}}'.format(max_digits).format(subject_index)
+        for category in params['categories']:
+            # rename the existing entries such that all subject indices have the same number of digits
+            rename_subject_entries(self.writer, df.DATA_PLACEHOLDER.format(category), subject_index_offset,
+                                   subject_count)
+
+            entries_entry = df.DATA_ENTRIES_PLACEHOLDER.format(category)
+            shapes_entry = df.DATA_SHAPES_PLACEHOLDER.format(category)
+            if subject_index_offset == 0:
+                self.writer.reserve(entries_entry, (subject_count,), str)
+                self.unreserved_shapes.add(category)
+                self.shape_categories.add(category)
+            elif self.writer.has(shapes_entry):  # not written by datasets created before
+                self.writer.resize(entries_entry, (subject_count,))
+                self.writer.fill(entries_entry, [get_subject_index_str(i, subject_count)
+                                                 for i in range(subject_index_offset)],
+                                 expr.IndexExpression((0, subject_index_offset)))
+                self.writer.resize(shapes_entry, (subject_count, self.writer.read(shapes_entry).shape[1]))
+                self.shape_categories.add(category)
+
+            scale_entry = df.QUANTIZATION_PLACEHOLDER.format(category, 'scale')
+            offset_entry = df.QUANTIZATION_PLACEHOLDER.format(category, 'offset')
+            channels = len(params['{}_names'.format(category)])
+            if subject_index_offset > 0 and self.writer.has(scale_entry):
+                # the appended subjects are stored losslessly (scale 1 and offset 0) if not quantized
+                self.writer.resize(scale_entry, (subject_count, channels))
+                self.writer.resize(offset_entry, (subject_count, channels))
+                self.quantized_categories.add(category)
+            elif category in self.dtypes and np.issubdtype(self.dtypes[category], np.integer):
+                self.writer.reserve(scale_entry, (subject_count, channels), dtype=np.float64)
+                self.writer.reserve(offset_entry, (subject_count, channels), dtype=np.float64)
+                if subject_index_offset > 0:
+                    # the existing subjects were stored losslessly
+                    index_expr = expr.IndexExpression((0, subject_index_offset))
+                    self.writer.fill(scale_entry, np.ones((subject_index_offset, channels)), index_expr)
+                    self.writer.fill(offset_entry, np.zeros((subject_index_offset, channels)), index_expr)
+                self.quantized_categories.add(category)
+
+    def on_subject(self, params: dict):
+        index_str = get_subject_index_str(params['subject_index'], params['subject_count'])
 
+        rows = {}
         for category in params['categories']:
             data = params[category]
+            channels = len(params['{}_names'.format(category)])
+            scale, offset = 1., 0.
+            quantized = params.get('{}_quantized'.format(category))  # copied from a previous build
+            if category in self.dtypes and quantized is not None and quantized[0].dtype == self.dtypes[category]:
+                data, scale, offset = quantized
+            elif category in self.dtypes:
+                data, scale, offset = quantize(data, self.dtypes[category], channels)
+            if category in self.existing_dtypes and data.dtype != self.existing_dtypes[category]:
+                raise ValueError('cannot append {} of dtype {}, the existing data is stored as {}'
+                                 .format(category, data.dtype, self.existing_dtypes[category]))
+            if category in self.quantized_categories:
+                rows[df.QUANTIZATION_PLACEHOLDER.format(category, 'scale')] = np.broadcast_to(scale, channels)
+                rows[df.QUANTIZATION_PLACEHOLDER.format(category, 'offset')] = np.broadcast_to(offset, channels)
             self.writer.write('{}/{}'.format(df.DATA_PLACEHOLDER.format(category), index_str), data, dtype=data.dtype)
 
+            if category in self.unreserved_shapes:
+                self.writer.reserve(df.DATA_SHAPES_PLACEHOLDER.format(category), (params['subject_count'], data.ndim),
+                                    dtype=np.int64)
+                self.unreserved_shapes.remove(category)
+            if category in self.shape_categories:
+                rows[df.DATA_ENTRIES_PLACEHOLDER.format(category)] = index_str
+                rows[df.DATA_SHAPES_PLACEHOLDER.format(category)] = np.asarray(data.shape)
+        if rows:
+            self.buffer_rows(params['subject_index'], rows)
 
-class WriteSubjectCallback(Callback):
 
-    def __init__(self, writer: wr.Writer) -> None:
-        self.writer = writer
+def quantize(data: np.ndarray, dtype, channels: int=1) -> tuple:
+    """Converts data to a (compact) storage dtype.
+
+    Floating dtypes are converted directly. Integer data within the range of an integer dtype is converted
+    losslessly (scale 1 and offset 0). Otherwise, the data is quantized per channel to the full range of the integer
+    dtype, such that `data ~= quantized * scale + offset`.
+
+    Args:
+        data (np.ndarray): The data.
+        dtype: The storage dtype.
+        channels (int): The number of channels (last dimension of `data` if larger than one).
+
+    Returns:
+        tuple: The converted data, the scale and the offset (np.ndarray of shape (channels,) or scalars).
+    """
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.integer):
+        return data.astype(dtype), 1., 0.
+
+    info = np.iinfo(dtype)
+    if np.issubdtype(data.dtype, np.integer) and (data.size == 0 or (info.min <= data.min() and
+                                                                    data.max() <= info.max)):
+        return data.astype(dtype), 1., 0.
+
+    axis = tuple(range(data.ndim - 1)) if channels > 1 and data.shape[-1] == channels else None
+    min_ = data.min(axis=axis).astype(np.float64)
+    max_ = data.max(axis=axis).astype(np.float64)
+    scale = (max_ - min_) / (float(info.max) - info.min)
+    scale = np.where(scale > 0, scale, 1.)
+    offset = min_ - info.min * scale
+
+    quantized = (data - offset.astype(np.float32)) / scale.astype(np.float32)
+    quantized = np.clip(np.rint(quantized, out=quantized), info.min, info.max)
+    return quantized.astype(dtype), scale, offset
+
+
+class WriteSubjectCallback(BufferedWriteCallback):
 
     def on_start(self, params: dict):
-        subject_count = len(params['subject_files'])
-        self.writer.reserve(df.SUBJECT, (subject_count,), str)
+        subject_count = params['subject_count']
+        subject_index_offset = params['subject_index_offset']
+        if subject_index_offset > 0:
+            existing_count = len(self.writer.read(df.SUBJECT)) if self.writer.has(df.SUBJECT) else 0
+            if existing_count != subject_index_offset:
+                raise ValueError('subject_index_offset {} does not match the {} subjects of the dataset'
+                                 .format(subject_index_offset, existing_count))
+            self.writer.resize(df.SUBJECT, (subject_count,))
+        else:
+            self.writer.reserve(df.SUBJECT, (subject_count,), str)
 
     def on_subject(self, params: dict):
         subject_files = params['subject_files']
         subject_index = params['subject_index']
 
-        subject = subject_files[subject_index].subject
-        self.writer.fill(df.SUBJECT, subject, expr.IndexExpression(subject_index))
+        subject = subject_files[subject_index - params['subject_index_offset']].subject
+        self.buffer_rows(subject_index, {df.SUBJECT: subject})
 
 
-class WriteImageInformationCallback(Callback):
+class WriteImageInformationCallback(BufferedWriteCallback):
+    """Writes the image information (shape, origin, direction and spacing) of the subjects.
 
-    def __init__(self, writer: wr.Writer, category='images') -> None:
-        self.writer = writer
+    By default, the image properties loaded with the data of `category` are written. If a loader is given, the
+    properties are read from the header of the first file of `category` (see :meth:`Load.load_properties`), e.g. for
+    loaders not returning image properties. Use :func:`write_image_information` to write the image information of
+    subjects without loading their data at all.
+    """
+
+    def __init__(self, writer: wr.Writer, category='images', flush_interval: int=None,
+                 load: ldr.Load=None) -> None:
+        """Initializes a new instance of the WriteImageInformationCallback class.
+
+        Args:
+            writer (Writer): The writer.
+            category (str): The category whose image properties are written.
+            flush_interval (int): The number of subjects after which the buffered rows are written.
+            load (Load): The loader reading the image properties from the file headers. If None, the image properties
+                loaded with the data are written.
+        """
+        super().__init__(writer, flush_interval)
         self.category = category
+        self.load = load
         self.new_subject = False
 
     def on_start(self, params: dict):
-        subject_count = len(params['subject_files'])
-        self.writer.reserve(df.INFO_SHAPE, (subject_count, 3), dtype=np.uint16)
-        self.writer.reserve(df.INFO_ORIGIN, (subject_count, 3), dtype=np.float)
-        self.writer.reserve(df.INFO_DIRECTION, (subject_count, 9), dtype=np.float)
-        self.writer.reserve(df.INFO_SPACING, (subject_count, 3), dtype=np.float)
+        subject_count = params['subject_count']
+        if params['subject_index_offset'] > 0:
+            self.writer.resize(df.INFO_SHAPE, (subject_count, 3))
+            self.writer.resize(df.INFO_ORIGIN, (subject_count, 3))
+            self.writer.resize(df.INFO_DIRECTION, (subject_count, 9))
+            self.writer.resize(df.INFO_SPACING, (subject_count, 3))
+        else:
+            self.writer.reserve(df.INFO_SHAPE, (subject_count, 3), dtype=np.uint16)
+            self.writer.reserve(df.INFO_ORIGIN, (subject_count, 3), dtype=np.float)
+            self.writer.reserve(df.INFO_DIRECTION, (subject_count, 9), dtype=np.float)
+            self.writer.reserve(df.INFO_SPACING, (subject_count, 3), dtype=np.float)
 
     def on_subject(self, params: dict):
         subject_index = params['subject_index']
-        properties = params['{}_properties'.format(self.category)]  # type: conv.ImageProperties
-
-        self.writer.fill(df.INFO_SHAPE, properties.size, expr.IndexExpression(subject_index))
-        self.writer.fill(df.INFO_ORIGIN, properties.origin, expr.IndexExpression(subject_index))
-        self.writer.fill(df.INFO_DIRECTION, properties.direction, expr.IndexExpression(subject_index))
-        self.writer.fill(df.INFO_SPACING, properties.spacing, expr.IndexExpression(subject_index))
+        if self.load is not None:
+            subject_file = params['subject_files'][subject_index - params['subject_index_offset']]
+            id_, file_path = next(iter(subject_file.categories[self.category].entries.items()))
+            properties = self.load.load_properties(file_path, id_, self.category, subject_file.subject)
+        else:
+            properties = params['{}_properties'.format(self.category)]  # type: conv.ImageProperties
+
+        self.buffer_rows(subject_index, {df.INFO_SHAPE: properties.size,
+                                         df.INFO_ORIGIN: properties.origin,
+                                         df.INFO_DIRECTION: properties.direction,
+                                         df.INFO_SPACING: properties.spacing})
+
+
+def write_image_information(writer: wr.Writer, subject_files: t.List[subj.SubjectFile],
+                            load: ldr.Load=ldr.LoadDefault(), category: str='images', num_threads: int=1):
+    """Writes the image information of subjects like :class:`WriteImageInformationCallback`, but from the file
+    headers only, i.e. without loading the data (see :func:`load_subject_properties`).
+
+    Args:
+        writer (Writer): The writer.
+        subject_files (list of SubjectFile): The subject files.
+        load (Load): The loader reading the image properties.
+        category (str): The category whose image properties are written.
+        num_threads (int): The number of threads loading the properties concurrently.
+    """
+    all_properties = ldr.load_subject_properties(subject_files, load, (category,), num_threads)
+    callback = WriteImageInformationCallback(writer, category)
+    params = {'subject_files': subject_files, 'subject_index_offset': 0, 'subject_count': len(subject_files)}
+    callback.on_start(params)
+    for subject_index, properties in enumerate(all_properties):
+        callback.on_subject({**params, 'subject_index': subject_index,
+                             '{}_properties'.format(category): next(iter(properties[category].values()))})
+    callback.on_end(params)
 
 
 class WriteNamesCallback(Callback):
@@ -104,13 +383,19 @@ class WriteNamesCallback(Callback):
 
     def on_start(self, params: dict):
         for category in params['categories']:
-            self.writer.write(df.NAMES_PLACEHOLDER.format(category), params['{}_names'.format(category)], dtype='str')
+            names = params['{}_names'.format(category)]
+            if params['subject_index_offset'] > 0:
+                existing_names = self.writer.read(df.NAMES_PLACEHOLDER.format(category))
+                if [str(name) for name in names] != existing_names:
+                    raise ValueError('{} names {} do not match the names {} of the existing subjects'
+                                     .format(category, names, existing_names))
+            self.writer.write(df.NAMES_PLACEHOLDER.format(category), names, dtype='str')
 
 
-class WriteFilesCallback(Callback):
+class WriteFilesCallback(BufferedWriteCallback):
 
-    def __init__(self, writer: wr.Writer) -> None:
-        self.writer = writer
+    def __init__(self, writer: wr.Writer, flush_interval: int=None) -> None:
+        super().__init__(writer, flush_interval)
         self.file_root = None
 
     @staticmethod
@@ -121,29 +406,515 @@ class WriteFilesCallback(Callback):
 
     def on_start(self, params: dict):
         subject_files = params['subject_files']
+        subject_index_offset = params['subject_index_offset']
+        subject_count = params['subject_count']
+
+        previous_file_root = self.writer.read(df.FILES_ROOT) if subject_index_offset > 0 else None
         self.file_root = self._get_common_path(subject_files)
+        if previous_file_root is not None:
+            self.file_root = os.path.commonpath([previous_file_root, self.file_root])
         self.writer.write(df.FILES_ROOT, self.file_root, dtype='str')
 
         for category in params['categories']:
-            self.writer.reserve(df.FILES_PLACEHOLDER.format(category),
-                                (len(subject_files), len(params['{}_names'.format(category)])), dtype='str')
+            entry = df.FILES_PLACEHOLDER.format(category)
+            shape = (subject_count, len(params['{}_names'.format(category)]))
+            if subject_index_offset == 0:
+                self.writer.reserve(entry, shape, dtype='str')
+                continue
+
+            self.writer.resize(entry, shape)
+            if self.file_root != previous_file_root:
+                # make the existing paths relative to the new root
+                index_expr = expr.IndexExpression((0, subject_index_offset))
+                previous_files = self.writer.read(entry, index_expr)
+                files = [[os.path.relpath(os.path.join(previous_file_root, f), self.file_root) for f in files]
+                         for files in previous_files]
+                self.writer.fill(entry, files, index_expr)
 
     def on_subject(self, params: dict):
         subject_index = params['subject_index']
         subject_files = params['subject_files']
 
-        subject_file = subject_files[subject_index]  # type: subj.SubjectFile
+        subject_file = subject_files[subject_index - params['subject_index_offset']]  # type: subj.SubjectFile
 
+        rows = {}
         for category in params['categories']:
-            for index, file_name in enumerate(subject_file.categories[category].entries.values()):
-                relative_path = os.path.relpath(file_name, self.file_root)
-                index_expr = expr.IndexExpression(indexing=[subject_index, index], axis=(0, 1))
-                self.writer.fill(df.FILES_PLACEHOLDER.format(category), relative_path, index_expr)
+            rows[df.FILES_PLACEHOLDER.format(category)] = [os.path.relpath(file_name, self.file_root) for file_name
+                                                           in subject_file.categories[category].entries.values()]
+        self.buffer_rows(subject_index, rows)
+
+
+class WriteBuildManifestCallback(Callback):
+    """Writes the build manifest (see :class:`BuildManifest`) if the traverser is given one."""
+
+    def __init__(self, writer: wr.Writer) -> None:
+        self.writer = writer
+
+    def on_start(self, params: dict):
+        if 'subject_hashes' not in params:
+            return
+
+        subject_index_offset = params['subject_index_offset']
+        subject_count = params['subject_count']
+        if subject_index_offset > 0 and self.writer.has(df.BUILD_SUBJECT_HASHES):
+            self.writer.resize(df.BUILD_SUBJECT_HASHES, (subject_count,))
+        else:
+            self.writer.reserve(df.BUILD_SUBJECT_HASHES, (subject_count,), str)
+        self.writer.fill(df.BUILD_SUBJECT_HASHES, params['subject_hashes'],
+                         expr.IndexExpression((subject_index_offset, subject_count)))
+        # an empty fingerprint (i.e. the configuration could not be fingerprinted) never matches
+        fingerprint = params['build_fingerprint'] if params['build_fingerprint'] is not None else ''
+        self.writer.write(df.BUILD_FINGERPRINT, fingerprint, dtype='str')
+
+
+class WriteStatisticsCallback(BufferedWriteCallback):
+    """Computes per-channel intensity statistics of the subjects and of the dataset while the subjects are written.
+
+    The statistics are stored under `meta/statistics/<category>/` (see :data:`definition.STATISTICS_PLACEHOLDER`):
+    `subject_mean`, `subject_std`, `subject_min`, `subject_max` with shape (subject_count, C) and
+    `subject_percentiles` with shape (subject_count, P, C) per subject, as well as `count`, `mean`, `std`, `min` and
+    `max` with shape (C,) for the dataset. The dataset statistics are computed in a streaming manner.
+    If a histogram is requested, the dataset histogram (bins, C) with its `histogram_edges` and the dataset
+    `percentiles` (P, C), approximated from the histogram, are additionally stored.
+    The statistics can be extracted with :class:`StatisticsExtractor`.
+    """
+
+    def __init__(self, writer: wr.Writer, categories=('images',), percentiles=(1, 99), histogram_bins: int=None,
+                 histogram_range: tuple=None, flush_interval: int=None) -> None:
+        """Initializes a new instance of the WriteStatisticsCallback class.
+
+        Args:
+            writer (Writer): The writer.
+            categories (tuple of str): The categories to compute the statistics of.
+            percentiles (tuple of float): The percentiles (0-100) to compute.
+            histogram_bins (int): The number of histogram bins. If None, no histogram is computed.
+            histogram_range (tuple): The (lower, upper) range of the histogram. Intensities outside the range are
+                counted in the outermost bins. Required if `histogram_bins` is not None.
+            flush_interval (int): The number of subjects after which the buffered subject statistics are written.
+        """
+        super().__init__(writer, flush_interval)
+        if histogram_bins is not None and histogram_range is None:
+            raise ValueError('histogram_range is required to compute a histogram')
+        self.categories = categories
+        self.percentiles = np.asarray(percentiles, dtype=np.float64)
+        self.histogram_bins = histogram_bins
+        self.histogram_range = histogram_range
+        self.dataset_statistics = {}
+
+    def on_start(self, params: dict):
+        subject_index_offset = params['subject_index_offset']
+        subject_count = params['subject_count']
+
+        self.dataset_statistics = {}
+        for category in self.categories:
+            channels = len(params['{}_names'.format(category)])
+            shapes = {'subject_mean': (subject_count, channels), 'subject_std': (subject_count, channels),
+                      'subject_min': (subject_count, channels), 'subject_max': (subject_count, channels),
+                      'subject_percentiles': (subject_count, len(self.percentiles), channels)}
+
+            if subject_index_offset > 0:
+                self._check_percentiles(category)
+                for statistic, shape in shapes.items():
+                    self.writer.resize(df.STATISTICS_PLACEHOLDER.format(category, statistic), shape)
+                self.dataset_statistics[category] = self._read_dataset_statistics(category)
+            else:
+                for statistic, shape in shapes.items():
+                    self.writer.reserve(df.STATISTICS_PLACEHOLDER.format(category, statistic), shape,
+                                        dtype=np.float64)
+                self.writer.write(df.STATISTICS_PLACEHOLDER.format(category, 'percentile_values'), self.percentiles)
+                self.dataset_statistics[category] = None
+
+    def on_subject(self, params: dict):
+        rows = {}
+        for category in self.categories:
+            data = params[category]
+            channels = len(params['{}_names'.format(category)])
+            if channels == 1 or data.shape[-1] != channels:
+                channels = 1
+            data = data.reshape(-1, channels)
+
+            mean = data.mean(axis=0, dtype=np.float64)
+            std = data.std(axis=0, dtype=np.float64)
+            min_ = data.min(axis=0).astype(np.float64)
+            max_ = data.max(axis=0).astype(np.float64)
+            rows[df.STATISTICS_PLACEHOLDER.format(category, 'subject_mean')] = mean
+            rows[df.STATISTICS_PLACEHOLDER.format(category, 'subject_std')] = std
+            rows[df.STATISTICS_PLACEHOLDER.format(category, 'subject_min')] = min_
+            rows[df.STATISTICS_PLACEHOLDER.format(category, 'subject_max')] = max_
+            rows[df.STATISTICS_PLACEHOLDER.format(category, 'subject_percentiles')] = \
+                np.percentile(data, self.percentiles, axis=0)
+
+            subject_statistics = {'count': np.full(channels, data.shape[0], dtype=np.float64), 'mean': mean,
+                                  'm2': std ** 2 * data.shape[0], 'min': min_, 'max': max_}
+            if self.histogram_bins is not None:
+                lower, upper = self.histogram_range
+                subject_statistics['histogram'] = np.stack(
+                    [np.histogram(np.clip(data[:, c], lower, upper), self.histogram_bins, self.histogram_range)[0]
+                     for c in range(channels)], axis=-1).astype(np.float64)
+            self.dataset_statistics[category] = self._merge(self.dataset_statistics[category], subject_statistics)
+
+        self.buffer_rows(params['subject_index'], rows)
+
+    def on_end(self, params: dict):
+        super().on_end(params)
+        for category in self.categories:
+            statistics = self.dataset_statistics[category]
+            if statistics is None:
+                continue
+
+            entry = df.STATISTICS_PLACEHOLDER
+            self.writer.write(entry.format(category, 'count'), statistics['count'])
+            self.writer.write(entry.format(category, 'mean'), statistics['mean'])
+            self.writer.write(entry.format(category, 'std'), np.sqrt(statistics['m2'] / statistics['count']))
+            self.writer.write(entry.format(category, 'min'), statistics['min'])
+            self.writer.write(entry.format(category, 'max'), statistics['max'])
+            if 'histogram' in statistics:
+                edges = np.linspace(self.histogram_range[0], self.histogram_range[1], self.histogram_bins + 1)
+                self.writer.write(entry.format(category, 'histogram'), statistics['histogram'])
+                self.writer.write(entry.format(category, 'histogram_edges'), edges)
+                self.writer.write(entry.format(category, 'percentiles'),
+                                  stat.get_histogram_percentiles(statistics['histogram'], edges, self.percentiles))
+
+    def _check_percentiles(self, category: str):
+        existing = self.writer.read(df.STATISTICS_PLACEHOLDER.format(category, 'percentile_values'))
+        if not np.array_equal(existing, self.percentiles):
+            raise ValueError('percentiles {} do not match the percentiles {} of the existing subjects'
+                             .format(self.percentiles.tolist(), np.asarray(existing).tolist()))
+
+    def _read_dataset_statistics(self, category: str):
+        def read(statistic):
+            return np.asarray(self.writer.read(df.STATISTICS_PLACEHOLDER.format(category, statistic)))
+
+        statistics = {'count': read('count'), 'mean': read('mean'), 'min': read('min'), 'max': read('max')}
+        statistics['m2'] = read('std') ** 2 * statistics['count']
+        if self.histogram_bins is not None:
+            if not self.writer.has(df.STATISTICS_PLACEHOLDER.format(category, 'histogram')) or \
+                    not np.allclose(read('histogram_edges'), np.linspace(self.histogram_range[0],
+                                                                         self.histogram_range[1],
+                                                                         self.histogram_bins + 1)):
+                raise ValueError('histogram does not match the histogram of the existing subjects')
+            statistics['histogram'] = read('histogram')
+        return statistics
+
+    @staticmethod
+    def _merge(a: dict, b: dict) -> dict:
+        if a is None:
+            return b
+        # parallel algorithm of Chan et al. for the mean and the sum of squared differences
+        count = a['count'] + b['count']
+        delta = b['mean'] - a['mean']
+        merged = {'count': count, 'mean': a['mean'] + delta * b['count'] / count,
+                  'm2': a['m2'] + b['m2'] + delta ** 2 * a['count'] * b['count'] / count,
+                  'min': np.minimum(a['min'], b['min']), 'max': np.maximum(a['max'], b['max'])}
+        if 'histogram' in a:
+            merged['histogram'] = a['histogram'] + b['histogram']
+        return merged
+
+
+class WriteForegroundCallback(BufferedWriteCallback):
+    """Records the foreground of each subject, such that samples can be selected without reading the data.
+
+    The entries are stored under `meta/foreground/<category>/` (see :data:`definition.FOREGROUND_PLACEHOLDER`):
+    `bbox` with shape (subject_count, K, image_dimension, 2) holding the start and (exclusive) stop of the foreground
+    bounding box ((0, 0) if there is no foreground), `counts` with shape (subject_count, K) holding the foreground
+    voxel counts, and `slice_counts/<subject>` with shape (K, sum of the image shape) holding the foreground voxel
+    counts of each slice along each axis (concatenated over the axes). K is the number of label values, or one if
+    any non-zero value is foreground. The entries can be extracted with :class:`ForegroundExtractor`.
+    """
+
+    def __init__(self, writer: wr.Writer, category: str='labels', label_values=None, image_dimension: int=3,
+                 flush_interval: int=None) -> None:
+        """Initializes a new instance of the WriteForegroundCallback class.
+
+        Args:
+            writer (Writer): The writer.
+            category (str): The category holding the labels.
+            label_values (tuple of int): The foreground label values. If None, any non-zero value is foreground.
+            image_dimension (int): The image dimension without the channels. The foreground of multiple channels
+                is combined.
+            flush_interval (int): The number of subjects after which the buffered bounding boxes and counts are
+                written.
+        """
+        super().__init__(writer, flush_interval)
+        self.category = category
+        self.label_values = label_values
+        self.image_dimension = image_dimension
+
+    def on_start(self, params: dict):
+        subject_index_offset = params['subject_index_offset']
+        subject_count = params['subject_count']
+        label_count = 1 if self.label_values is None else len(self.label_values)
+        label_values = [] if self.label_values is None else list(self.label_values)
+
+        bbox_entry = df.FOREGROUND_PLACEHOLDER.format(self.category, 'bbox')
+        counts_entry = df.FOREGROUND_PLACEHOLDER.format(self.category, 'counts')
+        if subject_index_offset > 0:
+            existing = list(self.writer.read(df.FOREGROUND_PLACEHOLDER.format(self.category, 'label_values')))
+            if existing != label_values:
+                raise ValueError('label values {} do not match the label values {} of the existing subjects'
+                                 .format(label_values, existing))
+            self.writer.resize(bbox_entry, (subject_count, label_count, self.image_dimension, 2))
+            self.writer.resize(counts_entry, (subject_count, label_count))
+            rename_subject_entries(self.writer, df.FOREGROUND_PLACEHOLDER.format(self.category, 'slice_counts'),
+                                   subject_index_offset, subject_count)
+        else:
+            self.writer.reserve(bbox_entry, (subject_count, label_count, self.image_dimension, 2), dtype=np.int32)
+            self.writer.reserve(counts_entry, (subject_count, label_count), dtype=np.int64)
+            self.writer.write(df.FOREGROUND_PLACEHOLDER.format(self.category, 'label_values'),
+                              np.asarray(label_values, dtype=np.int64))
+
+    def on_subject(self, params: dict):
+        subject_index = params['subject_index']
+        data = params[self.category]
+        data = data.reshape(data.shape[:self.image_dimension] + (-1,))
+
+        if self.label_values is None:
+            foregrounds = [(data != 0).any(axis=-1)]
+        else:
+            foregrounds = [(data == value).any(axis=-1) for value in self.label_values]
+
+        bboxes, counts, slice_counts = [], [], []
+        for foreground in foregrounds:
+            axis_counts = []
+            bbox = np.zeros((self.image_dimension, 2), dtype=np.int32)
+            for axis in range(self.image_dimension):
+                other_axes = tuple(a for a in range(self.image_dimension) if a != axis)
+                axis_count = foreground.sum(axis=other_axes)
+                axis_counts.append(axis_count)
+                nonzero = np.flatnonzero(axis_count)
+                if nonzero.size > 0:
+                    bbox[axis] = nonzero[0], nonzero[-1] + 1
+            bboxes.append(bbox)
+            counts.append(axis_counts[0].sum())
+            slice_counts.append(np.concatenate(axis_counts))
+
+        index_str = get_subject_index_str(subject_index, params['subject_count'])
+        self.writer.write('{}/{}'.format(df.FOREGROUND_PLACEHOLDER.format(self.category, 'slice_counts'), index_str),
+                          np.stack(slice_counts).astype(np.int64))
+        self.buffer_rows(subject_index, {df.FOREGROUND_PLACEHOLDER.format(self.category, 'bbox'): np.stack(bboxes),
+                                         df.FOREGROUND_PLACEHOLDER.format(self.category, 'counts'): counts})
+
+
+class WritePyramidCallback(BufferedWriteCallback):
+    """Writes downsampled versions (i.e. a multi-resolution pyramid) of the subjects' data.
+
+    The data downsampled by a factor f is stored in `pyramid/<f>/<category>/<subject>` (see
+    :data:`definition.PYRAMID_PLACEHOLDER`), and can be extracted with the `pyramid_factor` of :class:`DataExtractor`.
+    Images are downsampled by averaging f^d voxel blocks (anti-aliasing box filter), labels by the most frequent
+    label ('mode') or the first voxel ('nearest') of the blocks. Images not divisible by f are padded with the edge
+    values. The geometry of each level, derived from the image properties of `category`, is stored under
+    `meta/pyramid/<f>/` (see :data:`definition.PYRAMID_INFO_PLACEHOLDER`) with the shapes, origins and spacing in
+    the same format as the image information (see :class:`WriteImageInformationCallback`).
+    """
+
+    def __init__(self, writer: wr.Writer, factors=(2, 4, 8), categories=('images', 'labels'),
+                 label_categories=('labels',), label_method: str='mode', category: str='images',
+                 image_dimension: int=3, flush_interval: int=None) -> None:
+        """Initializes a new instance of the WritePyramidCallback class.
+
+        Args:
+            writer (Writer): The writer.
+            factors (tuple of int): The downsampling factors of the pyramid levels.
+            categories (tuple of str): The categories to downsample.
+            label_categories (tuple of str): The categories holding labels.
+            label_method (str): The downsampling of labels, 'mode' or 'nearest'.
+            category (str): The category whose image properties define the geometry of the levels.
+            image_dimension (int): The image dimension without the channels.
+            flush_interval (int): The number of subjects after which the buffered geometry is written.
+        """
+        super().__init__(writer, flush_interval)
+        if label_method not in ('mode', 'nearest'):
+            raise ValueError('label_method must be "mode" or "nearest"')
+        self.factors = factors
+        self.categories = categories
+        self.label_categories = label_categories
+        self.label_method = label_method
+        self.category = category
+        self.image_dimension = image_dimension
+
+    def on_start(self, params: dict):
+        subject_index_offset = params['subject_index_offset']
+        subject_count = params['subject_count']
+        for factor in self.factors:
+            for category in self.categories:
+                rename_subject_entries(self.writer, df.PYRAMID_PLACEHOLDER.format(factor, category),
+                                       subject_index_offset, subject_count)
+            for info, dtype in (('shapes', np.uint16), ('origins', np.float64), ('spacing', np.float64)):
+                entry = df.PYRAMID_INFO_PLACEHOLDER.format(factor, info)
+                if subject_index_offset > 0:
+                    self.writer.resize(entry, (subject_count, self.image_dimension))
+                else:
+                    self.writer.reserve(entry, (subject_count, self.image_dimension), dtype=dtype)
 
+    def on_subject(self, params: dict):
+        index_str = get_subject_index_str(params['subject_index'], params['subject_count'])
+        properties = params['{}_properties'.format(self.category)]  # type: conv.ImageProperties
 
-def get_default_callbacks(writer: wr.Writer):
-    return ComposeCallback([WriteDataCallback(writer),
-                            WriteFilesCallback(writer),
+        rows = {}
+        for factor in self.factors:
+            for category in self.categories:
+                method = self.label_method if category in self.label_categories else 'mean'
+                data = downsample(params[category], factor, method, self.image_dimension)
+                self.writer.write('{}/{}'.format(df.PYRAMID_PLACEHOLDER.format(factor, category), index_str), data,
+                                  dtype=data.dtype)
+
+            # the downsampled voxel centers are at the block centers (the size is in ITK order, i.e. x, y, z)
+            size = np.ceil(np.asarray(properties.size, dtype=np.float64) / factor)
+            spacing = np.asarray(properties.spacing) * factor
+            direction = np.asarray(properties.direction).reshape(self.image_dimension, self.image_dimension)
+            origin = np.asarray(properties.origin) + direction @ ((factor - 1) / 2 * np.asarray(properties.spacing))
+            rows[df.PYRAMID_INFO_PLACEHOLDER.format(factor, 'shapes')] = size
+            rows[df.PYRAMID_INFO_PLACEHOLDER.format(factor, 'origins')] = origin
+            rows[df.PYRAMID_INFO_PLACEHOLDER.format(factor, 'spacing')] = spacing
+        self.buffer_rows(params['subject_index'], rows)
+
+
+def downsample(data: np.ndarray, factor: int, method: str='mean', image_dimension: int=3) -> np.ndarray:
+    """Downsamples data by reducing blocks of factor^image_dimension voxels.
+
+    Args:
+        data (np.ndarray): The data with the image dimensions first and optional channels last.
+        factor (int): The downsampling factor.
+        method (str): 'mean' for the block average, 'mode' for the most frequent value (the smallest value on ties),
+            or 'nearest' for the voxel at the center of the blocks (the voxel after the center for even factors).
+        image_dimension (int): The image dimension without the channels.
+
+    Returns:
+        np.ndarray: The downsampled data of the same dtype. The voxels correspond to the block centers, i.e. the
+        origin is shifted by half a block minus half a voxel (see :class:`WritePyramidCallback`).
+    """
+    pad_width = [(0, -size % factor) for size in data.shape[:image_dimension]]
+    pad_width += [(0, 0)] * (data.ndim - image_dimension)
+    data_padded = np.pad(data, pad_width, mode='edge')
+
+    if method == 'nearest':
+        return np.ascontiguousarray(data_padded[(slice(factor // 2, None, factor),) * image_dimension])
+
+    block_shape = []
+    for size in data_padded.shape[:image_dimension]:
+        block_shape.extend((size // factor, factor))
+    blocks = data_padded.reshape(tuple(block_shape) + data_padded.shape[image_dimension:])
+    block_axes = tuple(range(1, 2 * image_dimension, 2))
+
+    if method == 'mean':
+        downsampled = blocks.mean(axis=block_axes, dtype=np.float64)
+        if np.issubdtype(data.dtype, np.integer):
+            downsampled = np.rint(downsampled)
+        return downsampled.astype(data.dtype)
+    if method == 'mode':
+        values = np.unique(data)
+        counts = np.stack([(blocks == value).sum(axis=block_axes) for value in values])
+        return values[np.argmax(counts, axis=0)]
+    raise ValueError('unknown method "{}"'.format(method))
+
+
+class ProfileCallback(Callback):
+    """Profiles the dataset creation and reports the progress and a summary.
+
+    Wraps the callbacks writing the dataset and measures their wall time (per callback for a :class:`ComposeCallback`)
+    in addition to the wall times of the traversal stages reported by the traverser (load, concat, transform, and
+    the wait for the next subject loaded or transformed concurrently). Further, the bytes read (file sizes), the bytes
+    written (array sizes before compression), the peak array size and the subjects per second are reported. The
+    traverser only measures its stages if the callback is or contains (see :class:`ComposeCallback`) a
+    ProfileCallback.
+
+    Examples:
+        >>> with get_writer('/path/to/dataset.h5') as writer:
+        >>>     callback = ProfileCallback(get_default_callbacks(writer), summary_file='/path/to/profile.json')
+        >>>     SubjectFileTraverser().traverse(subject_files, callback=callback)
+    """
+
+    def __init__(self, callback: Callback, report_interval: int=10, summary_file: str=None,
+                 verbose: bool=True) -> None:
+        """Initializes a new instance of the ProfileCallback class.
+
+        Args:
+            callback (Callback): The callback to profile.
+            report_interval (int): The number of subjects after which a progress line is printed.
+            summary_file (str): The path to the JSON file the summary is written to at the end. If None, the summary
+                is only available by the `summary` attribute.
+            verbose (bool): Whether to print the progress lines and the summary.
+        """
+        self.callback = callback
+        self.report_interval = report_interval
+        self.summary_file = summary_file
+        self.verbose = verbose
+        self.summary = {}
+        self.start_time = None
+        self.stage_times = {}
+        self.totals = {}
+
+    def _get_callbacks(self) -> list:
+        if isinstance(self.callback, ComposeCallback):
+            return list(self.callback.callbacks)
+        return [self.callback]
+
+    def _call(self, method: str, params: dict):
+        for callback in self._get_callbacks():
+            start = time.perf_counter()
+            getattr(callback, method)(params)
+            stage = 'callback/{}'.format(callback.__class__.__name__)
+            self.stage_times[stage] = self.stage_times.get(stage, 0.) + time.perf_counter() - start
+
+    def on_start(self, params: dict):
+        self.start_time = time.perf_counter()
+        self.stage_times = {}
+        self.totals = {'subjects': 0, 'bytes_read': 0, 'bytes_written': 0, 'peak_array_bytes': 0}
+        self._call('on_start', params)
+
+    def on_subject(self, params: dict):
+        profile = params.get('profile', {})
+        for stage, value in profile.items():
+            if stage == 'bytes_read':
+                self.totals['bytes_read'] += value
+            else:
+                self.stage_times[stage] = self.stage_times.get(stage, 0.) + value
+
+        array_bytes = [params[category].nbytes for category in params['categories']
+                       if isinstance(params[category], np.ndarray)]
+        self.totals['bytes_written'] += sum(array_bytes)
+        self.totals['peak_array_bytes'] = max([self.totals['peak_array_bytes']] + array_bytes)
+        self.totals['subjects'] += 1
+
+        self._call('on_subject', params)
+
+        if self.verbose and self.report_interval and self.totals['subjects'] % self.report_interval == 0:
+            elapsed = time.perf_counter() - self.start_time
+            print('{}/{} subjects, {:.2f} subjects/s, {:.1f} MB read, {:.1f} MB written'.format(
+                params['subject_index'] + 1, params['subject_count'], self.totals['subjects'] / elapsed,
+                self.totals['bytes_read'] / 1e6, self.totals['bytes_written'] / 1e6))
+
+    def on_end(self, params: dict):
+        self._call('on_end', params)
+
+        elapsed = time.perf_counter() - self.start_time
+        self.summary = dict(self.totals)
+        self.summary['wall_time'] = elapsed
+        self.summary['subjects_per_second'] = self.totals['subjects'] / elapsed if elapsed > 0 else 0.
+        self.summary['stage_times'] = self.stage_times
+        if self.summary_file is not None:
+            with open(self.summary_file, 'w') as f:
+                json.dump(self.summary, f, indent=2)
+        if self.verbose:
+            print(json.dumps(self.summary, indent=2))
+
+
+def get_default_callbacks(writer: wr.Writer, flush_interval: int=None, dtypes: dict=None):
+    """Get the default callbacks writing the data and meta entries of a dataset.
+
+    Args:
+        writer (Writer): The writer.
+        flush_interval (int): The number of subjects after which the buffered meta entries are written (see
+            :class:`BufferedWriteCallback`). If None, they are written at the end of the traversal only.
+        dtypes (dict): The storage dtype of the categories (see :class:`WriteDataCallback`).
+
+    Returns:
+        ComposeCallback: The composed callbacks.
+    """
+    # the subjects first, such that an inconsistent append is rejected before any entry is modified
+    return ComposeCallback([WriteSubjectCallback(writer, flush_interval),
+                            WriteDataCallback(writer, dtypes, flush_interval),
+                            WriteFilesCallback(writer, flush_interval),
                             WriteNamesCallback(writer),
-                            WriteImageInformationCallback(writer),
-                            WriteSubjectCallback(writer)])
+                            WriteImageInformationCallback(writer, flush_interval=flush_interval),
+                            WriteBuildManifestCallback(writer)])
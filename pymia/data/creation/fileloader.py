@@ -1,11 +1,17 @@
 import abc
+import concurrent.futures as cf
+import hashlib
+import json
+import os
 import typing as t
 
 import numpy as np
 import SimpleITK as sitk
 
 import pymia.data.conversion as conv
+import pymia.data.filecache as fc
 import pymia.data.subjectfile as subj
+from . import manifest as mf
 
 
 class Load(metaclass=abc.ABCMeta):
@@ -15,6 +21,17 @@ class Load(metaclass=abc.ABCMeta):
             -> t.Tuple[np.ndarray, t.Union[conv.ImageProperties, None]]:
         pass
 
+    def load_properties(self, file_name: str, id_: str, category: str, subject_id: str) \
+            -> t.Union[conv.ImageProperties, None]:
+        """Loads the image properties of a file without the data, if supported by the loader.
+
+        The default implementation loads the file entirely. Override it to read the image header only.
+
+        Returns:
+            ImageProperties: The image properties.
+        """
+        return self(file_name, id_, category, subject_id)[1]
+
 
 class LoadDefault(Load):
 
@@ -23,5 +40,171 @@ class LoadDefault(Load):
         img = sitk.ReadImage(file_name)
         return sitk.GetArrayFromImage(img), conv.ImageProperties(img)
 
+    def load_properties(self, file_name: str, id_: str, category: str, subject_id: str) \
+            -> t.Union[conv.ImageProperties, None]:
+        return conv.ImageProperties.from_file(file_name)
+
+
+class CachedLoad(Load):
+    """Loads files through another loader and caches the loaded data and image properties on disk.
+
+    The data is stored uncompressed as `.npy` file with the image properties in a `.json` file next to it. The cache
+    key consists of the file path, size and modification time, of the loader arguments and of a fingerprint of the
+    loader (see :func:`get_fingerprint`), such that modified files and differently configured loaders are loaded
+    again. Repeated dataset creations, e.g. with different transforms, thus skip reading and decompressing (e.g.
+    `.nii.gz`) the source files. If the size of the cache exceeds `max_bytes`, the least recently used entries are
+    evicted.
+
+    The cache is safe to be shared by the threads and processes of the traversers (see
+    :class:`ParallelSubjectFileTraverser`), since the entries are written atomically.
+    """
+
+    def __init__(self, load: Load, cache_dir: str, max_bytes: int=None, version: str=None) -> None:
+        """Initializes a new instance of the CachedLoad class.
+
+        Args:
+            load (Load): The loader of the files not yet in the cache.
+            cache_dir (str): The cache directory. Created if it does not exist.
+            max_bytes (int): The maximum size of the cache in bytes. If None, the size is unbounded.
+            version (str): The version of the loader, which replaces the fingerprint of the loader's state in the
+                cache key. Required if the loader is not picklable, or to invalidate the cache when the loader's code
+                changes.
+        """
+        if version is None:
+            try:
+                version = mf.get_fingerprint(load)
+            except ValueError as e:
+                raise ValueError('{}, provide a version of the loader'.format(e)) from e
+        self.load = load
+        self.version = version
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __call__(self, file_name: str, id_: str, category: str, subject_id: str) -> \
+            t.Tuple[np.ndarray, t.Union[conv.ImageProperties, None]]:
+        data_path, properties_path = self._get_cache_paths(file_name, id_, category, subject_id)
+        try:
+            data = np.load(data_path)
+            properties = self._read_properties(properties_path)
+            os.utime(data_path)  # mark as recently used
+            self.hits += 1
+            return data, properties
+        except (FileNotFoundError, ValueError):
+            pass
+
+        self.misses += 1
+        data, properties = self.load(file_name, id_, category, subject_id)
+        self._write(data_path, properties_path, data, properties)
+        return data, properties
+
+    def load_properties(self, file_name: str, id_: str, category: str, subject_id: str) \
+            -> t.Union[conv.ImageProperties, None]:
+        _, properties_path = self._get_cache_paths(file_name, id_, category, subject_id)
+        try:
+            return self._read_properties(properties_path)
+        except (FileNotFoundError, ValueError):
+            return self.load.load_properties(file_name, id_, category, subject_id)
+
+    def get_size(self) -> int:
+        """Get the size of the cache.
+
+        Returns:
+            int: The size of the cached data in bytes.
+        """
+        return sum(size for _, size, _ in self._get_entries())
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for data_path, _, _ in self._get_entries():
+            self._remove(data_path)
+
+    def _get_cache_paths(self, file_name: str, id_: str, category: str, subject_id: str) -> t.Tuple[str, str]:
+        stat = os.stat(file_name)
+        key = json.dumps([os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns, type(self.load).__name__,
+                          self.version, id_, category, subject_id])
+        base_path = os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest())
+        return base_path + '.npy', base_path + '.json'
+
+    @staticmethod
+    def _read_properties(properties_path: str) -> t.Union[conv.ImageProperties, None]:
+        with open(properties_path, 'r') as f:
+            values = json.load(f)
+        if values is None:
+            return None
+        properties = conv.ImageProperties.__new__(conv.ImageProperties)
+        for name, value in values.items():
+            setattr(properties, name, tuple(value) if isinstance(value, list) else value)
+        return properties
+
+    def _write(self, data_path: str, properties_path: str, data: np.ndarray,
+               properties: t.Union[conv.ImageProperties, None]):
+        # the data is written last, since entries are identified by their data file
+        fc.write_atomic(properties_path, lambda f: json.dump(None if properties is None else vars(properties), f),
+                        binary=False)
+        fc.write_atomic(data_path, lambda f: np.save(f, data))
+
+        if self.max_bytes is not None:
+            fc.evict(self.cache_dir, '.npy', self.max_bytes, remove_fn=self._remove)
+
+    def _get_entries(self) -> t.List[t.Tuple[str, int, int]]:
+        return fc.get_entries(self.cache_dir, '.npy')
+
+    @staticmethod
+    def _remove(data_path: str):
+        fc.remove(data_path)
+        fc.remove(os.path.splitext(data_path)[0] + '.json')
+
+
+def load_subject_properties(subject_files: t.List[subj.SubjectFile], load: Load=LoadDefault(),
+                            categories: t.Iterable[str]=None, num_threads: int=1) \
+        -> t.List[t.Dict[str, t.Dict[str, conv.ImageProperties]]]:
+    """Loads the image properties of all files of the subjects without reading the data (see
+    :meth:`Load.load_properties`), e.g. to check the subjects before creating a dataset.
+
+    Args:
+        subject_files (list of SubjectFile): The subject files.
+        load (Load): The file loader.
+        categories (iterable of str): The categories to load. If None, all categories are loaded.
+        num_threads (int): The number of threads loading the properties concurrently.
+
+    Returns:
+        list: The image properties of each subject as dict with the categories as keys and dicts with the file
+        identifiers as keys and the image properties as values.
+    """
+    def load_subject(subject_file: subj.SubjectFile):
+        subject_categories = subject_file.categories.keys() if categories is None else categories
+        return {category: {id_: load.load_properties(file_path, id_, category, subject_file.subject)
+                           for id_, file_path in subject_file.categories[category].entries.items()}
+                for category in subject_categories}
+
+    if num_threads > 1:
+        with cf.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            return list(executor.map(load_subject, subject_files))
+    return [load_subject(subject_file) for subject_file in subject_files]
+
+
+def check_subject_properties(subject_files: t.List[subj.SubjectFile], load: Load=LoadDefault(),
+                             categories: t.Iterable[str]=None, num_threads: int=1):
+    """Checks that all files of each subject have the same image geometry (size, origin, spacing and direction)
+    without reading the data.
 
+    Args:
+        subject_files (list of SubjectFile): The subject files.
+        load (Load): The file loader.
+        categories (iterable of str): The categories to check. If None, all categories are checked.
+        num_threads (int): The number of threads loading the properties concurrently.
 
+    Raises:
+        ValueError: If the image geometry of the files of a subject differs.
+    """
+    all_properties = load_subject_properties(subject_files, load, categories, num_threads)
+    for subject_file, properties in zip(subject_files, all_properties):
+        subject_properties = [(id_, p) for category in properties.values() for id_, p in category.items()]
+        reference_id, reference = subject_properties[0]
+        for id_, p in subject_properties[1:]:
+            if p != reference:
+                raise ValueError('image geometry of {} and {} of subject {} differs'
+                                 .format(reference_id, id_, subject_file.subject))
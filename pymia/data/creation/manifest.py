@@ -0,0 +1,214 @@
+import hashlib
+import os
+import pickle
+import typing as t
+import warnings
+
+import numpy as np
+import SimpleITK as sitk
+
+import pymia.data.conversion as conv
+import pymia.data.definition as df
+import pymia.data.indexexpression as expr
+import pymia.data.subjectfile as subj
+import pymia.data.extraction.reader as rd
+
+
+def get_subject_hash(subject_file: subj.SubjectFile, categories: t.Iterable[str], content_hash: bool=False) -> str:
+    """Get the hash of a subject's source files.
+
+    Args:
+        subject_file (SubjectFile): The subject's files.
+        categories (iterable of str): The categories to consider.
+        content_hash (bool): Whether to hash the file contents. If False, the path, size and modification time of the
+            files are hashed, which does not require reading the files.
+
+    Returns:
+        str: The hash.
+    """
+    sha = hashlib.sha1()
+    for category in categories:
+        for id_, file_path in subject_file.categories[category].entries.items():
+            sha.update(repr((category, str(id_), file_path)).encode())
+            if content_hash:
+                with open(file_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        sha.update(block)
+            else:
+                stat = os.stat(file_path)
+                sha.update(repr((stat.st_size, stat.st_mtime_ns)).encode())
+    return sha.hexdigest()
+
+
+def get_fingerprint(*objects) -> str:
+    """Get the fingerprint of the configuration of a build (e.g. the loader and transform).
+
+    The objects are hashed by their pickled representation. Note that pickle represents classes and module-level
+    functions by their name only, i.e. modifying the code of a function or class does not change the fingerprint.
+
+    Args:
+        *objects: The objects defining the configuration.
+
+    Returns:
+        str: The fingerprint.
+
+    Raises:
+        ValueError: If the objects are not picklable (e.g. lambdas or local functions), since the fingerprint would
+            not be reproducible.
+    """
+    try:
+        data = pickle.dumps(objects)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise ValueError('configuration cannot be fingerprinted, since it is not picklable ({})'.format(e)) from e
+    return hashlib.sha1(data).hexdigest()
+
+
+class BuildManifest:
+    """Represents the build manifest of a dataset, which allows skipping unchanged subjects when re-creating a dataset.
+
+    The manifest consists of a hash of each subject's source files and a fingerprint of the build configuration
+    (i.e. categories, loader, transform and concatenation function). It is written to the dataset by the
+    :class:`WriteBuildManifestCallback`. When re-creating a dataset, subjects whose hash and fingerprint match the
+    previous build are not loaded and transformed, but copied from the previous dataset.
+
+    The fingerprint is computed from the pickled configuration (see :func:`get_fingerprint`), hence it does not change
+    when the code of a function or class changes. Provide an explicit `fingerprint` (e.g. a version string) to
+    control when the subjects are re-processed, or if the configuration is not picklable. Otherwise, a non-picklable
+    configuration processes all subjects with a warning.
+
+    Note that the previous dataset needs to be a different file than the dataset being created.
+    The image properties of the copied subjects are restored from the image information of the previous dataset
+    (see :class:`WriteImageInformationCallback`) and are assigned to all categories. Quantized data (see
+    :func:`quantize`) is copied as stored if the storage dtype did not change, i.e. it is not quantized again.
+
+    Examples:
+        >>> manifest = BuildManifest(previous_file_path='/path/to/previous_dataset.h5')
+        >>> with get_writer('/path/to/dataset.h5') as writer:
+        >>>     SubjectFileTraverser().traverse(subject_files, callback=get_default_callbacks(writer),
+        >>>                                     manifest=manifest)
+    """
+
+    def __init__(self, previous_file_path: str=None, content_hash: bool=False, fingerprint: str=None) -> None:
+        """Initializes a new instance of the BuildManifest class.
+
+        Args:
+            previous_file_path (str): The path to the previously built dataset. If None or not existing, all subjects
+                are processed.
+            content_hash (bool): Whether to hash the file contents instead of the file sizes and modification times.
+            fingerprint (str): The explicit fingerprint (e.g. a version string) of the build configuration. If None,
+                the fingerprint is computed from the loader, transform and concatenation function.
+        """
+        self.previous_file_path = previous_file_path
+        self.content_hash = content_hash
+        self.explicit_fingerprint = fingerprint
+        self.subject_hashes = []
+        self.fingerprint = None
+        self.reader = None  # type: rd.Reader
+        self.entry_base_names = []
+
+    def prepare(self, subject_files: t.List[subj.SubjectFile], categories: t.List[str], load, transform,
+                concat_fn) -> t.Dict[int, int]:
+        """Computes the manifest and compares it to the manifest of the previous build.
+
+        Args:
+            subject_files (list of SubjectFile): The subject files.
+            categories (list of str): The categories to traverse.
+            load (Load): The file loader.
+            transform (Transform): The transform applied to the loaded data.
+            concat_fn: The function concatenating the loaded data of a category.
+
+        Returns:
+            dict: The indices of the unchanged subjects within `subject_files` mapped to their subject indices in the
+            previous build.
+        """
+        try:
+            if self.explicit_fingerprint is not None:
+                self.fingerprint = get_fingerprint(categories, self.explicit_fingerprint)
+            else:
+                self.fingerprint = get_fingerprint(categories, load, transform, concat_fn)
+        except ValueError as e:
+            warnings.warn('{}. All subjects are processed, provide an explicit fingerprint to skip unchanged '
+                          'subjects'.format(e))
+            self.fingerprint = None
+        self.subject_hashes = [get_subject_hash(s, categories, self.content_hash) for s in subject_files]
+
+        if self.fingerprint is None or self.previous_file_path is None or \
+                not os.path.exists(self.previous_file_path):
+            return {}
+
+        self.close()
+        # the stored data is read, such that unchanged quantized subjects are not quantized again
+        self.reader = rd.get_reader(self.previous_file_path, direct_open=True, dequantize=False)
+        if not self.reader.has(df.BUILD_FINGERPRINT) or self.reader.read(df.BUILD_FINGERPRINT) != self.fingerprint:
+            return {}
+        for category in categories:
+            names = [str(name) for name in subject_files[0].categories[category].entries.keys()]
+            if not self.reader.has(df.NAMES_PLACEHOLDER.format(category)) or \
+                    self.reader.read(df.NAMES_PLACEHOLDER.format(category)) != names:
+                return {}
+
+        previous_subjects = zip(self.reader.get_subjects(), self.reader.read(df.BUILD_SUBJECT_HASHES))
+        previous_hashes = {subject_and_hash: index for index, subject_and_hash in enumerate(previous_subjects)}
+        self.entry_base_names = [entry.rsplit('/', maxsplit=1)[1] for entry in self.reader.get_subject_entries()]
+
+        unchanged = {}
+        for index, (subject_file, subject_hash) in enumerate(zip(subject_files, self.subject_hashes)):
+            previous_index = previous_hashes.get((subject_file.subject, subject_hash))
+            if previous_index is not None:
+                unchanged[index] = previous_index
+        return unchanged
+
+    def load_previous(self, previous_index: int, categories: t.List[str]) -> dict:
+        """Loads the data of a subject from the previous build.
+
+        Args:
+            previous_index (int): The subject index in the previous build.
+            categories (list of str): The categories to load.
+
+        Returns:
+            dict: The data and image properties of each category. The data of quantized categories is dequantized,
+            and additionally the stored data, scale and offset are provided as tuple in `<category>_quantized`
+            (see :class:`WriteDataCallback`).
+        """
+        subject_index_expr = expr.IndexExpression(previous_index)
+        properties = self._read_properties(subject_index_expr) if self.reader.has(df.INFO_SHAPE) else None
+
+        params = {}
+        base_name = self.entry_base_names[previous_index]
+        for category in categories:
+            data = self.reader.read('{}/{}'.format(df.DATA_PLACEHOLDER.format(category), base_name))
+            scale_entry = df.QUANTIZATION_PLACEHOLDER.format(category, 'scale')
+            if self.reader.has(scale_entry):
+                scale = np.asarray(self.reader.read(scale_entry, subject_index_expr))
+                offset = np.asarray(self.reader.read(df.QUANTIZATION_PLACEHOLDER.format(category, 'offset'),
+                                                     subject_index_expr))
+                params['{}_quantized'.format(category)] = (data, scale, offset)
+                data = _dequantize(data, scale, offset)
+            params[category] = data
+            params['{}_properties'.format(category)] = properties
+        return params
+
+    def _read_properties(self, subject_index_expr: expr.IndexExpression) -> conv.ImageProperties:
+        # the properties are assembled directly, i.e. without allocating an image of the subject's size
+        properties = conv.ImageProperties.__new__(conv.ImageProperties)
+        properties.size = tuple(self.reader.read(df.INFO_SHAPE, subject_index_expr).tolist())
+        properties.origin = tuple(self.reader.read(df.INFO_ORIGIN, subject_index_expr).tolist())
+        properties.spacing = tuple(self.reader.read(df.INFO_SPACING, subject_index_expr).tolist())
+        properties.direction = tuple(self.reader.read(df.INFO_DIRECTION, subject_index_expr).tolist())
+        properties.dimensions = len(properties.size)
+        properties.number_of_components_per_pixel = 1
+        properties.pixel_id = sitk.sitkUInt8
+        return properties
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+def _dequantize(data: np.ndarray, scale: np.ndarray, offset: np.ndarray) -> np.ndarray:
+    if np.all(scale == 1) and np.all(offset == 0):
+        return data  # stored losslessly
+    if len(scale) == 1:
+        scale, offset = scale[0], offset[0]
+    return data * scale.astype(np.float32) + offset.astype(np.float32)
@@ -0,0 +1,99 @@
+import concurrent.futures as cf
+import json
+import os
+import typing as t
+
+import numpy as np
+
+from pymia.data import subjectfile as subj
+import pymia.data.transformation as tfm
+from . import callback as cb
+from . import fileloader as load
+from . import traverser as trav
+from . import writer as wr
+
+
+SHARDS_EXTENSION = '.shards'
+
+
+def get_shard_paths(file_path: str, shard_count: int, shard_extension: str='.h5') -> t.List[str]:
+    """Get the file paths of the shards of a sharded dataset, i.e. `<stem>_<shard index><shard_extension>`.
+
+    Args:
+        file_path (str): The path of the manifest file of the sharded dataset.
+        shard_count (int): The number of shards.
+        shard_extension (str): The file extension of the shards, which defines the writer (see :func:`get_writer`).
+
+    Returns:
+        list: The file paths of the shards.
+    """
+    stem = os.path.splitext(file_path)[0]
+    return ['{}_{:03d}{}'.format(stem, i, shard_extension) for i in range(shard_count)]
+
+
+def create_sharded_dataset(file_path: str, subject_files: t.List[subj.SubjectFile], shard_count: int,
+                           shard_extension: str='.h5', traverser: trav.Traverser=None, load=load.LoadDefault(),
+                           transform: tfm.Transform=None, callback_fn=cb.get_default_callbacks,
+                           num_workers: int=1) -> t.List[str]:
+    """Creates a dataset split into shards, each holding a contiguous range of the subjects.
+
+    The shards are independent datasets and can be written concurrently, e.g. by multiple processes or on multiple
+    machines. The file at `file_path` is a manifest listing the shards, which is read by :class:`ShardedReader` as a
+    single dataset.
+
+    Args:
+        file_path (str): The path of the manifest file. Must have the extension `.shards`.
+        subject_files (list of SubjectFile): The subject files.
+        shard_count (int): The number of shards. Reduced to the number of subjects if larger.
+        shard_extension (str): The file extension of the shards, which defines the writer (see :func:`get_writer`).
+        traverser (Traverser): The traverser. If None, a :class:`SubjectFileTraverser` is used.
+        load (Load): The file loader.
+        transform (Transform): The transform applied to the loaded data.
+        callback_fn: The function returning the callback for a writer (see :func:`get_default_callbacks`).
+        num_workers (int): The number of processes writing the shards concurrently. The arguments must be picklable
+            if larger than one.
+
+    Returns:
+        list: The file paths of the shards.
+    """
+    if os.path.splitext(file_path)[1] != SHARDS_EXTENSION:
+        raise ValueError('file path of the sharded dataset must have the extension "{}"'.format(SHARDS_EXTENSION))
+    if len(subject_files) == 0:
+        raise ValueError('No files')
+    if shard_count < 1:
+        raise ValueError('shard_count must be at least one')
+    if traverser is None:
+        traverser = trav.SubjectFileTraverser()
+
+    shard_count = min(shard_count, len(subject_files))
+    shard_paths = get_shard_paths(file_path, shard_count, shard_extension)
+    shard_subjects = [list(subjects) for subjects in np.array_split(np.asarray(subject_files, dtype=object),
+                                                                      shard_count)]
+
+    args = [(shard_path, subjects, traverser, load, transform, callback_fn)
+            for shard_path, subjects in zip(shard_paths, shard_subjects)]
+    if num_workers > 1:
+        with cf.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            for future in [executor.submit(_create_shard, *arg) for arg in args]:
+                future.result()
+    else:
+        for arg in args:
+            _create_shard(*arg)
+
+    manifest_dir = os.path.dirname(os.path.abspath(file_path))
+    shards = []
+    subject_offset = 0
+    for shard_path, subjects in zip(shard_paths, shard_subjects):
+        shards.append({'file': os.path.relpath(os.path.abspath(shard_path), manifest_dir),
+                       'subject_offset': subject_offset, 'subject_count': len(subjects)})
+        subject_offset += len(subjects)
+    with open(file_path, 'w') as f:
+        json.dump({'shards': shards}, f, indent=2)
+
+    return shard_paths
+
+
+def _create_shard(shard_path: str, subject_files: t.List[subj.SubjectFile], traverser: trav.Traverser, load,
+                  transform: tfm.Transform, callback_fn):
+    with wr.get_writer(shard_path) as writer:
+        traverser.traverse(subject_files, load=load, callback=callback_fn(writer), transform=transform)
@@ -1,4 +1,8 @@
 import abc
+import collections
+import concurrent.futures as cf
+import os
+import time
 import typing as t
 
 import numpy as np
@@ -8,6 +12,7 @@ import pymia.data.transformation as tfm
 import pymia.data.conversion as conv
 from . import callback as cb
 from . import fileloader as load
+from . import manifest as mf
 
 
 class Traverser(metaclass=abc.ABCMeta):
@@ -24,8 +29,122 @@ def default_concat(data: t.List[np.ndarray]) -> np.ndarray:
     return np.stack(data, axis=-1)
 
 
+def _load(load: load.Load, file_path: str, id_: str, category: str, subject_file: subj.SubjectFile,
+          profile: t.Union[dict, None]):
+    """Loads a file and adds the load time and the file size to the profile, if not None."""
+    if profile is None:
+        return load(file_path, id_, category, subject_file.subject)
+
+    start = time.perf_counter()
+    np_data, data_property = load(file_path, id_, category, subject_file.subject)
+    profile['load'] += time.perf_counter() - start
+    if os.path.isfile(file_path):
+        profile['bytes_read'] += os.path.getsize(file_path)
+    return np_data, data_property
+
+
+def _load_stacked(subject_file: subj.SubjectFile, category: str, load: load.Load, profile: t.Union[dict, None]) \
+        -> t.Tuple[np.ndarray, conv.ImageProperties]:
+    """Loads and stacks the files of a category like :func:`default_concat`, but without holding all loaded files
+    in memory at once.
+
+    The output is allocated when the first file is loaded and each file is copied into its channel slot right after
+    loading. Thus, the peak memory is the stacked output plus one file instead of twice the stacked output.
+    """
+    entries = list(subject_file.categories[category].entries.items())
+
+    stacked = None
+    category_property = None  # type: conv.ImageProperties
+    for channel, (id_, file_path) in enumerate(entries):
+        np_data, data_property = _load(load, file_path, id_, category, subject_file, profile)
+        if len(entries) == 1:
+            return np_data, data_property
+
+        start = time.perf_counter()
+        if stacked is None:
+            stacked = np.empty(np_data.shape + (len(entries),), dtype=np_data.dtype)
+            category_property = data_property
+        elif np_data.shape != stacked.shape[:-1]:
+            raise ValueError('all input arrays must have the same shape')
+        elif np.result_type(stacked.dtype, np_data.dtype) != stacked.dtype:
+            stacked = stacked.astype(np.result_type(stacked.dtype, np_data.dtype))  # same promotion as np.stack
+        stacked[..., channel] = np_data
+        del np_data
+        if profile is not None:
+            profile['concat'] += time.perf_counter() - start
+    return stacked, category_property
+
+
+def process_subject(subject_index: int, subject_file: subj.SubjectFile, categories: t.Iterable[str], load: load.Load,
+                    transform: tfm.Transform=None, concat_fn=default_concat, profile: bool=False) -> dict:
+    """Loads, concatenates and transforms the data of one subject.
+
+    If `profile` is True, the wall times of the stages ('load', 'concat' and 'transform') in seconds and the size of
+    the loaded files ('bytes_read') are added as dict to the parameters with key 'profile' (see
+    :class:`ProfileCallback`).
+
+    Args:
+        subject_index (int): The index of the subject.
+        subject_file (SubjectFile): The subject's files.
+        categories (iterable of str): The categories to load.
+        load (Load): The file loader.
+        transform (Transform): The transform applied to the loaded data.
+        concat_fn: The function concatenating the loaded data of a category.
+        profile (bool): Whether to profile the stages. Requires an additional file system access per loaded file.
+
+    Returns:
+        dict: The (transformed) parameters containing the data and image properties of each category.
+    """
+    stage_profile = {'load': 0., 'concat': 0., 'transform': 0., 'bytes_read': 0} if profile else None
+    transform_params = {'subject_index': subject_index}
+    for category in categories:
+
+        if concat_fn is default_concat:
+            category_data, category_property = _load_stacked(subject_file, category, load, stage_profile)
+        else:
+            category_list = []
+            category_property = None  # type: conv.ImageProperties
+            for id_, file_path in subject_file.categories[category].entries.items():
+                np_data, data_property = _load(load, file_path, id_, category, subject_file, stage_profile)
+                category_list.append(np_data)
+                if category_property is None:  # only required once
+                    category_property = data_property
+            start = time.perf_counter()
+            category_data = concat_fn(category_list)
+            if stage_profile is not None:
+                stage_profile['concat'] += time.perf_counter() - start
+
+        transform_params[category] = category_data
+        transform_params['{}_properties'.format(category)] = category_property
+
+    transform_params = _apply_transform(transform_params, transform, stage_profile)
+    if stage_profile is not None:
+        transform_params['profile'] = stage_profile
+    return transform_params
+
+
+def _apply_transform(params: dict, transform: tfm.Transform, profile: t.Union[dict, None]) -> dict:
+    if transform:
+        start = time.perf_counter()
+        params = transform(params)
+        if profile is not None:
+            profile['transform'] += time.perf_counter() - start
+    return params
+
+
+def _is_profiled(callback: cb.Callback) -> bool:
+    """Checks whether the callback is or contains a :class:`ProfileCallback`."""
+    if isinstance(callback, cb.ProfileCallback):
+        return True
+    if isinstance(callback, cb.ComposeCallback):
+        return any(_is_profiled(c) for c in callback.callbacks)
+    return False
+
+
 class SubjectFileTraverser(Traverser):
 
+    SYNCHRONOUS_STAGES = ('load', 'concat', 'transform')  # stages run by the traversing thread, i.e. not waited for
+
     def __init__(self, categories: t.Union[str, t.Tuple[str, ...]]=None):
         """Initializes a new instance of the SubjectFileTraverser class.
 
@@ -38,7 +157,23 @@ class SubjectFileTraverser(Traverser):
         self.categories = categories
 
     def traverse(self, subject_files: t.List[subj.SubjectFile], load=load.LoadDefault(), callback: cb.Callback=None,
-                 transform: tfm.Transform=None, concat_fn=default_concat):
+                 transform: tfm.Transform=None, concat_fn=default_concat, subject_index_offset: int=0,
+                 manifest: mf.BuildManifest=None):
+        """Traverses the subject files by loading, concatenating and transforming the data of each subject and passing
+        it to the callback.
+
+        Args:
+            subject_files (list of SubjectFile): The subject files.
+            load (Load): The file loader.
+            callback (Callback): The callback.
+            transform (Transform): The transform applied to the loaded data.
+            concat_fn: The function concatenating the loaded data of a category.
+            subject_index_offset (int): The number of subjects already in the dataset. The subjects are appended to
+                the existing subjects, i.e. their indices start at `subject_index_offset`. Use zero to create a new
+                dataset.
+            manifest (BuildManifest): The build manifest. If not None, the manifest is passed to the callbacks and
+                the subjects unchanged since the previous build are copied instead of loaded.
+        """
         if len(subject_files) == 0:
             raise ValueError('No files')
         if not isinstance(subject_files[0], subj.SubjectFile):
@@ -49,35 +184,62 @@ class SubjectFileTraverser(Traverser):
         if self.categories is None:
             self.categories = subject_files[0].categories
 
-        callback_params = {'subject_files': subject_files}
+        callback_params = {'subject_files': subject_files, 'subject_index_offset': subject_index_offset,
+                           'subject_count': subject_index_offset + len(subject_files)}
         for category in self.categories:
             callback_params.setdefault('categories', []).append(category)
             callback_params['{}_names'.format(category)] = self._get_names(subject_files, category)
+
+        unchanged = {}
+        if manifest is not None:
+            unchanged = manifest.prepare(subject_files, callback_params['categories'], load, transform, concat_fn)
+            callback_params['subject_hashes'] = manifest.subject_hashes
+            callback_params['build_fingerprint'] = manifest.fingerprint
         callback.on_start(callback_params)
 
-        # looping over the subject files and calling callbacks
-        for subject_index, subject_file in enumerate(subject_files):
-            transform_params = {'subject_index': subject_index}
-            for category in self.categories:
+        subjects = [(subject_index, subject_file) for subject_index, subject_file
+                    in enumerate(subject_files, subject_index_offset)
+                    if subject_index - subject_index_offset not in unchanged]
+        # the stages are only profiled if requested, since profiling accesses the file system for each loaded file
+        profile = _is_profiled(callback)
+        processed = self._process_subjects(subjects, load, transform, concat_fn, profile)
 
-                category_list = []
-                category_property = None  # type: conv.ImageProperties
-                for id_, file_path in subject_file.categories[category].entries.items():
-                    np_data, data_property = load(file_path, id_, category, subject_file.subject)
-                    category_list.append(np_data)
-                    if category_property is None:  # only required once
-                        category_property = data_property
+        # looping over the subject files and calling callbacks
+        try:
+            for subject_index in range(subject_index_offset, subject_index_offset + len(subject_files)):
+                if subject_index - subject_index_offset in unchanged:
+                    transform_params = manifest.load_previous(unchanged[subject_index - subject_index_offset],
+                                                              callback_params['categories'])
+                    transform_params['subject_index'] = subject_index
+                else:
+                    start = time.perf_counter()
+                    transform_params = next(processed)
+                    if profile:
+                        # the stages run by the traversing thread are profiled on their own
+                        stage_profile = transform_params['profile']
+                        own_time = sum(stage_profile[stage] for stage in self.SYNCHRONOUS_STAGES)
+                        stage_profile['wait'] = max(time.perf_counter() - start - own_time, 0.)
+                callback.on_subject({**transform_params, **callback_params})
+        finally:
+            processed.close()
+            if manifest is not None:
+                manifest.close()
 
-                category_data = concat_fn(category_list)
-                transform_params[category] = category_data
-                transform_params['{}_properties'.format(category)] = category_property
+        callback.on_end(callback_params)
 
-            if transform:
-                transform_params = transform(transform_params)
+    def _process_subjects(self, subjects: t.List[t.Tuple[int, subj.SubjectFile]], load: load.Load,
+                          transform: tfm.Transform, concat_fn, profile: bool=False) -> t.Iterator[dict]:
+        """Loads, concatenates and transforms the subjects in order.
 
-            callback.on_subject({**transform_params, **callback_params})
+        Args:
+            subjects (list of tuple): The subject indices and subject files to process.
+            profile (bool): Whether to profile the stages (see :func:`process_subject`).
 
-        callback.on_end(callback_params)
+        Returns:
+            Iterator[dict]: The transformed parameters of each subject, in the order of `subjects`.
+        """
+        for subject_index, subject_file in subjects:
+            yield process_subject(subject_index, subject_file, self.categories, load, transform, concat_fn, profile)
 
     @staticmethod
     def _get_names(subject_files: t.List[subj.SubjectFile], category: str) -> list:
@@ -85,3 +247,120 @@ class SubjectFileTraverser(Traverser):
         if not all(s.categories[category].entries.keys() == names for s in subject_files):
             raise ValueError('Inconsistent {} identifiers in the subject list'.format(category))
         return list(names)
+
+
+class ParallelSubjectFileTraverser(SubjectFileTraverser):
+    """Traverses the subject files with a pool of worker processes.
+
+    The workers load, concatenate and transform the subjects, while the callbacks are called in the traversing
+    process in the order of the subject files. Therefore, the writer is never accessed concurrently.
+    The load, transform and concat_fn arguments of :meth:`traverse` need to be picklable.
+    """
+
+    SYNCHRONOUS_STAGES = ()
+
+    def __init__(self, categories: t.Union[str, t.Tuple[str, ...]]=None, num_workers: int=None,
+                 max_in_flight: int=None):
+        """Initializes a new instance of the ParallelSubjectFileTraverser class.
+
+        Args:
+            categories (str or tuple of str): The categories to traverse. If None, then all categories of a SubjectFile
+                will be traversed.
+            num_workers (int): The number of worker processes. If None, the number of CPUs is used.
+            max_in_flight (int): The maximum number of subjects being processed or waiting to be passed to the
+                callbacks. Bounds the memory usage. If None, twice the number of workers is used.
+        """
+        super().__init__(categories)
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        if max_in_flight is None:
+            max_in_flight = 2 * num_workers
+        if num_workers < 1 or max_in_flight < 1:
+            raise ValueError('num_workers and max_in_flight must be at least 1')
+        self.num_workers = num_workers
+        self.max_in_flight = max_in_flight
+
+    def _process_subjects(self, subjects: t.List[t.Tuple[int, subj.SubjectFile]], load: load.Load,
+                          transform: tfm.Transform, concat_fn, profile: bool=False) -> t.Iterator[dict]:
+        categories = list(self.categories)
+        pending = collections.deque()
+        with cf.ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            try:
+                for subject_index, subject_file in subjects:
+                    if len(pending) >= self.max_in_flight:
+                        yield pending.popleft().result()
+                    pending.append(executor.submit(process_subject, subject_index, subject_file, categories, load,
+                                                   transform, concat_fn, profile))
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class PrefetchSubjectFileTraverser(SubjectFileTraverser):
+    """Traverses the subject files while loading the next subjects with background threads.
+
+    The files of the next subjects are loaded and concatenated by a pool of threads while the current subject is
+    transformed and passed to the callbacks in the traversing thread. This overlaps the file I/O with the
+    processing and writing. SimpleITK releases the GIL while reading, such that the load, transform and callbacks
+    effectively run concurrently. The load and concat_fn arguments of :meth:`traverse` need to be thread-safe.
+    """
+
+    SYNCHRONOUS_STAGES = ('transform',)
+
+    def __init__(self, categories: t.Union[str, t.Tuple[str, ...]]=None, prefetch_depth: int=2,
+                 num_threads: int=None, max_prefetch_bytes: int=None):
+        """Initializes a new instance of the PrefetchSubjectFileTraverser class.
+
+        Args:
+            categories (str or tuple of str): The categories to traverse. If None, then all categories of a SubjectFile
+                will be traversed.
+            prefetch_depth (int): The maximum number of subjects being loaded or waiting to be processed.
+            num_threads (int): The number of loading threads. If None, `prefetch_depth` threads are used.
+            max_prefetch_bytes (int): The maximum number of bytes of loaded subjects waiting to be processed. No more
+                subjects are prefetched when exceeded. Subjects still being loaded are not accounted for, i.e.
+                the bound can be exceeded by the subjects in flight. If None, only `prefetch_depth` applies.
+        """
+        super().__init__(categories)
+        if num_threads is None:
+            num_threads = prefetch_depth
+        if prefetch_depth < 1 or num_threads < 1:
+            raise ValueError('prefetch_depth and num_threads must be at least 1')
+        self.prefetch_depth = prefetch_depth
+        self.num_threads = num_threads
+        self.max_prefetch_bytes = max_prefetch_bytes
+
+    def _process_subjects(self, subjects: t.List[t.Tuple[int, subj.SubjectFile]], load: load.Load,
+                          transform: tfm.Transform, concat_fn, profile: bool=False) -> t.Iterator[dict]:
+        categories = list(self.categories)
+        pending = collections.deque()
+        with cf.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            try:
+                for subject_index, subject_file in subjects:
+                    while pending and (len(pending) >= self.prefetch_depth or self._is_memory_exceeded(pending)):
+                        yield self._transform(pending.popleft().result(), transform)
+                    pending.append(executor.submit(process_subject, subject_index, subject_file, categories, load,
+                                                   None, concat_fn, profile))
+                while pending:
+                    yield self._transform(pending.popleft().result(), transform)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _is_memory_exceeded(self, pending: t.Iterable[cf.Future]) -> bool:
+        if self.max_prefetch_bytes is None:
+            return False
+        loaded_bytes = 0
+        for future in pending:
+            if future.done() and future.exception() is None:
+                loaded_bytes += sum(v.nbytes for v in future.result().values() if isinstance(v, np.ndarray))
+        return loaded_bytes >= self.max_prefetch_bytes
+
+    @staticmethod
+    def _transform(params: dict, transform: tfm.Transform) -> dict:
+        profile = params.pop('profile', None)
+        params = _apply_transform(params, transform, profile)
+        if profile is not None:
+            params['profile'] = profile
+        return params
@@ -1,9 +1,12 @@
 import abc
 import os
+import typing as t
 
 import numpy as np
 import h5py
 
+import pymia.data.definition as df
+import pymia.data.directorystore as ds
 import pymia.data.indexexpression as expr
 
 
@@ -63,19 +66,168 @@ class Writer(metaclass=abc.ABCMeta):
         """
         pass
 
+    def has(self, entry: str) -> bool:
+        """Check whether a dataset entry exists.
+
+        Args:
+            entry(str): The dataset entry.
+
+        Returns:
+            bool: Whether the entry exists.
+        """
+        raise NotImplementedError('{} does not support reading'.format(self.__class__.__name__))
+
+    def read(self, entry: str, index: expr.IndexExpression=None):
+        """Read a previously written dataset entry.
+
+        Args:
+            entry(str): The dataset entry.
+            index(expr.IndexExpression): The slicing expression.
+
+        Returns:
+            The read data.
+        """
+        raise NotImplementedError('{} does not support reading'.format(self.__class__.__name__))
+
+    def resize(self, entry: str, shape: tuple):
+        """Resize a dataset entry, e.g. to append subjects. The data within the new shape is kept.
+
+        Args:
+            entry(str): The dataset entry to be resized.
+            shape(tuple): The new shape.
+        """
+        raise NotImplementedError('{} does not support resizing'.format(self.__class__.__name__))
+
+    def move(self, entry: str, new_entry: str):
+        """Rename a dataset entry.
+
+        Args:
+            entry(str): The dataset entry to be renamed.
+            new_entry(str): The new name of the entry.
+        """
+        raise NotImplementedError('{} does not support moving'.format(self.__class__.__name__))
+
+
+class StorageLayout:
+    """Represents the default storage layout, i.e. contiguous and uncompressed entries."""
+
+    def get_options(self, entry: str, shape: tuple, dtype=None) -> dict:
+        """Get the storage options of a dataset entry.
+
+        Args:
+            entry(str): The dataset entry to be created.
+            shape(tuple): The shape of the entry.
+            dtype: The dtype.
+
+        Returns:
+            dict: The storage options, i.e. the keyword arguments `chunks`, `compression`, `compression_opts` and
+            `shuffle` of :meth:`h5py.Group.create_dataset`.
+        """
+        return {}
+
+
+class ChunkedLayout(StorageLayout):
+    """Represents a chunked and optionally compressed storage layout of the data entries.
+
+    Examples:
+        Store one slice per chunk such that reading a slice-wise sample touches exactly one chunk:
+
+        >>> layout = ChunkedLayout.from_indexing_strategy(SliceIndexing(0), compression='lzf')
+        >>> writer = Hdf5Writer('/path/to/dataset.h5', layout=layout)
+    """
+
+    def __init__(self, chunk_shape: t.Tuple[t.Union[int, None], ...]=None, compression: str='gzip',
+                 compression_level: int=4, shuffle: bool=True, entry_prefix: str=df.DATA_PLACEHOLDER.format('')):
+        """Initializes a new instance of the ChunkedLayout class.
+
+        Args:
+            chunk_shape(tuple): The chunk shape. An axis with size None or an axis not part of the chunk shape is not
+                chunked (i.e. the chunk extends over the full axis). If None, the chunk shape is guessed by h5py.
+            compression(str): The compression filter ('gzip' or 'lzf'). None for no compression.
+            compression_level(int): The compression level for 'gzip' (0-9).
+            shuffle(bool): Whether to apply the shuffle filter, which improves the compression ratio.
+            entry_prefix(str): The layout is only applied to entries starting with this prefix (default the data
+                entries). Other entries are stored contiguous and uncompressed.
+        """
+        if compression not in (None, 'gzip', 'lzf'):
+            raise ValueError('unknown compression "{}"'.format(compression))
+        self.chunk_shape = chunk_shape
+        self.compression = compression
+        self.compression_level = compression_level
+        self.shuffle = shuffle
+        self.entry_prefix = entry_prefix
+
+    def get_chunks(self, shape: tuple) -> t.Union[tuple, bool]:
+        """Get the chunk shape of an entry.
+
+        Args:
+            shape(tuple): The shape of the entry.
+
+        Returns:
+            tuple or bool: The chunk shape, or True to let h5py guess the chunk shape.
+        """
+        if self.chunk_shape is None:
+            return True
+        chunks = list(shape)
+        for axis, size in enumerate(self.chunk_shape[:len(shape)]):
+            if size is not None:
+                chunks[axis] = min(size, shape[axis])
+        return tuple(chunks)
+
+    def get_options(self, entry: str, shape: tuple, dtype=None) -> dict:
+        # scalars and empty entries cannot be chunked
+        if not entry.startswith(self.entry_prefix) or len(shape) == 0 or 0 in shape:
+            return {}
+
+        options = {'chunks': self.get_chunks(shape), 'shuffle': self.shuffle}
+        if self.compression is not None:
+            options['compression'] = self.compression
+            if self.compression == 'gzip':
+                options['compression_opts'] = self.compression_level
+        return options
+
+    @classmethod
+    def from_indexing_strategy(cls, indexing_strategy, compression: str='gzip', compression_level: int=4,
+                               shuffle: bool=True) -> 'ChunkedLayout':
+        """Creates a layout whose chunks are aligned to the samples of an indexing strategy.
+
+        The chunk shape is given by :meth:`IndexingStrategy.get_chunk_shape`, i.e. one slice for
+        :class:`SliceIndexing` (along the first slice axis if multiple are given), one patch for
+        :class:`PatchWiseIndexing`, and the full volume for :class:`EmptyIndexing`.
+
+        Args:
+            indexing_strategy(IndexingStrategy): The indexing strategy used to extract the samples.
+            compression(str): The compression filter ('gzip' or 'lzf'). None for no compression.
+            compression_level(int): The compression level for 'gzip' (0-9).
+            shuffle(bool): Whether to apply the shuffle filter.
+
+        Returns:
+            ChunkedLayout: The layout.
+        """
+        # the strategy provides the chunk shape, such that the creation does not depend on the extraction package
+        chunk_shape = indexing_strategy.get_chunk_shape()
+        if chunk_shape is None:
+            raise ValueError('no chunk layout for indexing strategy {}'.format(indexing_strategy))
+        return cls(chunk_shape, compression, compression_level, shuffle)
+
 
 class Hdf5Writer(Writer):
     """Represents the dataset writer for HDF5 files."""
     str_type = h5py.special_dtype(vlen=str)
 
-    def __init__(self, file_path: str) -> None:
+    def __init__(self, file_path: str, layout: StorageLayout=None) -> None:
         """Initializes a new instance.
 
         Args:
             file_path(str): The path to the dataset file to write.
+            layout(StorageLayout): The storage layout (i.e. chunking and compression) of the entries.
+                If None, the entries are stored contiguous and uncompressed.
         """
         self.h5 = None  # type: h5py.File
         self.file_path = file_path
+        if layout is None:
+            layout = StorageLayout()
+        self.layout = layout
 
     def close(self):
         if self.h5 is not None:
@@ -83,13 +235,16 @@ class Hdf5Writer(Writer):
             self.h5 = None
 
     def open(self):
-        self.h5 = h5py.File(self.file_path, libver='latest')
+        self.h5 = h5py.File(self.file_path, mode='a', libver='latest')
 
     def reserve(self, entry: str, shape: tuple, dtype=None):
         # special string handling (in order not to use length limited strings)
         if dtype is str or dtype == 'str' or (isinstance(dtype, np.dtype) and dtype.type == np.str_):
             dtype = self.str_type
-        self.h5.create_dataset(entry, shape, dtype=dtype)
+        # reserved entries are resizable such that subjects can be appended
+        maxshape = (None,) * len(shape) if len(shape) > 0 else None
+        self.h5.create_dataset(entry, shape, dtype=dtype, maxshape=maxshape,
+                               **self.layout.get_options(entry, shape, dtype))
 
     def fill(self, entry: str, data, index: expr.IndexExpression=None):
         # special string handling (in order not to use length limited strings)
@@ -108,7 +263,137 @@ class Hdf5Writer(Writer):
             data = np.asarray(data, dtype=object)
         if entry in self.h5:
             del self.h5[entry]
-        self.h5.create_dataset(entry, dtype=dtype, data=data)
+        options = self.layout.get_options(entry, np.shape(data), dtype)
+        self.h5.create_dataset(entry, dtype=dtype, data=data, **options)
+
+    def has(self, entry: str) -> bool:
+        return entry in self.h5
+
+    def read(self, entry: str, index: expr.IndexExpression=None):
+        dataset = self.h5[entry]
+        if h5py.check_string_dtype(dataset.dtype) is not None and hasattr(dataset, 'asstr'):
+            dataset = dataset.asstr()  # h5py >= 3 returns bytes otherwise
+        data = dataset[()] if index is None else dataset[index.expression]
+        if isinstance(data, np.ndarray) and data.dtype == np.object:
+            return data.tolist()
+        return data
+
+    def resize(self, entry: str, shape: tuple):
+        dataset = self.h5[entry]
+        if dataset.chunks is not None and all(m is None or m >= s for m, s in zip(dataset.maxshape, shape)):
+            dataset.resize(shape)
+            return
+
+        # entries not created resizable are rewritten
+        data = dataset[()]
+        del self.h5[entry]
+        self.reserve(entry, shape, data.dtype)
+        overlap = tuple(slice(0, min(o, n)) for o, n in zip(data.shape, shape))
+        self.h5[entry][overlap] = data[overlap]
+
+    def move(self, entry: str, new_entry: str):
+        self.h5.move(entry, new_entry)
+
+
+class DirectoryStoreWriter(Writer):
+    """Represents the dataset writer for chunked directory stores (see :mod:`pymia.data.directorystore`).
+
+    Each chunk is stored in its own file, which allows multiple processes to read the dataset concurrently without
+    sharing a file handle. The chunk shape and compression are given by a :class:`StorageLayout`. The 'gzip' and
+    'lzf' compression filters are both mapped to zlib ('lzf' with level 1).
+    """
+
+    def __init__(self, file_path: str, layout: StorageLayout=None) -> None:
+        """Initializes a new instance.
+
+        Args:
+            file_path(str): The path to the dataset directory to write.
+            layout(StorageLayout): The storage layout (i.e. chunking and compression) of the entries.
+                If None, each data entry is stored in one zlib compressed chunk.
+        """
+        self.store = None  # type: ds.DirectoryStore
+        self.file_path = file_path
+        if layout is None:
+            layout = ChunkedLayout(chunk_shape=())
+        self.layout = layout
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def open(self):
+        self.store = ds.DirectoryStore(self.file_path, mode='a')
+        self.store.open()
+
+    def reserve(self, entry: str, shape: tuple, dtype=None):
+        self._create(entry, shape, dtype)
+
+    def fill(self, entry: str, data, index: expr.IndexExpression=None):
+        if index is None:
+            index = expr.IndexExpression()
+        self.store.write(entry, data, index.expression)
+
+    def write(self, entry: str, data, dtype=None):
+        if dtype is None:
+            dtype = np.asarray(data).dtype
+        self._create(entry, np.shape(data), dtype)
+        self.store.write(entry, data)
+
+    def has(self, entry: str) -> bool:
+        return self.store.has(entry)
+
+    def read(self, entry: str, index: expr.IndexExpression=None):
+        data = self.store.read(entry, None if index is None else index.expression)
+        if isinstance(data, np.ndarray) and data.dtype == np.object:
+            return data.tolist()
+        return data
+
+    def resize(self, entry: str, shape: tuple):
+        self.store.resize(entry, shape)
+
+    def move(self, entry: str, new_entry: str):
+        self.store.move(entry, new_entry)
+
+    def _create(self, entry: str, shape: tuple, dtype):
+        # special string handling (in order not to use length limited strings)
+        if dtype is str or dtype == 'str' or np.dtype(dtype).type in (np.str_, np.object_):
+            self.store.create(entry, shape, ds.STRING_DTYPE)
+            return
+
+        options = self.layout.get_options(entry, shape, dtype)
+        chunks = options.get('chunks')
+        if not isinstance(chunks, tuple):
+            chunks = None  # no guessing of the chunk shape, one chunk per entry
+
+        compression = options.get('compression')
+        if compression == 'gzip':
+            compression_level = options.get('compression_opts', 4)
+        elif compression == 'lzf':
+            compression_level = 1
+        else:
+            compression_level = None
+        self.store.create(entry, shape, dtype, chunks, compression_level, options.get('shuffle', False))
+
+
+class NpyMemmapWriter(DirectoryStoreWriter):
+    """Represents the dataset writer for memory mapped NumPy directories (see :mod:`pymia.data.directorystore`).
+
+    Each numeric entry is stored as raw .npy file and the remaining metadata in a JSON sidecar. The entries are
+    neither chunked nor compressed.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        """Initializes a new instance.
+
+        Args:
+            file_path(str): The path to the dataset directory to write.
+        """
+        super().__init__(file_path, StorageLayout())
+
+    def open(self):
+        self.store = ds.NpyMemmapStore(self.file_path, mode='a')
+        self.store.open()
 
 
 def get_writer(file_path: str) -> Writer:
@@ -120,11 +405,12 @@ def get_writer(file_path: str) -> Writer:
         Returns:
             Writer: Writer corresponding to dataset file extension.
         """
-    extension = os.path.splitext(file_path)[1]
+    extension = os.path.splitext(file_path.rstrip('/\\'))[1]
     if extension not in writer_registry:
         raise ValueError('unknown dataset file extension "{}"'.format(extension))
 
     return writer_registry[extension](file_path)
 
 
-writer_registry = {'.h5': Hdf5Writer, '.hdf5': Hdf5Writer}
+writer_registry = {'.h5': Hdf5Writer, '.hdf5': Hdf5Writer, '.pymia': DirectoryStoreWriter,
+                   '.npmm': NpyMemmapWriter}
@@ -19,8 +19,30 @@ FILES_ROOT = 'meta/files/file_root'
 
 SUBJECT = 'meta/subjects'
 
+STATISTICS_PLACEHOLDER = 'meta/statistics/{}/{}'  # category and statistic, e.g. 'meta/statistics/images/mean'
+FOREGROUND_PLACEHOLDER = 'meta/foreground/{}/{}'  # category and entry, e.g. 'meta/foreground/labels/counts'
+QUANTIZATION_PLACEHOLDER = 'meta/quantization/{}/{}'  # category and 'scale' or 'offset'
+PYRAMID_INFO_PLACEHOLDER = 'meta/pyramid/{}/{}'  # factor and 'shapes', 'origins' or 'spacing'
+
+DATA_SHAPES_PLACEHOLDER = 'meta/data/{}/shapes'  # category, the shape of each subject entry
+DATA_ENTRIES_PLACEHOLDER = 'meta/data/{}/entries'  # category, the name of each subject entry
+
+BUILD_FINGERPRINT = 'meta/build/fingerprint'
+BUILD_SUBJECT_HASHES = 'meta/build/subject_hashes'
+
+# entries of the meta group with one row per subject (wildcards as in fnmatch)
+SUBJECT_META_ENTRIES = (SUBJECT, INFO_SHAPE, INFO_ORIGIN, INFO_DIRECTION, INFO_SPACING, FILES_PLACEHOLDER.format('*'),
+                        BUILD_SUBJECT_HASHES, STATISTICS_PLACEHOLDER.format('*', 'subject_*'),
+                        FOREGROUND_PLACEHOLDER.format('*', 'bbox'), FOREGROUND_PLACEHOLDER.format('*', 'counts'),
+                        QUANTIZATION_PLACEHOLDER.format('*', 'scale'), QUANTIZATION_PLACEHOLDER.format('*', 'offset'),
+                        PYRAMID_INFO_PLACEHOLDER.format('*', '*'), DATA_SHAPES_PLACEHOLDER.format('*'))
+
 # DATA = 'data'
 DATA_PLACEHOLDER = 'data/{}'
+PYRAMID_PLACEHOLDER = 'pyramid/{}/{}'  # factor and category, e.g. 'pyramid/2/images'
 # DATA_IMAGE = '{}/images'.format(DATA)
 # DATA_LABEL = '{}/labels'.format(DATA)
 
+# groups with one entry per subject, named like the subject entries (wildcards as in fnmatch)
+SUBJECT_ENTRY_GROUPS = (DATA_PLACEHOLDER.format('*'), PYRAMID_PLACEHOLDER.format('*', '*'),
+                        FOREGROUND_PLACEHOLDER.format('*', 'slice_counts'))
@@ -0,0 +1,447 @@
+"""This module holds the directory stores used by the directory dataset readers and writers.
+
+A directory store is a directory holding a JSON index with the shape, dtype and storage layout of every entry.
+The :class:`DirectoryStore` stores the data of numeric entries in one (optionally compressed) file per chunk, such that
+independent processes can read different chunks without any shared file handle or library lock.
+The :class:`NpyMemmapStore` stores each numeric entry in a raw .npy file, which is read as memory map.
+"""
+import collections
+import itertools
+import json
+import os
+import typing as t
+import zlib
+
+import numpy as np
+
+import pymia.data.filecache as fc
+
+INDEX_FILE = 'index.json'
+STRING_FILE = 'values.json'
+STRING_DTYPE = 'str'
+
+
+def normalize_expression(expression, shape: tuple) -> t.Tuple[t.List[int], t.List[int], t.List[int]]:
+    """Converts a slicing expression to the start and stop of each axis.
+
+    Args:
+        expression: The slicing expression (see :attr:`IndexExpression.expression`).
+        shape(tuple): The shape of the sliced array.
+
+    Returns:
+        tuple: The starts and stops of the region, and the axes indexed by an integer (which are removed by slicing).
+    """
+    if not isinstance(expression, tuple):
+        expression = (expression,)
+    if len(expression) > len(shape):
+        raise IndexError('too many indices for shape {}'.format(shape))
+
+    starts, stops, int_axes = [], [], []
+    for axis, size in enumerate(shape):
+        index = expression[axis] if axis < len(expression) else slice(None)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(size)
+            if step != 1:
+                raise ValueError('only slices with step 1 are supported')
+            stop = max(start, stop)
+        else:
+            start = int(index) + size if index < 0 else int(index)
+            if not 0 <= start < size:
+                raise IndexError('index {} is out of bounds for axis {} with size {}'.format(index, axis, size))
+            stop = start + 1
+            int_axes.append(axis)
+        starts.append(start)
+        stops.append(stop)
+    return starts, stops, int_axes
+
+
+class DirectoryStore:
+    """Represents a chunked array store in a directory."""
+
+    def __init__(self, root: str, mode: str='r') -> None:
+        """Initializes a new instance of the DirectoryStore class.
+
+        Args:
+            root(str): The path of the store directory.
+            mode(str): 'r' to read or 'a' to read and write (the store is created if it does not exist).
+        """
+        if mode not in ('r', 'a'):
+            raise ValueError('unknown mode "{}"'.format(mode))
+        self.root = root
+        self.mode = mode
+        self.entries = {}
+        self.strings = {}  # cached values of the string entries
+        self.dirty_strings = set()
+
+    def open(self):
+        index_path = os.path.join(self.root, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                self.entries = json.load(f)
+        elif self.mode == 'r':
+            raise FileNotFoundError('no directory store at "{}"'.format(self.root))
+        else:
+            os.makedirs(self.root, exist_ok=True)
+            self.entries = {}
+
+    def close(self):
+        if self.mode == 'a':
+            self.flush()
+        self.entries = {}
+        self.strings = {}
+
+    def flush(self):
+        """Writes the string entries and the index to disk."""
+        for entry in self.dirty_strings:
+            if entry in self.entries:
+                self._write_file(os.path.join(self._entry_dir(entry), STRING_FILE),
+                                 json.dumps(self.strings[entry].tolist()).encode())
+        self.dirty_strings.clear()
+        self._write_file(os.path.join(self.root, INDEX_FILE), json.dumps(self.entries, indent=1).encode())
+
+    def has(self, entry: str) -> bool:
+        """Check whether an entry or group exists."""
+        entry = entry.strip('/')
+        return entry in self.entries or any(e.startswith(entry + '/') for e in self.entries)
+
+    def keys(self, group: str) -> list:
+        """Get the names of the entries and groups directly below a group."""
+        prefix = group.strip('/') + '/'
+        return list({e[len(prefix):].split('/', 1)[0] for e in self.entries if e.startswith(prefix)})
+
+    def get_shape(self, entry: str) -> tuple:
+        return tuple(self.entries[entry]['shape'])
+
+    def create(self, entry: str, shape: tuple, dtype, chunks: tuple=None, compression_level: int=None,
+               shuffle: bool=False):
+        """Create an entry.
+
+        Args:
+            entry(str): The entry to be created. An existing entry is replaced.
+            shape(tuple): The shape of the entry.
+            dtype: The dtype, or 'str' for strings.
+            chunks(tuple): The chunk shape. If None, the entry is stored in one chunk. Axes not part of the chunk shape
+                are not chunked.
+            compression_level(int): The zlib compression level. None for no compression.
+            shuffle(bool): Whether to shuffle the bytes before compressing.
+        """
+        if entry in self.entries:
+            self.delete(entry)
+        shape = tuple(int(s) for s in shape)
+        if dtype == STRING_DTYPE:
+            self.strings[entry] = np.full(shape, '', dtype=object)
+            self.dirty_strings.add(entry)
+            dtype_str = STRING_DTYPE
+        else:
+            dtype_str = np.dtype(dtype).str
+        if chunks is None:
+            chunks = shape
+        # axes not part of the chunk shape are not chunked
+        chunks = tuple(max(1, min(int(c), s)) for c, s in zip(chunks, shape)) + shape[len(chunks):]
+
+        self.entries[entry] = {'shape': shape, 'dtype': dtype_str, 'chunks': chunks,
+                               'compression_level': compression_level, 'shuffle': shuffle}
+        os.makedirs(self._entry_dir(entry), exist_ok=True)
+
+    def delete(self, entry: str):
+        entry_dir = self._entry_dir(entry)
+        file_names = [f for f in os.listdir(entry_dir) if os.path.isfile(os.path.join(entry_dir, f))] \
+            if os.path.isdir(entry_dir) else []
+        for file_name in file_names:
+            os.remove(os.path.join(entry_dir, file_name))
+        del self.entries[entry]
+        self.strings.pop(entry, None)
+        self.dirty_strings.discard(entry)
+
+    def resize(self, entry: str, shape: tuple):
+        """Resize an entry. The overlapping data is kept and new elements are filled with zeros or empty strings."""
+        info = self.entries[entry]
+        shape = tuple(int(s) for s in shape)
+        if info['dtype'] == STRING_DTYPE:
+            old = self._get_strings(entry)
+            new = np.full(shape, '', dtype=object)
+            overlap = tuple(slice(0, min(o, n)) for o, n in zip(old.shape, shape))
+            new[overlap] = old[overlap]
+            self.strings[entry] = new
+            self.dirty_strings.add(entry)
+            info['shape'] = shape
+            return
+
+        # chunks at the border are truncated to the shape of the entry, hence the entry is rewritten
+        old = np.array(self.read(entry))
+        self.create(entry, shape, info['dtype'], info.get('chunks'), info.get('compression_level'),
+                    info.get('shuffle', False))
+        overlap = tuple(slice(0, min(o, n)) for o, n in zip(old.shape, shape))
+        self.write(entry, old[overlap], overlap)
+
+    def move(self, entry: str, new_entry: str):
+        """Rename an entry."""
+        self._move_files(entry, new_entry)
+        self.entries[new_entry] = self.entries.pop(entry)
+        if entry in self.strings:
+            self.strings[new_entry] = self.strings.pop(entry)
+        if entry in self.dirty_strings:
+            self.dirty_strings.discard(entry)
+            self.dirty_strings.add(new_entry)
+
+    def _move_files(self, entry: str, new_entry: str):
+        new_dir = self._entry_dir(new_entry)
+        os.makedirs(os.path.dirname(new_dir), exist_ok=True)
+        os.replace(self._entry_dir(entry), new_dir)
+
+    def read(self, entry: str, expression=None):
+        """Read (a region of) an entry.
+
+        Args:
+            entry(str): The entry.
+            expression: The slicing expression. If None, the full entry is read.
+
+        Returns:
+            np.ndarray: The data. Scalars are returned as numpy scalars.
+        """
+        info = self.entries[entry]
+        shape = tuple(info['shape'])
+        if expression is None:
+            expression = ()
+
+        if info['dtype'] == STRING_DTYPE:
+            return self._get_strings(entry)[expression]
+
+        starts, stops, int_axes = normalize_expression(expression, shape)
+        data = np.zeros([stop - start for start, stop in zip(starts, stops)], dtype=np.dtype(info['dtype']))
+        for chunk_index, chunk_slicing, region_slicing in self._iter_chunks(info, starts, stops):
+            chunk = self._read_chunk(entry, info, chunk_index)
+            if chunk is not None:
+                data[region_slicing] = chunk[chunk_slicing]
+        data = data.squeeze(axis=tuple(int_axes)) if int_axes else data
+        return data[()] if data.ndim == 0 else data
+
+    def write(self, entry: str, data, expression=None):
+        """Write data to (a region of) an existing entry.
+
+        Args:
+            entry(str): The entry.
+            data: The data to write. Is broadcast to the shape of the region.
+            expression: The slicing expression. If None, the full entry is written.
+        """
+        info = self.entries[entry]
+        shape = tuple(info['shape'])
+        if expression is None:
+            expression = ()
+
+        if info['dtype'] == STRING_DTYPE:
+            data = np.asarray(data, dtype=object)
+            self._get_strings(entry)[expression] = data[()] if data.ndim == 0 else data
+            self.dirty_strings.add(entry)
+            return
+
+        starts, stops, int_axes = normalize_expression(expression, shape)
+        region_shape = [stop - start for start, stop in zip(starts, stops)]
+        squeezed_shape = [s for a, s in enumerate(region_shape) if a not in int_axes]
+        data = np.broadcast_to(np.asarray(data, dtype=np.dtype(info['dtype'])), squeezed_shape).reshape(region_shape)
+
+        for chunk_index, chunk_slicing, region_slicing in self._iter_chunks(info, starts, stops):
+            chunk_shape = self._get_chunk_shape(info, chunk_index)
+            if all(s.stop - s.start == c for s, c in zip(chunk_slicing, chunk_shape)):
+                chunk = data[region_slicing]  # chunk is fully overwritten
+            else:
+                chunk = self._read_chunk(entry, info, chunk_index)
+                chunk = np.zeros(chunk_shape, dtype=data.dtype) if chunk is None else chunk.copy()
+                chunk[chunk_slicing] = data[region_slicing]
+            self._write_chunk(entry, info, chunk_index, chunk)
+
+    def _get_strings(self, entry: str) -> np.ndarray:
+        if entry not in self.strings:
+            with open(os.path.join(self._entry_dir(entry), STRING_FILE), 'r') as f:
+                values = json.load(f)
+            strings = np.empty(tuple(self.entries[entry]['shape']), dtype=object)
+            strings[()] = values if strings.ndim == 0 else np.array(values, dtype=object)
+            self.strings[entry] = strings
+        return self.strings[entry]
+
+    def _entry_dir(self, entry: str) -> str:
+        return os.path.join(self.root, *entry.strip('/').split('/'))
+
+    @staticmethod
+    def _get_chunk_shape(info: dict, chunk_index: tuple) -> tuple:
+        # chunks at the border are truncated to the shape of the entry
+        return tuple(min(c, s - i * c) for i, c, s in zip(chunk_index, info['chunks'], info['shape']))
+
+    @staticmethod
+    def _iter_chunks(info: dict, starts: list, stops: list):
+        """Yields the chunks overlapping a region with the overlap's slicing in chunk and region coordinates."""
+        chunks = info['chunks']
+        if any(start == stop for start, stop in zip(starts, stops)):
+            return
+        ranges = [range(start // c, (stop - 1) // c + 1) for start, stop, c in zip(starts, stops, chunks)]
+        for chunk_index in itertools.product(*ranges):
+            chunk_slicing, region_slicing = [], []
+            for i, c, start, stop in zip(chunk_index, chunks, starts, stops):
+                lower, upper = max(start, i * c), min(stop, (i + 1) * c)
+                chunk_slicing.append(slice(lower - i * c, upper - i * c))
+                region_slicing.append(slice(lower - start, upper - start))
+            yield chunk_index, tuple(chunk_slicing), tuple(region_slicing)
+
+    def _chunk_path(self, entry: str, chunk_index: tuple) -> str:
+        name = '.'.join(str(i) for i in chunk_index) if len(chunk_index) > 0 else '0'
+        return os.path.join(self._entry_dir(entry), name)
+
+    def _read_chunk(self, entry: str, info: dict, chunk_index: tuple) -> t.Union[np.ndarray, None]:
+        path = self._chunk_path(entry, chunk_index)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            buffer = f.read()
+
+        dtype = np.dtype(info['dtype'])
+        if info['compression_level'] is not None:
+            buffer = zlib.decompress(buffer)
+        if info['shuffle'] and dtype.itemsize > 1:
+            buffer = np.frombuffer(buffer, np.uint8).reshape(dtype.itemsize, -1).T.tobytes()
+        return np.frombuffer(buffer, dtype=dtype).reshape(self._get_chunk_shape(info, chunk_index))
+
+    def _write_chunk(self, entry: str, info: dict, chunk_index: tuple, chunk: np.ndarray):
+        dtype = np.dtype(info['dtype'])
+        buffer = np.ascontiguousarray(chunk, dtype=dtype).tobytes()
+        if info['shuffle'] and dtype.itemsize > 1:
+            buffer = np.frombuffer(buffer, np.uint8).reshape(-1, dtype.itemsize).T.tobytes()
+        if info['compression_level'] is not None:
+            buffer = zlib.compress(buffer, info['compression_level'])
+        self._write_file(self._chunk_path(entry, chunk_index), buffer)
+
+    @staticmethod
+    def _write_file(path: str, buffer: bytes):
+        fc.write_atomic(path, lambda f: f.write(buffer))
+
+
+class NpyMemmapStore(DirectoryStore):
+    """Represents an array store in a directory holding one raw .npy file per numeric entry.
+
+    The numeric entries are read as memory maps, i.e. without decoding or copying. The shapes and dtypes of the
+    entries as well as the string entries are stored in a JSON sidecar (the index).
+
+    Every memory map holds a file descriptor. Therefore, the memory maps written to are closed after each write and
+    only the `MAX_MEMMAPS` most recently read are kept open, such that stores with many entries do not exceed the
+    limit of open files.
+    """
+
+    MAX_MEMMAPS = 64  # number of memory maps kept open for reading
+
+    def __init__(self, root: str, mode: str='r') -> None:
+        super().__init__(root, mode)
+        self.memmaps = collections.OrderedDict()  # least recently read first
+
+    def close(self):
+        super().close()
+        self.memmaps = collections.OrderedDict()
+
+    def flush(self):
+        for entry in self.dirty_strings:
+            if entry in self.entries:
+                self.entries[entry]['values'] = self.strings[entry].tolist()
+        self.dirty_strings.clear()
+        self._write_file(os.path.join(self.root, INDEX_FILE), json.dumps(self.entries).encode())
+
+    def create(self, entry: str, shape: tuple, dtype, chunks: tuple=None, compression_level: int=None,
+               shuffle: bool=False):
+        """Create an entry. The chunk and compression arguments are ignored, since the entries are stored raw."""
+        if entry in self.entries:
+            self.delete(entry)
+        shape = tuple(int(s) for s in shape)
+        if dtype == STRING_DTYPE:
+            self.strings[entry] = np.full(shape, '', dtype=object)
+            self.dirty_strings.add(entry)
+            self.entries[entry] = {'shape': shape, 'dtype': STRING_DTYPE}
+            return
+
+        dtype = np.dtype(dtype)
+        os.makedirs(os.path.dirname(self._entry_path(entry)), exist_ok=True)
+        self.memmaps.pop(entry, None)
+        if len(shape) > 0 and 0 not in shape:
+            # creates the file, the memory map is not kept and thus closed right away
+            np.lib.format.open_memmap(self._entry_path(entry), mode='w+', dtype=dtype, shape=shape)
+        else:
+            # scalar and empty arrays cannot be memory mapped
+            np.save(self._entry_path(entry), np.zeros(shape, dtype=dtype))
+        self.entries[entry] = {'shape': shape, 'dtype': dtype.str}
+
+    def delete(self, entry: str):
+        memmap = self.memmaps.pop(entry, None)
+        del memmap  # close the memory map before removing the file
+        if os.path.exists(self._entry_path(entry)):
+            os.remove(self._entry_path(entry))
+        del self.entries[entry]
+        self.strings.pop(entry, None)
+        self.dirty_strings.discard(entry)
+
+    def read(self, entry: str, expression=None):
+        """Read (a region of) an entry.
+
+        Args:
+            entry(str): The entry.
+            expression: The slicing expression. If None, the full entry is read.
+
+        Returns:
+            np.ndarray: A read-only view of the memory mapped entry. Scalars are returned as numpy scalars.
+        """
+        if expression is None:
+            expression = ()
+        if self.entries[entry]['dtype'] == STRING_DTYPE:
+            return self._get_strings(entry)[expression]
+
+        data = self._get_memmap(entry)[expression]
+        return data[()] if data.ndim == 0 else data
+
+    def write(self, entry: str, data, expression=None):
+        if expression is None:
+            expression = ()
+        if self.entries[entry]['dtype'] == STRING_DTYPE:
+            super().write(entry, data, expression)
+            return
+        if not self._is_mappable(entry):
+            array = self._get_memmap(entry)
+            array[expression] = data
+            np.save(self._entry_path(entry), array)
+            return
+        # the memory maps read share the written pages, i.e. they do not need to be reopened
+        memmap = np.load(self._entry_path(entry), mmap_mode='r+')
+        memmap[expression] = data
+        del memmap  # closes the memory map and its file descriptor
+
+    def _get_memmap(self, entry: str) -> np.ndarray:
+        if entry in self.memmaps:
+            self.memmaps.move_to_end(entry)
+            return self.memmaps[entry]
+
+        if self._is_mappable(entry):
+            memmap = np.load(self._entry_path(entry), mmap_mode='r')
+        else:
+            # scalar and empty arrays cannot be memory mapped
+            memmap = np.load(self._entry_path(entry))
+            memmap.flags.writeable = self.mode == 'a'
+        self.memmaps[entry] = memmap
+        while len(self.memmaps) > self.MAX_MEMMAPS:
+            self.memmaps.popitem(last=False)  # views still in use keep their memory map open
+        return memmap
+
+    def _is_mappable(self, entry: str) -> bool:
+        shape = self.entries[entry]['shape']
+        return len(shape) > 0 and 0 not in shape
+
+    def _get_strings(self, entry: str) -> np.ndarray:
+        if entry not in self.strings:
+            strings = np.empty(tuple(self.entries[entry]['shape']), dtype=object)
+            values = self.entries[entry]['values']
+            strings[()] = values if strings.ndim == 0 else np.array(values, dtype=object)
+            self.strings[entry] = strings
+        return self.strings[entry]
+
+    def _move_files(self, entry: str, new_entry: str):
+        self.memmaps.pop(entry, None)
+        if self.entries[entry]['dtype'] != STRING_DTYPE:
+            new_path = self._entry_path(new_entry)
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.replace(self._entry_path(entry), new_path)
+
+    def _entry_path(self, entry: str) -> str:
+        return self._entry_dir(entry) + '.npy'
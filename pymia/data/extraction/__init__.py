@@ -1,11 +1,16 @@
-from .reader import (Reader, Hdf5Reader, get_reader)
-from .indexing import (IndexingStrategy, SliceIndexing, VoxelWiseIndexing, EmptyIndexing, PatchWiseIndexing)
+from .reader import (Reader, Hdf5Reader, DirectoryStoreReader, NpyMemmapReader, ShardedReader, InMemoryReader,
+                     get_reader)
+from .indexing import (IndexingStrategy, SliceIndexing, VoxelWiseIndexing, EmptyIndexing, PatchWiseIndexing,
+                       IndexTable)
 from .dataset import ParameterizableDataset
+from .sharedcache import (SharedVolumeCache, get_shared_memory_dir)
 from .extractor import (Extractor, DataExtractor, FilesExtractor, NamesExtractor, SubjectExtractor, IndexingExtractor,
                         SelectiveDataExtractor, RandomDataExtractor, ComposeExtractor,
-                        ImagePropertiesExtractor, PadPatchDataExtractor, ImageShapeExtractor)
+                        ImagePropertiesExtractor, PadPatchDataExtractor, ImageShapeExtractor, StatisticsExtractor,
+                        ForegroundExtractor, QuantizationExtractor)
 from .sample import (select_indices, SubsetSequentialSampler, NonBlackSelection, SelectionStrategy, ComposeSelection,
-                     SubjectSelection, WithForegroundSelection, PercentileSelection, NonConstantSelection)
+                     SubjectSelection, WithForegroundSelection, PercentileSelection, NonConstantSelection,
+                     select_foreground_indices)
 
 # pytorch class forwarding
 from torch.utils.data.sampler import (WeightedRandomSampler,SequentialSampler,Sampler, RandomSampler, BatchSampler,
@@ -1,3 +1,11 @@
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import typing as t
+import warnings
+
 import torch.utils.data.dataset as data
 
 import pymia.data.transformation as tfm
@@ -5,19 +13,31 @@ import pymia.data.indexexpression as expr
 from . import reader as rd
 from . import indexing as idx
 from . import extractor as extr
+from . import sharedcache as shc
 
 
 class ParameterizableDataset(data.Dataset):
 
     def __init__(self, dataset_path: str, indexing_strategy: idx.IndexingStrategy=None, extractor: extr.Extractor=None,
-                 transform: tfm.Transform=None, subject_subset: list=None, init_reader_once=True) -> None:
+                 transform: tfm.Transform=None, subject_subset: list=None, init_reader_once=True,
+                 dequantize: bool=True, cache_bytes: int=0, in_memory: bool=False,
+                 shared_cache: shc.SharedVolumeCache=None, index_cache_dir: str=None, batch_reads: bool=False) -> None:
         self.dataset_path = dataset_path
         self.indexing_strategy = None
         self.extractor = extractor
         self.transform = transform
         self.subject_subset = subject_subset
+        if not init_reader_once and (cache_bytes or in_memory):
+            # the reader and thus its volumes would be discarded after each sample
+            raise ValueError('cache_bytes and in_memory require init_reader_once')
         self.init_reader_once = init_reader_once
-        self.indices = []
+        self.dequantize = dequantize
+        self.cache_bytes = cache_bytes
+        self.in_memory = in_memory
+        self.shared_cache = shared_cache
+        self.index_cache_dir = index_cache_dir
+        self.batch_reads = batch_reads
+        self.indices = None  # type: idx.IndexTable
         self.reader = None
 
         # init indices
@@ -34,15 +54,39 @@ class ParameterizableDataset(data.Dataset):
         self.extractor = extractor
 
     def set_indexing_strategy(self, indexing_strategy: idx.IndexingStrategy, subject_subset: list=None):
-        self.indices.clear()
         self.indexing_strategy = indexing_strategy
+        cache_path = None
+        if self.index_cache_dir is not None:
+            cache_path = self._get_index_cache_path(indexing_strategy, subject_subset)
+            if cache_path is not None and os.path.isfile(cache_path):
+                self.indices = idx.IndexTable.load(cache_path, indexing_strategy)
+                return
+
+        self.indices = idx.IndexTable(indexing_strategy)
         with rd.get_reader(self.dataset_path) as reader:
             all_subjects = reader.get_subjects()
-            for i, subject in enumerate(reader.get_subject_entries()):
+            for i, shape in enumerate(reader.get_all_shapes()):
                 if subject_subset is None or all_subjects[i] in subject_subset:
-                    subject_indices = self.indexing_strategy(reader.get_shape(subject))
-                    subject_and_indices = zip(len(subject_indices) * [i], subject_indices)
-                    self.indices.extend(subject_and_indices)
+                    self.indices.append(i, shape)
+        if cache_path is not None:
+            self.indices.save(cache_path)
+
+    def _get_index_cache_path(self, indexing_strategy: idx.IndexingStrategy, subject_subset: list=None) -> str:
+        # the key identifies the dataset file by its path, size and modification time, the indexing strategy by
+        # its class and parameters, and the format of the saved table
+        stat = os.stat(self.dataset_path)
+        subjects = None if subject_subset is None else sorted(str(subject) for subject in subject_subset)
+        strategy_class = type(indexing_strategy)
+        try:
+            key = json.dumps([os.path.abspath(self.dataset_path), stat.st_size, stat.st_mtime_ns,
+                              '{}.{}'.format(strategy_class.__module__, strategy_class.__qualname__),
+                              indexing_strategy.get_parameters(), subjects, idx.IndexTable.FORMAT_VERSION],
+                             sort_keys=True)
+        except TypeError as e:
+            warnings.warn('index table is not cached, since the parameters of the indexing strategy are not JSON '
+                          'serializable ({})'.format(e))
+            return None
+        return os.path.join(self.index_cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz')
 
     def set_transform(self, transform: tfm.Transform):
         self.transform = transform
@@ -58,20 +102,58 @@ class ParameterizableDataset(data.Dataset):
 
         params = {'subject_index': subject_index, 'index_expr': index_expr}
         extracted = {}
-
-        if not self.init_reader_once:
-            with rd.get_reader(self.dataset_path) as reader:
-                extractor.extract(reader, params, extracted)
-        else:
-            if self.reader is None:
-                self.reader = rd.get_reader(self.dataset_path, direct_open=True)
-            extractor.extract(self.reader, params, extracted)
+        with self._get_reader() as reader:
+            extractor.extract(reader, params, extracted)
 
         if transform:
             extracted = transform(extracted)
 
         return extracted
 
+    def direct_extract_batch(self, extractor: extr.Extractor, subject_index: int,
+                             index_exprs: t.List[expr.IndexExpression], transform: tfm.Transform=None) -> t.List[dict]:
+        """Extracts multiple samples of a subject, reading the bounding region of the samples once per data entry
+        (see :meth:`Reader.batch`) instead of once per sample.
+
+        Args:
+            extractor (Extractor): The extractor.
+            subject_index (int): The index of the subject.
+            index_exprs (list of IndexExpression): The index expressions of the samples.
+            transform (Transform): The transform applied to each sample.
+
+        Returns:
+            list: The extracted samples.
+        """
+        with self._get_reader() as reader:
+            return self._extract_batch(reader, extractor, subject_index, index_exprs, transform)
+
+    @contextlib.contextmanager
+    def _get_reader(self):
+        if not self.init_reader_once:
+            with rd.get_reader(self.dataset_path, dequantize=self.dequantize,
+                               shared_cache=self.shared_cache) as reader:
+                yield reader
+            return
+
+        if self.reader is None:
+            self.reader = rd.get_reader(self.dataset_path, direct_open=True, dequantize=self.dequantize,
+                                        cache_bytes=self.cache_bytes, in_memory=self.in_memory,
+                                        shared_cache=self.shared_cache)
+        yield self.reader
+
+    @staticmethod
+    def _extract_batch(reader: rd.Reader, extractor: extr.Extractor, subject_index: int,
+                       index_exprs: t.List[expr.IndexExpression], transform: tfm.Transform=None) -> t.List[dict]:
+        samples = []
+        with reader.batch(index_exprs):
+            for index_expr in index_exprs:
+                extracted = {}
+                extractor.extract(reader, {'subject_index': subject_index, 'index_expr': index_expr}, extracted)
+                if transform:
+                    extracted = transform(extracted)
+                samples.append(extracted)
+        return samples
+
     def __len__(self):
         return len(self.indices)
 
@@ -79,5 +161,34 @@ class ParameterizableDataset(data.Dataset):
         subject_index, index_expr = self.indices[item]
         return self.direct_extract(self.extractor, subject_index, index_expr, self.transform)
 
+    def __getitems__(self, items: t.List[int]) -> t.List[dict]:
+        """Get the samples of a batch (used by the :class:`torch.utils.data.DataLoader` instead of
+        :meth:`__getitem__`). If `batch_reads` is enabled, the samples are grouped by subject and extracted with
+        :meth:`direct_extract_batch`, which pays off for nearby samples (e.g. consecutive slices of a sequential
+        sampler). Otherwise, the samples are extracted one by one.
+
+        Args:
+            items (list of int): The indices of the samples.
+
+        Returns:
+            list: The samples in the order of the indices.
+        """
+        if not self.batch_reads:
+            return [self[item] for item in items]
+
+        items_by_subject = collections.OrderedDict()
+        for position, item in enumerate(items):
+            subject_index, index_expr = self.indices[item]
+            items_by_subject.setdefault(subject_index, []).append((position, index_expr))
+
+        samples = [None] * len(items)
+        for subject_index, subject_items in items_by_subject.items():
+            subject_samples = self.direct_extract_batch(self.extractor, subject_index,
+                                                        [index_expr for _, index_expr in subject_items],
+                                                        self.transform)
+            for (position, _), sample in zip(subject_items, subject_samples):
+                samples[position] = sample
+        return samples
+
     def __del__(self):
         self.close_reader()
@@ -123,6 +123,112 @@ class ImagePropertiesExtractor(Extractor):
         extracted['properties'] = img_properties
 
 
+class StatisticsExtractor(Extractor):
+    """Extracts the intensity statistics precomputed at the dataset creation (see :class:`WriteStatisticsCallback`).
+
+    The statistics of a category are extracted as dict to `<category>_statistics`. The dict contains the dataset
+    statistics `mean`, `std`, `min`, `max` (and `percentiles` if available) and, if `subject_statistics` is True,
+    the statistics of the sample's subject `subject_mean`, `subject_std`, `subject_min`, `subject_max` and
+    `subject_percentiles`. The statistics have the channels as last dimension.
+    """
+
+    def __init__(self, categories=('images',), subject_statistics: bool=True, cache: bool=True) -> None:
+        super().__init__()
+        self.categories = categories
+        self.subject_statistics = subject_statistics
+        self.cache = cache
+        self.cached_result = None
+
+    def extract(self, reader: rd.Reader, params: dict, extracted: dict) -> None:
+        if not self.cache or self.cached_result is None:
+            d = self._extract_dataset_statistics(reader)
+            self.cached_result = d
+        else:
+            d = self.cached_result
+
+        subject_index_expr = expr.IndexExpression(params['subject_index'])
+        for category in self.categories:
+            statistics = dict(d[category])
+            if self.subject_statistics:
+                for statistic in ('subject_mean', 'subject_std', 'subject_min', 'subject_max', 'subject_percentiles'):
+                    statistics[statistic] = reader.read(df.STATISTICS_PLACEHOLDER.format(category, statistic),
+                                                        subject_index_expr)
+            extracted['{}_statistics'.format(category)] = statistics
+
+    def _extract_dataset_statistics(self, reader: rd.Reader):
+        d = {}
+        for category in self.categories:
+            statistics = {}
+            for statistic in ('mean', 'std', 'min', 'max', 'percentiles', 'percentile_values'):
+                entry = df.STATISTICS_PLACEHOLDER.format(category, statistic)
+                if reader.has(entry):
+                    statistics[statistic] = reader.read(entry)
+            if 'mean' not in statistics:
+                raise ValueError('StatisticsExtractor requires the statistics of {} (use WriteStatisticsCallback)'
+                                 .format(category))
+            d[category] = statistics
+        return d
+
+
+class ForegroundExtractor(Extractor):
+    """Extracts the foreground information recorded at the dataset creation (see :class:`WriteForegroundCallback`).
+
+    The information is extracted as dict to `<category>_foreground` with the entries `bbox` (K, image_dimension, 2),
+    `counts` (K,) and `slice_counts`, a list with the foreground voxel counts (K, shape[axis]) of each axis.
+    No data is read, the shapes are read from the meta entries written at the dataset creation if available (see
+    :class:`WriteDataCallback`).
+    """
+
+    def __init__(self, category: str='labels') -> None:
+        super().__init__()
+        self.category = category
+        self.entry_base_names = None
+
+    def extract(self, reader: rd.Reader, params: dict, extracted: dict) -> None:
+        if self.entry_base_names is None:
+            entries = reader.get_subject_entries()
+            self.entry_base_names = [entry.rsplit('/', maxsplit=1)[1] for entry in entries]
+
+        subject_index = params['subject_index']
+        subject_index_expr = expr.IndexExpression(subject_index)
+
+        bbox = reader.read(df.FOREGROUND_PLACEHOLDER.format(self.category, 'bbox'), subject_index_expr)
+        counts = reader.read(df.FOREGROUND_PLACEHOLDER.format(self.category, 'counts'), subject_index_expr)
+        slice_counts = reader.read('{}/{}'.format(df.FOREGROUND_PLACEHOLDER.format(self.category, 'slice_counts'),
+                                                  self.entry_base_names[subject_index]))
+        shapes_entry = df.DATA_SHAPES_PLACEHOLDER.format(self.category)
+        if reader.has(shapes_entry):
+            shape = reader.read(shapes_entry, subject_index_expr)
+        else:
+            shape = reader.get_shape('{}/{}'.format(df.DATA_PLACEHOLDER.format(self.category),
+                                                    self.entry_base_names[subject_index]))
+        split_indices = np.cumsum(shape[:bbox.shape[1]])[:-1]
+        extracted['{}_foreground'.format(self.category)] = {'bbox': bbox, 'counts': counts,
+                                                            'slice_counts': np.split(slice_counts, split_indices,
+                                                                                     axis=-1)}
+
+
+class QuantizationExtractor(Extractor):
+    """Extracts the quantization scale and offset of the subject (see :func:`quantize`).
+
+    Used together with a dataset not dequantizing the data (e.g. `ParameterizableDataset(..., dequantize=False)`)
+    to dequantize the samples later, e.g. on the GPU: `data * <category>_scale + <category>_offset`.
+    The scale and offset have the channels as last dimension.
+    """
+
+    def __init__(self, categories=('images',)) -> None:
+        super().__init__()
+        self.categories = categories
+
+    def extract(self, reader: rd.Reader, params: dict, extracted: dict) -> None:
+        subject_index_expr = expr.IndexExpression(params['subject_index'])
+        for category in self.categories:
+            extracted['{}_scale'.format(category)] = reader.read(df.QUANTIZATION_PLACEHOLDER.format(category, 'scale'),
+                                                                 subject_index_expr)
+            extracted['{}_offset'.format(category)] = reader.read(
+                df.QUANTIZATION_PLACEHOLDER.format(category, 'offset'), subject_index_expr)
+
+
 class FilesExtractor(Extractor):
     """Extracts the file paths.
 
@@ -262,10 +368,24 @@ class ImageShapeExtractor(Extractor):
 
 class DataExtractor(Extractor):
 
-    def __init__(self, categories=('images',), ignore_indexing: bool=False) -> None:
+    def __init__(self, categories=('images',), ignore_indexing: bool=False, pyramid_factor: int=1,
+                 image_dimension: int=3) -> None:
+        """Initializes a new instance of the DataExtractor class.
+
+        Args:
+            categories (tuple of str): The categories to extract.
+            ignore_indexing (bool): Whether to extract the full data instead of the sample's index expression.
+            pyramid_factor (int): The downsampling factor of the pyramid level to extract the data from (see
+                :class:`WritePyramidCallback`). The index expression (in full resolution coordinates) is mapped to the
+                pyramid level, i.e. the extracted region covers the full resolution region. One for the full
+                resolution data.
+            image_dimension (int): The image dimension without the channels, i.e. the axes downsampled in the pyramid.
+        """
         super().__init__()
         self.categories = categories
         self.ignore_indexing = ignore_indexing
+        self.pyramid_factor = pyramid_factor
+        self.image_dimension = image_dimension
         self.entry_base_names = None
 
     def extract(self, reader: rd.Reader, params: dict, extracted: dict) -> None:
@@ -275,16 +395,54 @@ class DataExtractor(Extractor):
 
         subject_index = params['subject_index']
         index_expr = params['index_expr']
+        if self.pyramid_factor != 1 and not self.ignore_indexing:
+            index_expr = get_pyramid_index_expression(index_expr, self.pyramid_factor, self.image_dimension)
 
         base_name = self.entry_base_names[subject_index]
         for category in self.categories:
+            if self.pyramid_factor == 1:
+                group = df.DATA_PLACEHOLDER.format(category)
+            else:
+                group = df.PYRAMID_PLACEHOLDER.format(self.pyramid_factor, category)
             if self.ignore_indexing:
-                data = reader.read('{}/{}'.format(df.DATA_PLACEHOLDER.format(category), base_name))
+                data = reader.read('{}/{}'.format(group, base_name))
             else:
-                data = reader.read('{}/{}'.format(df.DATA_PLACEHOLDER.format(category), base_name), index_expr)
+                data = reader.read('{}/{}'.format(group, base_name), index_expr)
             extracted[category] = data
 
 
+def get_pyramid_index_expression(index_expr: expr.IndexExpression, factor: int,
+                                 image_dimension: int=3) -> expr.IndexExpression:
+    """Maps an index expression in full resolution coordinates to a pyramid level.
+
+    Args:
+        index_expr (IndexExpression): The index expression in full resolution coordinates.
+        factor (int): The downsampling factor of the pyramid level.
+        image_dimension (int): The image dimension without the channels, i.e. the downsampled axes.
+
+    Returns:
+        IndexExpression: The index expression covering the region in the pyramid level.
+    """
+    expression = index_expr.expression
+    if not isinstance(expression, tuple):
+        return index_expr
+
+    pyramid_expression = []
+    for axis, index in enumerate(expression):
+        if axis >= image_dimension:
+            pyramid_expression.append(index)
+        elif isinstance(index, int):
+            pyramid_expression.append(index // factor)
+        else:
+            start = None if index.start is None else index.start // factor
+            stop = None if index.stop is None else -(-index.stop // factor)
+            pyramid_expression.append(slice(start, stop))
+
+    pyramid_index_expr = expr.IndexExpression()
+    pyramid_index_expr.expression = tuple(pyramid_expression)
+    return pyramid_index_expr
+
+
 class PadPatchDataExtractor(Extractor):
 
     def __init__(self, padding: t.Union[tuple, t.List[tuple]], categories=('images',)) -> None:
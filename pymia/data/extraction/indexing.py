@@ -1,11 +1,243 @@
 import abc
+import os
 import typing as t
 
 import numpy as np
 
+import pymia.data.filecache as fc
 import pymia.data.indexexpression as expr
 
 
+# markers of the index arrays, see get_index_array. Both are below any index, such that negative indices are kept
+INDEX_NONE = int(np.iinfo(np.int32).min)  # None as start or stop of a slice, (INDEX_NONE, INDEX_NONE) is the full slice
+INDEX_INT = INDEX_NONE + 1  # stop marking an integer index, i.e. (i, INDEX_INT) is the index i
+
+
+def to_index_array(index_exprs: t.List[expr.IndexExpression]) -> np.ndarray:
+    """Converts index expressions of int and slice (without step) elements to an index array (see
+    :meth:`IndexingStrategy.get_index_array`).
+
+    Args:
+        index_exprs (list of IndexExpression): The index expressions.
+
+    Returns:
+        np.ndarray: The index array.
+
+    Raises:
+        ValueError: If an expression contains other elements than int and slice, a slice with a step other than 1,
+            or an index out of the int32 range.
+    """
+    expressions = [_get_expression_elements(e) for e in index_exprs]
+    index_array = np.full((len(expressions), max((len(e) for e in expressions), default=0), 2), INDEX_NONE,
+                          dtype=np.int32)
+    for row, expression in zip(index_array, expressions):
+        for axis, e in enumerate(expression):
+            if isinstance(e, slice):
+                row[axis] = (INDEX_NONE if e.start is None else e.start, INDEX_NONE if e.stop is None else e.stop)
+            else:
+                row[axis] = (e, INDEX_INT)
+    return index_array
+
+
+def _get_expression_elements(index_expr: expr.IndexExpression) -> tuple:
+    expression = index_expr.expression
+    if not isinstance(expression, tuple):
+        expression = (expression, )  # a single element indexes the first axis, e.g. slice(None) the full volume
+
+    def is_index(value) -> bool:
+        return isinstance(value, (int, np.integer)) and not isinstance(value, bool) and \
+            INDEX_INT < value <= np.iinfo(np.int32).max
+
+    for e in expression:
+        if isinstance(e, slice):
+            if e.step not in (None, 1) or not all(v is None or is_index(v) for v in (e.start, e.stop)):
+                raise ValueError('slice {} is not supported by index arrays'.format(e))
+        elif not is_index(e):
+            raise ValueError('index {} is not supported by index arrays'.format(e))
+    return expression
+
+
+def to_index_expression(index_row: np.ndarray) -> expr.IndexExpression:
+    """Converts a row of an index array (see :meth:`IndexingStrategy.get_index_array`) to an index expression.
+
+    Args:
+        index_row (np.ndarray): The row (i.e. one sample) of the index array.
+
+    Returns:
+        IndexExpression: The index expression.
+    """
+    expression = []
+    for start, stop in index_row.tolist():
+        if stop == INDEX_INT:
+            expression.append(start)
+        else:
+            expression.append(slice(None if start == INDEX_NONE else start, None if stop == INDEX_NONE else stop))
+    while expression and expression[-1] == slice(None):
+        expression.pop()  # trailing full slices are implicit
+
+    index_expr = expr.IndexExpression()
+    if expression:
+        index_expr.expression = tuple(expression)
+    return index_expr
+
+
+class IndexTable:
+    """Represents the samples of a dataset, i.e. the subject indices and index expressions, in a compact form.
+
+    The table stores one segment per subject with the subject's shape and the offset of its samples. The index
+    expressions are only created when accessing a sample, from the rows of the index array computed by the indexing
+    strategy for the sample (see :meth:`IndexingStrategy.get_index_rows`), such that the size of the table does not
+    depend on the number of samples. Only the index arrays of strategies not computing the rows lazily (see
+    :meth:`IndexingStrategy.get_index_count`) are stored, once per distinct shape. The table behaves like a list of
+    `(subject_index, index_expr)` tuples.
+    """
+
+    SEGMENT_DTYPE = np.dtype([('subject', np.int32), ('offset', np.int64), ('shape', np.int32), ('array', np.int32)])
+    ITER_CHUNK_SIZE = 65536  # number of index rows computed at once when iterating
+    FORMAT_VERSION = 2  # version of the saved tables (see save), part of the index cache keys
+
+    def __init__(self, indexing_strategy: 'IndexingStrategy') -> None:
+        """Initializes a new instance of the IndexTable class.
+
+        Args:
+            indexing_strategy (IndexingStrategy): The indexing strategy computing the samples of the subjects.
+        """
+        self.indexing_strategy = indexing_strategy
+        self.shapes = []  # type: t.List[tuple]
+        self.arrays = []  # type: t.List[np.ndarray]
+        self.segments = np.zeros(0, dtype=self.SEGMENT_DTYPE)  # one row per subject, ordered by offset
+        self.length = 0
+        self._rows = []
+        self._shape_indices = {}  # shape -> index into shapes
+        self._array_indices = {}  # shape -> index into arrays
+
+    def append(self, subject_index: int, shape: tuple):
+        """Appends the samples of a subject.
+
+        Args:
+            subject_index (int): The subject index.
+            shape (tuple): The shape of the subject's data.
+        """
+        shape = tuple(int(size) for size in shape)
+        if shape not in self._shape_indices:
+            self._shape_indices[shape] = len(self.shapes)
+            self.shapes.append(shape)
+            count = self.indexing_strategy.get_index_count(shape)
+            if count is None:
+                self._array_indices[shape] = len(self.arrays)
+                self.arrays.append(self.indexing_strategy.get_index_array(shape))
+        shape_index = self._shape_indices[shape]
+        array_index = self._array_indices.get(shape, -1)
+        count = len(self.arrays[array_index]) if array_index >= 0 else self.indexing_strategy.get_index_count(shape)
+        self._rows.append((subject_index, self.length, shape_index, array_index))
+        self.length += count
+
+    def clear(self):
+        self.__init__(self.indexing_strategy)
+
+    def get_subject_indices(self) -> np.ndarray:
+        """Get the subject index of each sample.
+
+        Returns:
+            np.ndarray: The subject indices.
+        """
+        self._update_segments()
+        counts = np.diff(np.append(self.segments['offset'], self.length))
+        return np.repeat(self.segments['subject'], counts)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, item: int) -> t.Tuple[int, expr.IndexExpression]:
+        if item < 0:
+            item += self.length
+        if not 0 <= item < self.length:
+            raise IndexError('index {} out of range'.format(item))
+        self._update_segments()
+        segment = self.segments[np.searchsorted(self.segments['offset'], item, side='right') - 1]
+        index_row = self._get_index_rows(segment, np.array([item - segment['offset']]))[0]
+        return int(segment['subject']), to_index_expression(index_row)
+
+    def __iter__(self):
+        for subject_index, _, _, index_rows in self.iter_index_rows():
+            for index_row in index_rows:
+                yield subject_index, to_index_expression(index_row)
+
+    def iter_index_rows(self) -> t.Iterator[t.Tuple[int, tuple, int, np.ndarray]]:
+        """Iterates over the index rows of the samples in chunks of at most `ITER_CHUNK_SIZE` rows of one subject,
+        e.g. to process the samples vectorized without creating their index expressions.
+
+        Yields:
+            tuple: The subject index, the shape of the subject's data, the index of the chunk's first sample and the
+            index rows of the chunk's samples (see :meth:`IndexingStrategy.get_index_array`).
+        """
+        self._update_segments()
+        stops = np.append(self.segments['offset'][1:], self.length)
+        for segment, stop in zip(self.segments, stops):
+            for start in range(0, stop - segment['offset'], self.ITER_CHUNK_SIZE):
+                indices = np.arange(start, min(start + self.ITER_CHUNK_SIZE, stop - segment['offset']))
+                yield int(segment['subject']), self.shapes[segment['shape']], int(segment['offset']) + start, \
+                    self._get_index_rows(segment, indices)
+
+    def save(self, file_path: str):
+        """Saves the table to a `.npz` file, which is written atomically, i.e. concurrent loads see either no or the
+        complete table. The indexing strategy is not saved.
+
+        Args:
+            file_path (str): The file path.
+        """
+        self._update_segments()
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        shapes = np.full((len(self.shapes), max((len(shape) for shape in self.shapes), default=0)), -1,
+                         dtype=np.int64)
+        for shape_index, shape in enumerate(self.shapes):
+            shapes[shape_index, :len(shape)] = shape
+        offsets = np.cumsum([0] + [len(array) for array in self.arrays])
+        arrays = np.concatenate(self.arrays) if self.arrays else np.zeros((0, 0, 2), dtype=np.int32)
+        fc.write_atomic(file_path, lambda f: np.savez(f, segments=self.segments, length=self.length, shapes=shapes,
+                                                       offsets=offsets, arrays=arrays))
+
+    @classmethod
+    def load(cls, file_path: str, indexing_strategy: 'IndexingStrategy') -> 'IndexTable':
+        """Loads a table saved by :meth:`save`.
+
+        Args:
+            file_path (str): The file path.
+            indexing_strategy (IndexingStrategy): The indexing strategy the table was built with.
+
+        Returns:
+            IndexTable: The table.
+        """
+        table = cls(indexing_strategy)
+        with np.load(file_path) as data:
+            table.segments = data['segments']
+            table.length = int(data['length'])
+            table.shapes = [tuple(size for size in shape.tolist() if size >= 0) for shape in data['shapes']]
+            offsets, arrays = data['offsets'], data['arrays']
+        table.arrays = [arrays[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+        table._shape_indices = {shape: shape_index for shape_index, shape in enumerate(table.shapes)}
+        table._array_indices = {table.shapes[shape_index]: array_index
+                                for shape_index, array_index in zip(table.segments['shape'], table.segments['array'])
+                                if array_index >= 0}
+        return table
+
+    @property
+    def nbytes(self) -> int:
+        self._update_segments()
+        return self.segments.nbytes + sum(8 * len(shape) for shape in self.shapes) + \
+            sum(array.nbytes for array in self.arrays)
+
+    def _get_index_rows(self, segment, indices: np.ndarray) -> np.ndarray:
+        if segment['array'] >= 0:
+            return self.arrays[segment['array']][indices]
+        return self.indexing_strategy.get_index_rows(self.shapes[segment['shape']], indices)
+
+    def _update_segments(self):
+        if self._rows:
+            self.segments = np.concatenate([self.segments, np.array(self._rows, dtype=self.SEGMENT_DTYPE)])
+            self._rows = []
+
+
 class IndexingStrategy(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
@@ -13,6 +245,74 @@ class IndexingStrategy(metaclass=abc.ABCMeta):
         # return list of indexes by giving shape
         pass
 
+    def get_index_array(self, shape) -> np.ndarray:
+        """Get the index expressions of the samples in vectorized form.
+
+        The index array has the shape (N, D, 2) for N samples, with the start and stop of the slice along each of
+        the D axes, where :data:`INDEX_NONE` stands for None and a stop of :data:`INDEX_INT` for an integer index
+        (see :func:`to_index_expression`). Axes beyond D are fully sliced.
+        The default implementation converts the index expressions of :meth:`__call__`, or computes all rows (see
+        :meth:`get_index_rows`) of strategies computing the rows lazily.
+
+        Args:
+            shape: The shape of the subject's data.
+
+        Returns:
+            np.ndarray: The index array.
+        """
+        count = self.get_index_count(shape)
+        if count is None:
+            return to_index_array(self(shape))
+        return self.get_index_rows(shape, np.arange(count))
+
+    def get_index_count(self, shape) -> t.Union[int, None]:
+        """Get the number of samples without computing the index array.
+
+        Strategies implementing this method and :meth:`get_index_rows` are indexed lazily by the :class:`IndexTable`,
+        i.e. without storing their index arrays.
+
+        Args:
+            shape: The shape of the subject's data.
+
+        Returns:
+            int: The number of samples, or None if the strategy does not compute the rows lazily (the default).
+        """
+        return None
+
+    def get_index_rows(self, shape, indices: np.ndarray) -> np.ndarray:
+        """Get the rows of the index array (see :meth:`get_index_array`) of some samples.
+
+        Args:
+            shape: The shape of the subject's data.
+            indices (np.ndarray): The indices of the samples.
+
+        Returns:
+            np.ndarray: The rows of the samples.
+        """
+        return self.get_index_array(shape)[indices]
+
+    def get_parameters(self) -> dict:
+        """Get the parameters of the strategy, e.g. to identify the index tables of the strategy in the index cache
+        of :class:`ParameterizableDataset`.
+
+        The default implementation returns the attributes of the instance. Strategies caching computed indices in
+        attributes should exclude them.
+
+        Returns:
+            dict: The parameters by name.
+        """
+        return dict(vars(self))
+
+    def get_chunk_shape(self) -> t.Union[tuple, None]:
+        """Get the storage chunk shape aligned to the samples of the strategy (see
+        :meth:`ChunkedLayout.from_indexing_strategy`).
+
+        Returns:
+            tuple: The chunk shape, where an axis with size None or not part of the shape is not chunked, or None if
+            the samples are not aligned to a chunk shape (the default).
+        """
+        return None
+
     def __repr__(self) -> str:
         return self.__class__.__name__
 
@@ -22,6 +322,15 @@ class EmptyIndexing(IndexingStrategy):
     def __call__(self, shape) -> t.List[expr.IndexExpression]:
         return [expr.IndexExpression()]
 
+    def get_index_count(self, shape) -> int:
+        return 1
+
+    def get_index_rows(self, shape, indices: np.ndarray) -> np.ndarray:
+        return np.zeros((len(indices), 0, 2), dtype=np.int32)
+
+    def get_chunk_shape(self) -> tuple:
+        return ()
+
 
 class SliceIndexing(IndexingStrategy):
 
@@ -36,6 +345,24 @@ class SliceIndexing(IndexingStrategy):
             indexing.extend(expr.IndexExpression(i, axis) for i in range(shape[axis]))
         return indexing
 
+    def get_index_count(self, shape) -> int:
+        return sum(shape[axis] for axis in self.slice_axis)
+
+    def get_index_rows(self, shape, indices: np.ndarray) -> np.ndarray:
+        # the samples are the slices along the first slice axis, followed by the slices along the next axes
+        indices = np.asarray(indices)
+        stops = np.cumsum([shape[axis] for axis in self.slice_axis])
+        blocks = np.searchsorted(stops, indices, side='right')
+        samples, axes = np.arange(len(indices)), np.asarray(self.slice_axis)[blocks]
+        rows = np.full((len(indices), max(self.slice_axis) + 1, 2), INDEX_NONE, dtype=np.int32)
+        rows[samples, axes, 0] = indices - np.append(0, stops[:-1])[blocks]
+        rows[samples, axes, 1] = INDEX_INT
+        return rows
+
+    def get_chunk_shape(self) -> tuple:
+        axis = self.slice_axis[0]
+        return tuple(1 if a == axis else None for a in range(axis + 1))
+
     def __repr__(self) -> str:
         return '{} ({})'.format(self.__class__.__name__, self.slice_axis)
 
@@ -64,6 +391,21 @@ class VoxelWiseIndexing(IndexingStrategy):
         self.indexing = [expr.IndexExpression(idx.tolist()) for idx in indices]
         return self.indexing
 
+    def get_parameters(self) -> dict:
+        return {'image_dimension': self.image_dimension}
+
+    def __repr__(self) -> str:
+        return '{} ({})'.format(self.__class__.__name__, self.image_dimension)
+
+    def get_index_count(self, shape) -> int:
+        return int(np.prod(shape[:self.image_dimension]))
+
+    def get_index_rows(self, shape, indices: np.ndarray) -> np.ndarray:
+        rows = np.empty((len(indices), self.image_dimension, 2), dtype=np.int32)
+        rows[..., 0] = np.stack(np.unravel_index(indices, shape[:self.image_dimension]), axis=-1)
+        rows[..., 1] = INDEX_INT
+        return rows
+
 
 class PatchWiseIndexing(IndexingStrategy):
 
@@ -86,20 +428,35 @@ class PatchWiseIndexing(IndexingStrategy):
         if shape == self.prev_shape:
             return self.prev_indexing
 
-        shape_without_voxel = shape[:self.image_dimension]
-        index_count = np.divide(shape_without_voxel, self.patch_shape)
-        index_count = np.floor(index_count) if self.ignore_incomplete else np.ceil(index_count)
-        index_count = index_count.astype('int')
-
-        indices = np.indices(index_count).reshape(index_count.size, -1).T
-        index_ranges = np.stack([indices, indices + 1], axis=-1)
-        index_ranges *= np.asarray(self.patch_shape)[np.newaxis, :, np.newaxis]
+        index_ranges = self.get_index_array(shape)
         indexing = [expr.IndexExpression(idx.tolist()) for idx in index_ranges]
 
         self.prev_indexing = indexing
         self.prev_shape = shape
         return indexing
 
+    def get_index_count(self, shape) -> int:
+        return int(np.prod(self._get_patch_counts(shape)))
+
+    def get_index_rows(self, shape, indices: np.ndarray) -> np.ndarray:
+        patch_indices = np.stack(np.unravel_index(indices, self._get_patch_counts(shape)), axis=-1).astype(np.int32)
+        index_ranges = np.stack([patch_indices, patch_indices + 1], axis=-1).reshape(len(indices),
+                                                                                     self.image_dimension, 2)
+        index_ranges *= np.asarray(self.patch_shape, dtype=np.int32)[np.newaxis, :, np.newaxis]
+        return index_ranges
+
+    def get_parameters(self) -> dict:
+        return {'patch_shape': self.patch_shape, 'ignore_incomplete': self.ignore_incomplete}
+
+    def get_chunk_shape(self) -> tuple:
+        return tuple(self.patch_shape)
+
+    def _get_patch_counts(self, shape) -> tuple:
+        # the number of patches along each axis
+        index_count = np.divide(shape[:self.image_dimension], self.patch_shape)
+        index_count = np.floor(index_count) if self.ignore_incomplete else np.ceil(index_count)
+        return tuple(index_count.astype('int'))
+
     def __repr__(self) -> str:
         return '{} (patch shape={}, ignore incomplete={})'.format(self.__class__.__name__,
                                                                   self.patch_shape,
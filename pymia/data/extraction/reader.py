@@ -1,11 +1,19 @@
 import abc
+import collections
+import contextlib
+import fnmatch
+import json
 import os
+import typing as t
 
 import h5py
 import numpy as np
 
 import pymia.data.indexexpression as expr
 import pymia.data.definition as df
+import pymia.data.directorystore as ds
+import pymia.data.statistics as stat
+from . import sharedcache as shc
 
 
 class Reader(metaclass=abc.ABCMeta):
@@ -19,6 +27,17 @@ class Reader(metaclass=abc.ABCMeta):
         """
         super().__init__()
         self.file_path = file_path
+        self.dequantize = True
+        self.quantization = {}
+        self.category = 'images'
+        self.cache_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.volume_cache = collections.OrderedDict()  # entry -> whole volume, least recently used first
+        self.shared_cache = None  # type: shc.SharedVolumeCache
+        self.batch_index_exprs = None  # type: t.List[expr.IndexExpression]
+        self.batch_regions = {}  # entry -> (bounds, data) of the region read for the batch
+        self.max_batch_region_ratio = 2.  # maximum ratio of the region size to the summed size of the samples
 
     def __enter__(self):
         self.open()
@@ -51,6 +70,29 @@ class Reader(metaclass=abc.ABCMeta):
         """
         pass
 
+    def get_all_shapes(self) -> t.List[tuple]:
+        """Get the shapes of all subject entries (in the order of :meth:`get_subject_entries`).
+
+        Reads the shapes written at the dataset creation (see :class:`WriteDataCallback`) at once if available,
+        otherwise the shape of each entry.
+
+        Returns:
+            list: The shape of each subject entry.
+        """
+        shapes_entry = df.DATA_SHAPES_PLACEHOLDER.format(self.category)
+        if self.has(shapes_entry):
+            return [tuple(shape) for shape in np.asarray(self.read(shapes_entry)).tolist()]
+        return [tuple(self.get_shape(entry)) for entry in self.get_subject_entries()]
+
+    def _get_subject_entries_from_meta(self) -> t.Union[list, None]:
+        """Get the subject entries from the names written at the dataset creation (see :class:`WriteDataCallback`),
+        or None if not available."""
+        entries_entry = df.DATA_ENTRIES_PLACEHOLDER.format(self.category)
+        if not self.has(entries_entry):
+            return None
+        group = df.DATA_PLACEHOLDER.format(self.category)
+        return ['{}/{}'.format(group, name) for name in self.read(entries_entry)]
+
     @abc.abstractmethod
     def get_subjects(self) -> list:
         """Get the subject names in the dataset.
@@ -73,6 +115,14 @@ class Reader(metaclass=abc.ABCMeta):
         """
         pass
 
+    def get_entries(self) -> list:
+        """Get all dataset entries holding data, i.e. without the groups.
+
+        Returns:
+            list: The list of entry strings.
+        """
+        raise NotImplementedError('{} does not support listing the entries'.format(self.__class__.__name__))
+
     @abc.abstractmethod
     def has(self, entry: str) -> bool:
         """Check whether a dataset entry exists.
@@ -95,6 +145,145 @@ class Reader(metaclass=abc.ABCMeta):
         """Close the reader."""
         pass
 
+    def dequantize_data(self, entry: str, data, index: expr.IndexExpression=None):
+        """Dequantize the data of a data entry stored with an integer dtype and a scale and offset (see
+        :func:`quantize`). Returns the data unchanged if `dequantize` is False or the entry is not quantized.
+
+        Args:
+            entry(str): The dataset entry.
+            data: The read data.
+            index(expr.IndexExpression): The slicing expression used to read the data.
+
+        Returns:
+            The (dequantized) data.
+        """
+        if not self.dequantize or not entry.startswith(df.DATA_PLACEHOLDER.format('')):
+            return data
+
+        category, base_name = entry[len(df.DATA_PLACEHOLDER.format('')):].rsplit('/', maxsplit=1)
+        if category not in self.quantization:
+            scale_entry = df.QUANTIZATION_PLACEHOLDER.format(category, 'scale')
+            offset_entry = df.QUANTIZATION_PLACEHOLDER.format(category, 'offset')
+            # the rank of the entries (i.e. of the category) is read once to detect reads selecting a channel
+            self.quantization[category] = (np.asarray(self.read(scale_entry)), np.asarray(self.read(offset_entry)),
+                                           len(self.get_shape(entry))) if self.has(scale_entry) else None
+        if self.quantization[category] is None:
+            return data
+
+        scales, offsets, rank = self.quantization[category]
+        scale, offset = scales[int(base_name)], offsets[int(base_name)]
+        if np.all(scale == 1) and np.all(offset == 0):
+            return data  # stored losslessly
+        if len(scale) > 1 and index is not None and isinstance(index.expression, tuple) and \
+                len(index.expression) == rank:
+            scale, offset = scale[index.expression[-1]], offset[index.expression[-1]]  # channel selected
+        elif len(scale) == 1:
+            scale, offset = scale[0], offset[0]
+        return data * scale.astype(np.float32) + offset.astype(np.float32)
+
+    def read_cached(self, entry: str, index: expr.IndexExpression, read_fn):
+        """Read a subject entry through the volume cache. The whole (decoded) volume of the entry is read once and
+        kept in memory, such that repeated reads of e.g. slices or patches of the same subject do not decode the
+        stored chunks again. The least recently used volumes are evicted if the cached volumes exceed
+        `cache_bytes`. If a `shared_cache` is set, it is used instead, such that the volumes are shared by multiple
+        processes (see :class:`SharedVolumeCache`). Reads directly if the caches are disabled (`cache_bytes` is zero
+        and no `shared_cache`) or for other entries.
+
+        Args:
+            entry(str): The dataset entry.
+            index(expr.IndexExpression): The slicing expression.
+            read_fn: The function reading the entry, i.e. `read_fn(entry, expression)`, with expression None to read
+                the whole volume.
+
+        Returns:
+            The read data. A copy of the cached data, hence it can be modified.
+        """
+        if self.batch_index_exprs is not None and index is not None and \
+                entry.startswith(df.DATA_PLACEHOLDER.format('')) and self.cache_bytes <= 0 and \
+                self.shared_cache is None:
+            data = self._read_batch_region(entry, index, read_fn)
+            if data is not None:
+                return data
+
+        if (self.cache_bytes <= 0 and self.shared_cache is None) or index is None or \
+                not entry.startswith((df.DATA_PLACEHOLDER.format(''), 'pyramid/')):
+            return read_fn(entry, None if index is None else index.expression)
+
+        if self.shared_cache is not None:
+            volume = self.shared_cache.read(self.file_path, entry, lambda: read_fn(entry, None))
+        elif entry in self.volume_cache:
+            self.cache_hits += 1
+            self.volume_cache.move_to_end(entry)
+            volume = self.volume_cache[entry]
+        else:
+            self.cache_misses += 1
+            volume = read_fn(entry, None)
+            if volume.nbytes <= self.cache_bytes:
+                self.volume_cache[entry] = volume
+                cached_bytes = sum(v.nbytes for v in self.volume_cache.values())
+                while cached_bytes > self.cache_bytes:
+                    _, evicted = self.volume_cache.popitem(last=False)
+                    cached_bytes -= evicted.nbytes
+        return np.array(volume[index.expression])
+
+    def clear_cache(self):
+        """Clear the volume cache (see :meth:`read_cached`) and reset its hit and miss counters."""
+        self.volume_cache.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @contextlib.contextmanager
+    def batch(self, index_exprs: t.List[expr.IndexExpression]):
+        """Context to read the samples of a batch from the same subject with one read per data entry.
+
+        Within the context, the first read of a data entry reads the bounding region of all index expressions of the
+        batch at once, and the samples are sliced from this region. Reads not contained in the region (e.g. of
+        padded patches) are read directly. Since the region covers everything between the samples, the samples are
+        read one by one if the region is larger than `max_batch_region_ratio` times the summed size of the samples
+        (e.g. for randomly sampled slices).
+
+        Args:
+            index_exprs(list of IndexExpression): The index expressions of the samples of the batch.
+        """
+        self.batch_index_exprs = index_exprs
+        self.batch_regions = {}
+        try:
+            yield self
+        finally:
+            self.batch_index_exprs = None
+            self.batch_regions = {}
+
+    def _read_batch_region(self, entry: str, index: expr.IndexExpression, read_fn):
+        shape = tuple(self.get_shape(entry))
+        if entry not in self.batch_regions:
+            all_bounds = [_get_bounds(index_expr.expression, shape) for index_expr in self.batch_index_exprs]
+            self.batch_regions[entry] = None
+            if all(bounds is not None for bounds in all_bounds):
+                bounds = [(min(b[axis][0] for b in all_bounds), max(b[axis][1] for b in all_bounds))
+                          for axis in range(len(shape))]
+                samples_size = sum(np.prod([stop - start for start, stop in b]) for b in all_bounds)
+                if np.prod([stop - start for start, stop in bounds]) <= self.max_batch_region_ratio * samples_size:
+                    region = read_fn(entry, tuple(slice(start, stop) for start, stop in bounds))
+                    self.batch_regions[entry] = (bounds, region)
+        if self.batch_regions[entry] is None:
+            return None
+
+        bounds, region = self.batch_regions[entry]
+        sample_bounds = _get_bounds(index.expression, shape)
+        if sample_bounds is None or \
+                any(start < b[0] or stop > b[1] for (start, stop), b in zip(sample_bounds, bounds)):
+            return None
+
+        expression = index.expression if isinstance(index.expression, tuple) else (index.expression,)
+        relative = []
+        for axis, e in enumerate(expression):
+            if isinstance(e, slice):
+                relative.append(slice(sample_bounds[axis][0] - bounds[axis][0],
+                                      sample_bounds[axis][1] - bounds[axis][0]))
+            else:
+                relative.append(sample_bounds[axis][0] - bounds[axis][0])
+        return np.array(region[tuple(relative)])
+
 
 class Hdf5Reader(Reader):
     """Represents the dataset reader for HDF5 files."""
@@ -111,6 +300,9 @@ class Hdf5Reader(Reader):
         self.category = category
 
     def get_subject_entries(self) -> list:
+        entries = self._get_subject_entries_from_meta()
+        if entries is not None:
+            return entries
         group = df.DATA_PLACEHOLDER.format(self.category)
         return ['{}/{}'.format(group, k) for k in sorted(self.h5[group].keys())]
 
@@ -121,16 +313,22 @@ class Hdf5Reader(Reader):
         return self.read(df.SUBJECT)
 
     def read(self, entry: str, index: expr.IndexExpression=None):
-        if index is None:
-            data = self.h5[entry][()]  # need () instead of util.IndexExpression(None) [which is equal to slice(None)]
-        else:
-            data = self.h5[entry][index.expression]
+        dataset = self.h5[entry]
+        if h5py.check_string_dtype(dataset.dtype) is not None and hasattr(dataset, 'asstr'):
+            dataset = dataset.asstr()  # h5py >= 3 returns bytes otherwise
+        # need () instead of util.IndexExpression(None) [which is equal to slice(None)]
+        data = self.read_cached(entry, index, lambda e, expression: dataset[() if expression is None else expression])
 
         if isinstance(data, np.ndarray) and data.dtype == np.object:
             return data.tolist()
         # if h5py.check_dtype(vlen=self.h5[entry].dtype) == str and not isinstance(data, str):
         #     return data.tolist()
-        return data
+        return self.dequantize_data(entry, data, index)
+
+    def get_entries(self) -> list:
+        entries = []
+        self.h5.visititems(lambda name, obj: entries.append(name) if isinstance(obj, h5py.Dataset) else None)
+        return entries
 
     def has(self, entry: str) -> bool:
         return entry in self.h5
@@ -142,27 +340,397 @@ class Hdf5Reader(Reader):
         if self.h5 is not None:
             self.h5.close()
             self.h5 = None
+        self.clear_cache()
+
+
+class DirectoryStoreReader(Reader):
+    """Represents the dataset reader for chunked directory stores (see :mod:`pymia.data.directorystore`).
+
+    Each read only opens the chunk files it needs. Hence, the reader can safely be used by forked processes (e.g. the
+    workers of a :class:`torch.utils.data.DataLoader`) and does not serialize concurrent reads.
+    """
+
+    def __init__(self, file_path: str, category='images') -> None:
+        """Initializes a new instance.
+
+        Args:
+            file_path(str): The path to the dataset directory.
+            category(str): The category of an entry that contains data of all subjects
+        """
+        super().__init__(file_path)
+        self.store = None  # type: ds.DirectoryStore
+        self.category = category
+
+    def get_subject_entries(self) -> list:
+        entries = self._get_subject_entries_from_meta()
+        if entries is not None:
+            return entries
+        group = df.DATA_PLACEHOLDER.format(self.category)
+        return ['{}/{}'.format(group, k) for k in sorted(self.store.keys(group))]
+
+    def get_shape(self, entry: str) -> list:
+        return self.store.get_shape(entry)
+
+    def get_subjects(self) -> list:
+        return self.read(df.SUBJECT)
+
+    def read(self, entry: str, index: expr.IndexExpression=None):
+        data = self.read_cached(entry, index, self.store.read)
+        if isinstance(data, np.ndarray) and data.dtype == np.object:
+            return data.tolist()
+        return self.dequantize_data(entry, data, index)
+
+    def get_entries(self) -> list:
+        return sorted(self.store.entries.keys())
+
+    def has(self, entry: str) -> bool:
+        return self.store.has(entry)
+
+    def open(self):
+        self.store = ds.DirectoryStore(self.file_path, mode='r')
+        self.store.open()
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        self.clear_cache()
+
+
+class NpyMemmapReader(DirectoryStoreReader):
+    """Represents the dataset reader for memory mapped NumPy directories (see :mod:`pymia.data.directorystore`).
+
+    The data entries are returned as read-only views of the memory mapped files, i.e. reading a sample does neither
+    decode nor copy the data. Transforms modifying the data in-place therefore need to copy the data first.
+    The other entries are returned as copies.
+    """
+
+    def read(self, entry: str, index: expr.IndexExpression=None):
+        data = super().read(entry, index)
+        if isinstance(data, np.ndarray) and not entry.startswith(df.DATA_PLACEHOLDER.format('')):
+            return np.array(data)
+        return data
+
+    def open(self):
+        self.store = ds.NpyMemmapStore(self.file_path, mode='r')
+        self.store.open()
+
+
+class ShardedReader(Reader):
+    """Represents the dataset reader federating the shards of a sharded dataset (see
+    :func:`create_sharded_dataset`).
+
+    The file is a JSON manifest listing the shards, each being a dataset with a contiguous range of the subjects.
+    The reader keeps a reader of each shard open and maps the global subject indices and entries to the shards:
+
+    - The entries of the groups with one entry per subject (e.g. `data/images/<subject>`, see
+      :data:`definition.SUBJECT_ENTRY_GROUPS`) are named by the global subject index.
+    - The meta entries with one row per subject (see :data:`definition.SUBJECT_META_ENTRIES`) are concatenated.
+      The file paths are made relative to the common file root of the shards.
+    - The names of the subject entries (see :data:`definition.DATA_ENTRIES_PLACEHOLDER`) are the global names.
+    - The dataset statistics (see :class:`WriteStatisticsCallback`) are merged.
+    - Other entries (e.g. the names) are read from the first shard.
+
+    The budget of the volume cache (`cache_bytes`, see :meth:`Reader.read_cached`) is split evenly among the shards.
+    """
+
+    MERGED_STATISTICS = ('count', 'mean', 'std', 'min', 'max', 'histogram', 'percentiles')
+
+    def __init__(self, file_path: str, category='images') -> None:
+        """Initializes a new instance.
+
+        Args:
+            file_path(str): The path to the manifest file.
+            category(str): The category of an entry that contains data of all subjects
+        """
+        super().__init__(file_path)
+        self.category = category
+        self.shards = []  # type: t.List[Reader]
+        self.subject_counts = []
+        self.entry_map = {}  # global subject entry -> (shard index, shard subject entry), e.g. of all categories
+        self.cache = {}  # concatenated and merged meta entries
+
+    def get_subject_entries(self) -> list:
+        group = df.DATA_PLACEHOLDER.format(self.category)
+        return sorted(entry for entry in self.entry_map if entry.rpartition('/')[0] == group)
+
+    def get_shape(self, entry: str) -> list:
+        shard, shard_entry = self._map_subject_entry(entry)
+        if shard is not None:
+            return self.shards[shard].get_shape(shard_entry)
+        if self._is_subject_meta_entry(entry) or self._is_entry_names_entry(entry):
+            return (sum(self.subject_counts),) + tuple(self.shards[0].get_shape(entry)[1:])
+        return self.shards[0].get_shape(entry)
+
+    def get_subjects(self) -> list:
+        return self.read(df.SUBJECT)
+
+    def read(self, entry: str, index: expr.IndexExpression=None):
+        shard, shard_entry = self._map_subject_entry(entry)
+        if shard is not None:
+            return self.shards[shard].read(shard_entry, index)
+
+        if entry not in self.cache:
+            if self._is_subject_meta_entry(entry):
+                self.cache[entry] = self._concatenate(entry)
+            elif entry == df.FILES_ROOT:
+                self.cache[entry] = self._get_file_root()
+            elif self._is_entry_names_entry(entry):
+                self.cache[entry] = self._get_entry_names(entry)
+            elif self._is_dataset_statistics_entry(entry):
+                self.cache[entry] = self._merge_statistics(entry)
+            else:
+                return self.shards[0].read(entry, index)
+
+        return _select(self.cache[entry], index)
+
+    @contextlib.contextmanager
+    def batch(self, index_exprs: t.List[expr.IndexExpression]):
+        with contextlib.ExitStack() as stack:
+            for shard in self.shards:
+                shard.max_batch_region_ratio = self.max_batch_region_ratio
+                stack.enter_context(shard.batch(index_exprs))
+            yield self
+
+    def get_entries(self) -> list:
+        global_entries = {shard_entry: entry for entry, shard_entry in self.entry_map.items()}
+        entries = [e for e in self.shards[0].get_entries() if (0, e) not in global_entries]
+        for shard_index, shard in enumerate(self.shards):
+            entries.extend(global_entries[(shard_index, e)] for e in shard.get_entries()
+                           if (shard_index, e) in global_entries)
+        return entries
+
+    def has(self, entry: str) -> bool:
+        shard, shard_entry = self._map_subject_entry(entry)
+        if shard is not None:
+            return self.shards[shard].has(shard_entry)
+        return self.shards[0].has(entry)
+
+    def open(self):
+        if self.shards:
+            return  # already open
+
+        with open(self.file_path, 'r') as f:
+            manifest = json.load(f)
+
+        root = os.path.dirname(os.path.abspath(self.file_path))
+        digits = len(str(sum(shard['subject_count'] for shard in manifest['shards'])))
+        # each shard caches its own volumes, hence the budget of the volume cache is split among the shards
+        shard_cache_bytes = self.cache_bytes // len(manifest['shards'])
+        for shard_index, shard in enumerate(manifest['shards']):
+            reader = get_reader(os.path.join(root, shard['file']), direct_open=True, dequantize=self.dequantize,
+                                cache_bytes=shard_cache_bytes, shared_cache=self.shared_cache)
+            self.shards.append(reader)
+            self.subject_counts.append(shard['subject_count'])
+            local_names = [entry.rpartition('/')[2] for entry in reader.get_subject_entries()]
+            for group in self._get_subject_groups(reader):
+                for local_index, local_name in enumerate(local_names):
+                    global_name = '{{:0{}}}'.format(digits).format(shard['subject_offset'] + local_index)
+                    self.entry_map['{}/{}'.format(group, global_name)] = (shard_index,
+                                                                          '{}/{}'.format(group, local_name))
+
+    def close(self):
+        for reader in self.shards:
+            reader.close()
+        self.shards = []
+        self.subject_counts = []
+        self.entry_map = {}
+        self.cache = {}
+
+    def _map_subject_entry(self, entry: str):
+        return self.entry_map.get(entry, (None, None))
+
+    @staticmethod
+    def _get_subject_groups(reader: Reader) -> set:
+        """Get the groups holding one entry per subject (see :data:`definition.SUBJECT_ENTRY_GROUPS`)."""
+        groups = {entry.rpartition('/')[0] for entry in reader.get_entries()}
+        return {group for group in groups
+                if any(fnmatch.fnmatchcase(group, pattern) for pattern in df.SUBJECT_ENTRY_GROUPS)}
+
+    @staticmethod
+    def _is_subject_meta_entry(entry: str) -> bool:
+        return any(fnmatch.fnmatchcase(entry, pattern) for pattern in df.SUBJECT_META_ENTRIES)
+
+    @staticmethod
+    def _is_entry_names_entry(entry: str) -> bool:
+        return fnmatch.fnmatchcase(entry, df.DATA_ENTRIES_PLACEHOLDER.format('*'))
+
+    @staticmethod
+    def _is_dataset_statistics_entry(entry: str) -> bool:
+        return any(fnmatch.fnmatchcase(entry, df.STATISTICS_PLACEHOLDER.format('*', statistic))
+                   for statistic in ShardedReader.MERGED_STATISTICS)
+
+    def _get_file_root(self) -> str:
+        return os.path.commonpath([shard.read(df.FILES_ROOT) for shard in self.shards])
+
+    def _get_entry_names(self, entry: str) -> list:
+        prefix, suffix = df.DATA_ENTRIES_PLACEHOLDER.split('{}')
+        category = entry[len(prefix):-len(suffix)]
+        group = df.DATA_PLACEHOLDER.format(category)
+        # the global names are zero-padded, i.e. sorted by the subject index
+        return sorted(e.rpartition('/')[2] for e in self.entry_map if e.rpartition('/')[0] == group)
+
+    def _concatenate(self, entry: str):
+        shard_data = [shard.read(entry) for shard in self.shards]
+        if fnmatch.fnmatchcase(entry, df.FILES_PLACEHOLDER.format('*')):
+            file_root = self._get_file_root()
+            shard_data = [[[os.path.relpath(os.path.join(shard.read(df.FILES_ROOT), f), file_root) for f in files]
+                           for files in data] for shard, data in zip(self.shards, shard_data)]
+        if isinstance(shard_data[0], list):
+            return [row for data in shard_data for row in data]
+        return np.concatenate(shard_data)
+
+    def _merge_statistics(self, entry: str):
+        group = entry.rpartition('/')[0]
+        statistic = entry.rpartition('/')[2]
+
+        def read(name):
+            return [np.asarray(shard.read('{}/{}'.format(group, name))) for shard in self.shards]
+
+        if statistic == 'min':
+            return np.min(read('min'), axis=0)
+        if statistic == 'max':
+            return np.max(read('max'), axis=0)
+        if statistic in ('count', 'histogram'):
+            return np.sum(read(statistic), axis=0)
+        if statistic == 'percentiles':
+            return stat.get_histogram_percentiles(self.read('{}/histogram'.format(group)),
+                                                  self.shards[0].read('{}/histogram_edges'.format(group)),
+                                                  self.shards[0].read('{}/percentile_values'.format(group)))
+
+        counts, means, stds = read('count'), read('mean'), read('std')
+        count = np.sum(counts, axis=0)
+        mean = np.sum([c * m for c, m in zip(counts, means)], axis=0) / count
+        if statistic == 'mean':
+            return mean
+        m2 = np.sum([c * (s ** 2 + (m - mean) ** 2) for c, m, s in zip(counts, means, stds)], axis=0)
+        return np.sqrt(m2 / count)
+
+
+class InMemoryReader(Reader):
+    """Represents the dataset reader holding all entries of a dataset in memory.
+
+    All entries are read once when opening the reader. Subsequent reads only slice the in-memory arrays, i.e.
+    without any file access. Use it for datasets fitting into the memory. The arrays are read-only (as for
+    :class:`NpyMemmapReader`), such that transforms modifying the data in-place need to copy the data first.
+    """
+
+    def __init__(self, file_path: str, category='images') -> None:
+        """Initializes a new instance.
+
+        Args:
+            file_path(str): The path to the dataset file, which is read with the reader corresponding to its
+                extension (see :func:`get_reader`).
+            category(str): The category of an entry that contains data of all subjects
+        """
+        super().__init__(file_path)
+        self.category = category
+        self.entries = None  # type: dict
+        self.shapes = {}
+
+    def get_subject_entries(self) -> list:
+        prefix = df.DATA_PLACEHOLDER.format(self.category) + '/'
+        return sorted(e for e in self.entries if e.startswith(prefix) and '/' not in e[len(prefix):])
+
+    def get_shape(self, entry: str) -> list:
+        return self.shapes[entry]
+
+    def get_subjects(self) -> list:
+        return self.read(df.SUBJECT)
+
+    def read(self, entry: str, index: expr.IndexExpression=None):
+        data = _select(self.entries[entry], index)
+        if isinstance(data, list):
+            return list(data)
+        return self.dequantize_data(entry, data, index)
+
+    def get_entries(self) -> list:
+        return list(self.entries.keys())
+
+    def has(self, entry: str) -> bool:
+        entry = entry.strip('/')
+        return entry in self.entries or any(e.startswith(entry + '/') for e in self.entries)
+
+    def open(self):
+        if self.entries is not None:
+            return  # already open
+
+        self.entries = {}
+        with get_reader(self.file_path, dequantize=False) as reader:
+            for entry in reader.get_entries():
+                data = reader.read(entry)
+                if isinstance(data, np.ndarray):
+                    data = np.ascontiguousarray(data)
+                    data.setflags(write=False)
+                self.entries[entry] = data
+                self.shapes[entry] = tuple(reader.get_shape(entry))
+
+    def close(self):
+        self.entries = None
+        self.shapes = {}
+        self.quantization = {}
+
+
+def _get_bounds(expression, shape: tuple):
+    """Get the (start, stop) per axis of an expression of int and slice (without step) elements, or None if the
+    expression contains other elements."""
+    if not isinstance(expression, tuple):
+        expression = (expression,)
+    if len(expression) > len(shape):
+        return None
+    bounds = []
+    for e, size in zip(expression + (slice(None),) * (len(shape) - len(expression)), shape):
+        if isinstance(e, slice) and e.step in (None, 1):
+            start, stop, _ = e.indices(size)
+            bounds.append((start, max(start, stop)))
+        elif isinstance(e, (int, np.integer)):
+            index = e + size if e < 0 else e
+            bounds.append((index, index + 1))
+        else:
+            return None
+    return bounds
+
+
+def _select(data, index: expr.IndexExpression):
+    if index is None:
+        return data
+    if isinstance(data, list):
+        selected = np.asarray(data, dtype=object)[index.expression]
+        return selected.tolist() if isinstance(selected, np.ndarray) else selected
+    return data[index.expression]
 
 
-def get_reader(file_path: str, direct_open: bool=False) -> Reader:
+def get_reader(file_path: str, direct_open: bool=False, dequantize: bool=True, cache_bytes: int=0,
+               in_memory: bool=False, shared_cache: shc.SharedVolumeCache=None) -> Reader:
     """ Get the dataset reader corresponding to the file extension.
 
     Args:
         file_path(str): The path to the dataset file.
         direct_open(bool): Whether the file should directly be opened.
+        dequantize(bool): Whether quantized data entries are dequantized (see :meth:`Reader.dequantize_data`).
+            If False, the stored integers are returned, e.g. to dequantize them on the GPU.
+        cache_bytes(int): The size in bytes of the volume cache holding whole subject volumes (see
+            :meth:`Reader.read_cached`). Zero disables the cache.
+        in_memory(bool): Whether all entries are read into memory when opening the reader (see
+            :class:`InMemoryReader`).
+        shared_cache(SharedVolumeCache): The volume cache shared by processes (see :meth:`Reader.read_cached`).
 
     Returns:
         Reader: Reader corresponding to dataset file extension.
     """
 
-    extension = os.path.splitext(file_path)[1]
+    extension = os.path.splitext(file_path.rstrip('/\\'))[1]
     if extension not in reader_registry:
         raise ValueError('unknown dataset file extension "{}"'.format(extension))
 
-    reader = reader_registry[extension](file_path)
+    reader = InMemoryReader(file_path) if in_memory else reader_registry[extension](file_path)
+    reader.dequantize = dequantize
+    reader.cache_bytes = cache_bytes
+    reader.shared_cache = shared_cache
     if direct_open:
         reader.open()
     return reader
 
 
-reader_registry = {'.h5': Hdf5Reader, '.hdf5': Hdf5Reader}
+reader_registry = {'.h5': Hdf5Reader, '.hdf5': Hdf5Reader, '.pymia': DirectoryStoreReader,
+                   '.npmm': NpyMemmapReader, '.shards': ShardedReader}
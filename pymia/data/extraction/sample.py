@@ -5,6 +5,12 @@ import numpy as np
 import torch.utils.data as data
 import torch.utils.data.sampler as smplr
 
+import pymia.data.definition as df
+from . import dataset as ds
+from . import extractor as extr
+from . import indexing as idx
+from . import reader as rd
+
 
 class SelectionStrategy(metaclass=abc.ABCMeta):
 
@@ -116,6 +122,80 @@ def select_indices(data_source: data.Dataset, selection_strategy: SelectionStrat
     return selected_indices
 
 
+def select_foreground_indices(data_source: ds.ParameterizableDataset, category: str='labels',
+                              label_index: int=None) -> t.List[int]:
+    """Selects the indices of the samples containing foreground without reading any data.
+
+    Uses the foreground recorded at the dataset creation (see :class:`WriteForegroundCallback`). The selection is
+    exact for samples covering full slices (e.g. :class:`SliceIndexing`) or full subjects (e.g.
+    :class:`EmptyIndexing`). For other samples (e.g. patches), a sample is selected if it intersects the foreground
+    bounding box, which might include samples without foreground.
+
+    Args:
+        data_source (ParameterizableDataset): The dataset.
+        category (str): The category holding the labels.
+        label_index (int): The index of the label value (see `label_values` of :class:`WriteForegroundCallback`)
+            to consider. If None, any foreground is considered.
+
+    Returns:
+        list: The indices of the selected samples.
+    """
+    with rd.get_reader(data_source.dataset_path) as reader:
+        bboxes = reader.read(df.FOREGROUND_PLACEHOLDER.format(category, 'bbox'))
+        counts = reader.read(df.FOREGROUND_PLACEHOLDER.format(category, 'counts'))
+        labels = slice(None) if label_index is None else [label_index]
+        image_dimension = bboxes.shape[2]
+
+        extractor = extr.ForegroundExtractor(category)
+        slice_foreground = {}  # extracted lazily per subject
+        selected_indices = []
+        for subject_index, shape, offset, index_rows in data_source.indices.iter_index_rows():
+            if not counts[subject_index, labels].any():
+                continue
+
+            starts, stops, is_int = _get_bounds(index_rows, shape[:image_dimension])
+            is_full = (starts == 0) & (stops == np.asarray(shape[:image_dimension])) & ~is_int
+            # exact selection by the slice counts for samples of one full slice
+            exact = np.all(is_int | is_full, axis=1) & (is_int.sum(axis=1) == 1)
+            selected = np.zeros(len(index_rows), dtype=np.bool_)
+            if exact.any():
+                if subject_index not in slice_foreground:
+                    extracted = {}
+                    extractor.extract(reader, {'subject_index': subject_index}, extracted)
+                    slice_foreground[subject_index] = [axis_counts[labels].any(axis=0) for axis_counts in
+                                                       extracted['{}_foreground'.format(category)]['slice_counts']]
+                axes = np.argmax(is_int, axis=1)
+                for axis, axis_foreground in enumerate(slice_foreground[subject_index]):
+                    rows = np.flatnonzero(exact & (axes == axis))
+                    selected[rows] = axis_foreground[starts[rows, axis]]
+
+            # others intersecting the bounding box of any label
+            subject_bboxes = bboxes[subject_index, labels]
+            subject_bboxes = subject_bboxes[subject_bboxes[:, 0, 1] > 0]  # (K, image_dimension, 2) with foreground
+            intersects = (starts[:, None] < subject_bboxes[None, :, :, 1]) & \
+                (stops[:, None] > subject_bboxes[None, :, :, 0])
+            selected[~exact] = np.any(np.all(intersects, axis=2), axis=1)[~exact]
+            selected_indices.extend((offset + np.flatnonzero(selected)).tolist())
+    return selected_indices
+
+
+def _get_bounds(index_rows: np.ndarray, shape: tuple) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get the start and stop (N, image_dimension) of the index rows within the shape, and whether the rows index
+    an axis by an integer."""
+    dimension = len(shape)
+    bounds = np.full((len(index_rows), dimension, 2), idx.INDEX_NONE, dtype=np.int64)
+    axes = min(dimension, index_rows.shape[1])
+    bounds[:, :axes] = index_rows[:, :axes]  # missing axes are full slices
+
+    starts, stops = bounds[..., 0], bounds[..., 1]
+    is_int = stops == idx.INDEX_INT
+    sizes = np.broadcast_to(np.asarray(shape, dtype=np.int64), starts.shape)
+    starts = np.where(starts == idx.INDEX_NONE, 0, np.where(starts < 0, starts + sizes, starts))
+    stops = np.where(is_int, starts + 1,
+                     np.where(stops == idx.INDEX_NONE, sizes, np.where(stops < 0, stops + sizes, stops)))
+    return starts, np.minimum(stops, sizes), is_int
+
+
 class SubsetSequentialSampler(smplr.Sampler):
     """Samples elements sequential from a given list of indices, without replacement."""
 
@@ -0,0 +1,120 @@
+import collections
+import hashlib
+import os
+import shutil
+import tempfile
+import typing as t
+
+import numpy as np
+
+import pymia.data.filecache as fc
+
+
+def get_shared_memory_dir() -> str:
+    """Get the directory backed by shared memory, i.e. `/dev/shm` if available or the temporary directory otherwise.
+
+    Returns:
+        str: The directory path.
+    """
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class SharedVolumeCache:
+    """Represents a volume cache shared by processes, e.g. the workers of a :class:`torch.utils.data.DataLoader`.
+
+    The volumes are stored as `.npy` files in a directory backed by shared memory (see
+    :func:`get_shared_memory_dir`) and memory mapped by each process. Hence, a volume is read and decoded once by the
+    process needing it first and then read without copy by all processes. If the size of the cache exceeds
+    `max_bytes`, the least recently used volumes are evicted. Each process keeps the volumes it read mapped, but at
+    most `max_bytes` of them, such that the memory of evicted volumes is freed once their views are not used anymore.
+
+    The cache is picklable and only holds the directory and the budget, such that it can be passed to the worker
+    processes. The cache is not removed automatically, call :meth:`clear` once it is not needed anymore.
+    """
+
+    def __init__(self, name: str, max_bytes: int, root: str=None) -> None:
+        """Initializes a new instance of the SharedVolumeCache class.
+
+        Args:
+            name (str): The name of the cache, i.e. the processes using the same name and root share the cache.
+            max_bytes (int): The maximum size of the cache in bytes.
+            root (str): The directory containing the cache directory. If None, the shared memory directory is used.
+        """
+        self.cache_dir = os.path.join(get_shared_memory_dir() if root is None else root, 'pymia_{}'.format(name))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._volumes = collections.OrderedDict()  # path -> (inode, volume) mapped by this process, least recent first
+        self._versions = {}  # file path -> modification time
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_volumes'] = collections.OrderedDict()  # memory maps are opened again in each process
+        return state
+
+    def read(self, file_path: str, entry: str, read_fn) -> np.ndarray:
+        """Read a volume from the cache or by `read_fn` if not cached.
+
+        Args:
+            file_path (str): The path to the dataset file. Modified datasets are not read from the cache.
+            entry (str): The dataset entry.
+            read_fn: The function reading the entire volume if not cached, i.e. `read_fn()`.
+
+        Returns:
+            np.ndarray: The volume, read-only if cached.
+        """
+        path = self._get_path(file_path, entry)
+        try:
+            os.utime(path)  # mark as recently used and check that the volume was not evicted
+            inode = os.stat(path).st_ino
+            mapped = self._volumes.pop(path, None)
+            if mapped is None or mapped[0] != inode:  # not mapped yet, or evicted and cached again
+                mapped = (inode, np.load(path, mmap_mode='r'))
+            self._volumes[path] = mapped
+            self._unmap()
+            self.hits += 1
+            return mapped[1]
+        except (FileNotFoundError, ValueError):
+            self._volumes.pop(path, None)
+
+        self.misses += 1
+        volume = read_fn()
+        if volume.nbytes > self.max_bytes:
+            return volume
+
+        fc.write_atomic(path, lambda f: np.save(f, volume))
+        fc.evict(self.cache_dir, '.npy', self.max_bytes)
+        return volume
+
+    def get_size(self) -> int:
+        """Get the size of the cache.
+
+        Returns:
+            int: The size of the cached volumes in bytes.
+        """
+        return sum(size for _, size, _ in self._get_entries())
+
+    def clear(self):
+        """Removes the cache with all volumes."""
+        self._volumes.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _get_path(self, file_path: str, entry: str) -> str:
+        file_path = os.path.abspath(file_path)
+        if file_path not in self._versions:
+            self._versions[file_path] = os.stat(file_path).st_mtime_ns
+        key = '{}:{}:{}'.format(file_path, self._versions[file_path], entry)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    def _unmap(self):
+        # the mapped volumes of this process are limited by the budget as well, since evicted volumes stay in memory
+        # until they are unmapped
+        size = sum(volume.nbytes for _, volume in self._volumes.values())
+        while size > self.max_bytes and len(self._volumes) > 1:
+            _, (_, volume) = self._volumes.popitem(last=False)
+            size -= volume.nbytes
+
+    def _get_entries(self) -> t.List[t.Tuple[str, int, int]]:
+        return fc.get_entries(self.cache_dir, '.npy')
@@ -0,0 +1,85 @@
+"""This module holds the helpers of the file caches and stores shared by threads and processes.
+
+The files are written atomically (see :func:`write_atomic`), such that concurrent readers never see partially written
+files. The cache directories are bounded by evicting the least recently used files (see :func:`evict`), where the
+caches mark a file as recently used by updating its modification time, e.g. by :func:`os.utime`.
+"""
+import os
+import threading
+import typing as t
+
+
+def write_atomic(path: str, write_fn, binary: bool=True):
+    """Writes a file to a temporary file first, which then replaces the file.
+
+    Args:
+        path (str): The file path.
+        write_fn: The function writing the content to the open file, i.e. `write_fn(f)`.
+        binary (bool): Whether the file is opened in binary mode.
+    """
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, 'wb' if binary else 'w') as f:
+            write_fn(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_entries(directory: str, extension: str) -> t.List[t.Tuple[str, int, int]]:
+    """Get the files of a cache directory.
+
+    Args:
+        directory (str): The cache directory.
+        extension (str): The extension of the files to consider, e.g. '.npy'.
+
+    Returns:
+        list: The path, size in bytes and modification time (in nanoseconds) of each file.
+    """
+    entries = []
+    for file_name in os.listdir(directory):
+        if not file_name.endswith(extension):
+            continue
+        path = os.path.join(directory, file_name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:  # evicted concurrently
+            continue
+        entries.append((path, stat.st_size, stat.st_mtime_ns))
+    return entries
+
+
+def evict(directory: str, extension: str, max_bytes: int, remove_fn=None):
+    """Removes the least recently used files of a cache directory until its size does not exceed `max_bytes`.
+
+    Args:
+        directory (str): The cache directory.
+        extension (str): The extension of the files to consider (see :func:`get_entries`).
+        max_bytes (int): The maximum size of the files in bytes.
+        remove_fn: The function removing a file and the files belonging to it, i.e. `remove_fn(path)`.
+            If None, only the file is removed.
+    """
+    entries = sorted(get_entries(directory, extension), key=lambda entry: entry[2])  # least recently used first
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for path, entry_size, _ in entries:
+        if size <= max_bytes:
+            break
+        if remove_fn is None:
+            remove(path)
+        else:
+            remove_fn(path)
+        size -= entry_size
+
+
+def remove(path: str):
+    """Removes a file if it exists, i.e. if it was not removed concurrently.
+
+    Args:
+        path (str): The file path.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -1,9 +1,13 @@
 """The loading module holds classes to load data."""
 import abc
+import concurrent.futures as cf
 import enum
+import json
 import typing
 import os
 
+import pymia.data.filecache as fc
+
 
 class FilePathGenerator(metaclass=abc.ABCMeta):
     """Represents an abstract file path generator.
@@ -100,6 +104,17 @@ class FileSystemDataCrawler:
         >>>     print(id_, path)
         Patient1 {'Patient1': '/path/to/root_dir/Patient1', <MyImgType.T1: 1>: '/path/to/root_dir/Patient1/Image.mha', <MyImgType.GroundTruth: 2>: '/path/to/root_dir/Patient1/GroundTruth.mha'}
         Patient2 {'Patient2': '/path/to/root_dir/Patient2', <MyImgType.T1: 1>: '/path/to/root_dir/Patient2/Image.mha', <MyImgType.GroundTruth: 2>: '/path/to/root_dir/Patient2/GroundTruth.mha'}
+
+        For large directory trees (e.g. on network file systems), the directories can be scanned concurrently and
+        the scan can be cached, such that only directories modified since the last crawl are scanned again:
+
+        >>> crawler = FileSystemDataCrawler('/path/to/root_dir',
+        >>>                                 [MyImgType.T1, MyImgType.GroundTruth],
+        >>>                                 MyFilePathGenerator(),
+        >>>                                 MyDirFilter(),
+        >>>                                 '.mha',
+        >>>                                 num_threads=16,
+        >>>                                 cache_file='/path/to/crawl_cache.json')
     """
     
     def __init__(self,
@@ -107,7 +122,10 @@ class FileSystemDataCrawler:
                  file_keys: list,
                  file_path_generator: FilePathGenerator,
                  dir_filter: DirectoryFilter=None,
-                 file_extension: str='.nii.gz'):
+                 file_extension: str='.nii.gz',
+                 num_threads: int=1,
+                 cache_file: str=None,
+                 check_files: bool=False):
         """Initializes a new instance of the FileSystemDataCrawler class.
 
         Args:
@@ -118,6 +136,11 @@ class FileSystemDataCrawler:
                 data identifier to an data file path.
             dir_filter (DirectoryFilter): A directory filter, which filters a list of directories.
             file_extension (str): The data file extension (with or without dot).
+            num_threads (int): The number of threads scanning the directories concurrently.
+            cache_file (str): The path to a JSON file caching the directory scans. A directory is only scanned again
+                if its modification time changed. If None, no cache is used.
+            check_files (bool): Whether to check that the generated file paths exist. The check uses the directory
+                scans where possible. Raises a ValueError listing the missing files.
         """
         super().__init__()
 
@@ -126,6 +149,10 @@ class FileSystemDataCrawler:
         self.file_keys = file_keys
         self.file_path_generator = file_path_generator
         self.file_extension = file_extension if file_extension.startswith('.') else '.' + file_extension
+        self.num_threads = num_threads
+        self.cache_file = cache_file
+        self.check_files = check_files
+        self.directory_files = {}  # dict with key=path to data directory, value=set of the names in the directory
 
         # dict with key=id (i.e, directory name), value=path to data directory
         self.data = {}  # dict with key=id (i.e, directory name), value=dict with key=file_keys and value=path to file
@@ -144,6 +171,19 @@ class FileSystemDataCrawler:
 
             self.data[id_] = data_dict
 
+        if self.check_files:
+            missing_files = [data_dict[item] for data_dict in self.data.values() for item in self.file_keys
+                             if not self._file_exists(data_dict[item])]
+            if len(missing_files) > 0:
+                raise ValueError('{} data files do not exist: {}'.format(len(missing_files),
+                                                                         ', '.join(missing_files)))
+
+    def _file_exists(self, file_path: str) -> bool:
+        directory, file_name = os.path.split(file_path)
+        if directory in self.directory_files:
+            return file_name in self.directory_files[directory]
+        return os.path.exists(file_path)
+
     def _crawl_directories(self):
         """Crawls the directories, which contain data.
 
@@ -155,15 +195,60 @@ class FileSystemDataCrawler:
             raise ValueError('root_dir {} does not exist'.format(self.root_dir))
 
         # search the root directory for data directories
-        data_dirs = next(os.walk(self.root_dir))[1]
+        with os.scandir(self.root_dir) as entries:
+            data_dirs = [entry.name for entry in entries if entry.is_dir()]
 
         if self.dir_filter:
             # filter the data directories
             data_dirs = self.dir_filter.filter_directories(data_dirs)
 
+        cache = self._load_cache()
+        data_dir_paths = [os.path.join(self.root_dir, data_dir) for data_dir in data_dirs]
+        if self.num_threads > 1:
+            with cf.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+                scans = list(executor.map(lambda path: self._scan_directory(path, cache), data_dir_paths))
+        else:
+            scans = [self._scan_directory(path, cache) for path in data_dir_paths]
+        self._save_cache(dict(zip(data_dirs, scans)))
+
+        for path, (_, file_names) in zip(data_dir_paths, scans):
+            self.directory_files[path] = set(file_names)
+
         return {
-            data_dir: os.path.join(self.root_dir, data_dir)
-            for data_dir in data_dirs
-            if any(file.endswith(self.file_extension) for file  # check if directory contains data files
-                   in os.listdir(os.path.join(self.root_dir, data_dir)))
+            data_dir: path
+            for data_dir, path, (_, file_names) in zip(data_dirs, data_dir_paths, scans)
+            if any(file.endswith(self.file_extension) for file in file_names)  # check if directory contains data files
         }
+
+    @staticmethod
+    def _scan_directory(path: str, cache: dict) -> typing.Tuple[int, typing.List[str]]:
+        """Scans a directory unless it is cached and not modified since.
+
+        Returns:
+            tuple: The modification time (in ns) and the names in the directory.
+        """
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = cache.get(os.path.basename(path))
+        if cached is not None and cached[0] == mtime_ns:
+            return mtime_ns, cached[1]
+
+        with os.scandir(path) as entries:
+            return mtime_ns, [entry.name for entry in entries]
+
+    def _load_cache(self) -> dict:
+        if self.cache_file is None or not os.path.isfile(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+        except ValueError:
+            return {}  # corrupt cache
+        if cache.get('root_dir') != os.path.abspath(self.root_dir):
+            return {}
+        return cache['directories']
+
+    def _save_cache(self, scans: dict):
+        if self.cache_file is None:
+            return
+        cache = {'root_dir': os.path.abspath(self.root_dir), 'directories': scans}
+        fc.write_atomic(self.cache_file, lambda f: json.dump(cache, f), binary=False)
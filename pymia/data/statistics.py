@@ -0,0 +1,25 @@
+"""This module holds the intensity statistics helpers shared by the dataset creation and extraction.
+
+The statistics are computed at the dataset creation (see :class:`WriteStatisticsCallback`) and merged when reading
+sharded datasets (see :class:`ShardedReader`).
+"""
+import numpy as np
+
+
+def get_histogram_percentiles(histogram: np.ndarray, edges: np.ndarray, percentiles) -> np.ndarray:
+    """Approximates percentiles from a histogram by linear interpolation within the bins.
+
+    Args:
+        histogram (np.ndarray): The histogram of shape (bins, C).
+        edges (np.ndarray): The bin edges of shape (bins + 1,).
+        percentiles: The percentiles (0-100).
+
+    Returns:
+        np.ndarray: The percentiles of shape (P, C).
+    """
+    percentiles = np.asarray(percentiles, dtype=np.float64)
+    result = np.empty((len(percentiles), histogram.shape[1]))
+    for channel in range(histogram.shape[1]):
+        cumulative = np.concatenate([[0], np.cumsum(histogram[:, channel])])
+        result[:, channel] = np.interp(percentiles / 100 * cumulative[-1], cumulative, edges)
+    return result
@@ -94,6 +94,78 @@ class IntensityNormalization(Transform):
         return (arr - arr.mean()) / arr.std()
 
 
+class StatisticsIntensityNormalization(Transform):
+    """Normalizes the intensities to zero mean and unit variance with precomputed statistics.
+
+    Requires the statistics to be extracted by the :class:`StatisticsExtractor` and the channels to be the last
+    dimension of the entries. The normalization is a single multiply-add per channel. Channels with a standard
+    deviation not larger than `eps` (e.g. constant images) are only shifted to zero mean.
+    """
+
+    def __init__(self, level: str='dataset', entries=('images',), eps: float=1e-8) -> None:
+        """Initializes a new instance of the StatisticsIntensityNormalization class.
+
+        Args:
+            level (str): Whether to use the statistics of the 'dataset' or of the 'subject'.
+            entries (tuple of str): The entries to normalize.
+            eps (float): The minimal standard deviation to divide by.
+        """
+        super().__init__()
+        if level not in ('dataset', 'subject'):
+            raise ValueError('level must be "dataset" or "subject"')
+        self.level = level
+        self.entries = entries
+        self.eps = eps
+
+    def __call__(self, sample: dict) -> dict:
+        for entry in self.entries:
+            statistics = get_statistics(sample, entry)
+            prefix = 'subject_' if self.level == 'subject' else ''
+            std = np.asarray(statistics[prefix + 'std'], dtype=np.float64)
+            mean = np.asarray(statistics[prefix + 'mean'], dtype=np.float64)
+            scale = 1 / np.where(std > self.eps, std, 1)  # also catches NaN, e.g. of empty entries
+            offset = np.where(np.isfinite(mean), -mean * scale, 0)
+            sample[entry] = multiply_add(check_and_return(sample[entry], np.ndarray), scale, offset)
+        return sample
+
+
+class StatisticsIntensityRescale(Transform):
+    """Rescales the intensities to a range with precomputed statistics.
+
+    Requires the statistics to be extracted by the :class:`StatisticsExtractor` and the channels to be the last
+    dimension of the entries. The rescaling is a single multiply-add per channel.
+    """
+
+    def __init__(self, lower, upper, level: str='dataset', entries=('images',)) -> None:
+        """Initializes a new instance of the StatisticsIntensityRescale class.
+
+        Args:
+            lower: The lower bound of the range.
+            upper: The upper bound of the range.
+            level (str): Whether to use the statistics of the 'dataset' or of the 'subject'.
+            entries (tuple of str): The entries to rescale.
+        """
+        super().__init__()
+        if level not in ('dataset', 'subject'):
+            raise ValueError('level must be "dataset" or "subject"')
+        self.lower = lower
+        self.upper = upper
+        self.level = level
+        self.entries = entries
+
+    def __call__(self, sample: dict) -> dict:
+        for entry in self.entries:
+            statistics = get_statistics(sample, entry)
+            prefix = 'subject_' if self.level == 'subject' else ''
+            min_, max_ = statistics[prefix + 'min'], statistics[prefix + 'max']
+            if np.any(min_ == max_):
+                raise ValueError('cannot rescale when min == max')
+            scale = (self.upper - self.lower) / (max_ - min_)
+            sample[entry] = multiply_add(check_and_return(sample[entry], np.ndarray), scale,
+                                         self.lower - min_ * scale)
+        return sample
+
+
 class LambdaTransform(Transform):
 
     def __init__(self, lambda_fn, loop_axis=None, entries=('images',)) -> None:
@@ -344,6 +416,24 @@ class Mask(Transform):
         return sample
 
 
+def get_statistics(sample: dict, entry: str) -> dict:
+    if entry not in sample:
+        raise ValueError(ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
+    if '{}_statistics'.format(entry) not in sample:
+        raise ValueError(ENTRY_NOT_EXTRACTED_ERR_MSG.format('{}_statistics'.format(entry)))
+    return sample['{}_statistics'.format(entry)]
+
+
+def multiply_add(arr: np.ndarray, scale, offset) -> np.ndarray:
+    """Computes `arr * scale + offset` in the floating type of the array (float32 for non-floating arrays)."""
+    dtype = arr.dtype if np.issubdtype(arr.dtype, np.floating) else np.float32
+    scale = np.asarray(scale, dtype=dtype)
+    offset = np.asarray(offset, dtype=dtype)
+    result = np.multiply(arr, scale, dtype=dtype)
+    result += offset
+    return result
+
+
 def check_and_return(obj, type_):
     if not isinstance(obj, type_):
         raise ValueError("entry must be '{}'".format(type_.__name__))
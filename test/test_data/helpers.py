@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+import pymia.data.conversion as conv
+import pymia.data.creation as crt
+import pymia.data.creation.fileloader as load
+import pymia.data.subjectfile as subj
+
+
+class ArrayLoad(load.Load):
+    """Loads deterministic arrays derived from the file name instead of reading files."""
+
+    def __init__(self, shape=(4, 5, 6)) -> None:
+        self.shape = shape
+
+    def __call__(self, file_name: str, id_: str, category: str, subject_id: str):
+        seed = sum(ord(c) for c in file_name)
+        data = np.random.RandomState(seed).rand(*self.shape).astype(np.float32)
+        if category == 'labels':
+            data = (data > 0.5).astype(np.uint8)
+        return data, conv.ImageProperties(sitk.GetImageFromArray(data))
+
+
+def get_subject_files(count: int, root: str='/data'):
+    return [subj.SubjectFile('Subject_{}'.format(i),
+                             images={'T1': os.path.join(root, str(i), 'T1.mha'),
+                                     'T2': os.path.join(root, str(i), 'T2.mha')},
+                             labels={'GT': os.path.join(root, str(i), 'GT.mha')})
+            for i in range(count)]
+
+
+class DatasetTestCase(unittest.TestCase):
+    """Provides a temporary directory and builds datasets of :class:`ArrayLoad` subjects."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build(self, file_path, subject_files, callback_fn=crt.get_default_callbacks, load=ArrayLoad(), **kwargs):
+        """Builds a dataset with the callbacks of `callback_fn(writer)`, `kwargs` are passed to the traverser."""
+        with crt.get_writer(file_path) as writer:
+            crt.SubjectFileTraverser().traverse(subject_files, load=load, callback=callback_fn(writer), **kwargs)
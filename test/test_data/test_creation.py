@@ -0,0 +1,1015 @@
+import json
+import os
+import pickle
+import time
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+import pymia.data.conversion as conv
+import pymia.data.creation as crt
+import pymia.data.creation.callback as cb
+import pymia.data.creation.fileloader as load
+import pymia.data.creation.traverser as trav
+import pymia.data.definition as df
+import pymia.data.extraction as extr
+import pymia.data.indexexpression as expr
+import pymia.data.subjectfile as subj
+import pymia.data.transformation as tfm
+from .helpers import ArrayLoad, DatasetTestCase, get_subject_files
+
+
+class ScaledLoad(load.Load):
+    """Loads the files scaled by a factor."""
+
+    def __init__(self, scale) -> None:
+        self.scale = scale
+
+    def __call__(self, file_name: str, id_: str, category: str, subject_id: str):
+        data, properties = load.LoadDefault()(file_name, id_, category, subject_id)
+        return data * self.scale, properties
+
+
+class SlowArrayLoad(ArrayLoad):
+    """Loads the arrays with a delay."""
+
+    DELAY = 0.05
+
+    def __call__(self, file_name: str, id_: str, category: str, subject_id: str):
+        time.sleep(self.DELAY)
+        return super().__call__(file_name, id_, category, subject_id)
+
+
+class RecordCallback(cb.Callback):
+
+    def __init__(self) -> None:
+        self.subjects = []
+
+    def on_subject(self, params: dict):
+        self.subjects.append((params['subject_index'], params['images'], params['labels']))
+
+
+def get_statistics_callbacks(writer, percentiles=(1, 99)):
+    return crt.ComposeCallback([crt.get_default_callbacks(writer),
+                                crt.WriteStatisticsCallback(writer, percentiles=percentiles, histogram_bins=1000,
+                                                            histogram_range=(0, 1))])
+
+
+def get_foreground_callbacks(writer):
+    return crt.ComposeCallback([crt.get_default_callbacks(writer),
+                                crt.WriteForegroundCallback(writer, label_values=(1,))])
+
+
+def get_sparse_labels_transform():
+    # sparse labels such that some slices have no foreground
+    return tfm.LambdaTransform(lambda labels: labels * (np.arange(6) < 2), entries=('labels',))
+
+
+class TestParallelSubjectFileTraverser(unittest.TestCase):
+
+    def test_same_order_as_sequential(self):
+        subject_files = get_subject_files(7)
+
+        expected = RecordCallback()
+        crt.SubjectFileTraverser().traverse(subject_files, load=ArrayLoad(), callback=expected)
+
+        for max_in_flight in (1, 3):
+            actual = RecordCallback()
+            traverser = crt.ParallelSubjectFileTraverser(num_workers=2, max_in_flight=max_in_flight)
+            traverser.traverse(subject_files, load=ArrayLoad(), callback=actual)
+
+            self.assertEqual(len(actual.subjects), len(expected.subjects))
+            for (index, images, labels), (exp_index, exp_images, exp_labels) in zip(actual.subjects,
+                                                                                    expected.subjects):
+                self.assertEqual(index, exp_index)
+                np.testing.assert_array_equal(images, exp_images)
+                np.testing.assert_array_equal(labels, exp_labels)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, crt.ParallelSubjectFileTraverser, num_workers=0)
+        self.assertRaises(ValueError, crt.ParallelSubjectFileTraverser, max_in_flight=0)
+
+
+class TestPrefetchSubjectFileTraverser(unittest.TestCase):
+
+    def test_same_order_as_sequential(self):
+        subject_files = get_subject_files(7)
+        transform = tfm.IntensityNormalization(entries=('images',))
+
+        expected = RecordCallback()
+        crt.SubjectFileTraverser().traverse(subject_files, load=ArrayLoad(), callback=expected, transform=transform)
+
+        for prefetch_depth, max_prefetch_bytes in ((1, None), (3, None), (3, 1)):
+            actual = RecordCallback()
+            traverser = crt.PrefetchSubjectFileTraverser(prefetch_depth=prefetch_depth,
+                                                         max_prefetch_bytes=max_prefetch_bytes)
+            traverser.traverse(subject_files, load=ArrayLoad(), callback=actual, transform=transform)
+
+            self.assertEqual([s[0] for s in actual.subjects], [s[0] for s in expected.subjects])
+            for (_, images, labels), (_, exp_images, exp_labels) in zip(actual.subjects, expected.subjects):
+                np.testing.assert_array_equal(images, exp_images)
+                np.testing.assert_array_equal(labels, exp_labels)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, crt.PrefetchSubjectFileTraverser, prefetch_depth=0)
+        self.assertRaises(ValueError, crt.PrefetchSubjectFileTraverser, num_threads=0)
+
+
+class TestProcessSubject(unittest.TestCase):
+
+    def test_stacked_equals_default_concat(self):
+        subject_file = get_subject_files(1)[0]
+        concat_fn = lambda data: trav.default_concat(data)  # not the default, i.e. np.stack on the loaded list
+        expected = trav.process_subject(0, subject_file, ('images', 'labels'), ArrayLoad(), concat_fn=concat_fn)
+        actual = trav.process_subject(0, subject_file, ('images', 'labels'), ArrayLoad())
+        for category in ('images', 'labels'):
+            self.assertEqual(actual[category].dtype, expected[category].dtype)
+            np.testing.assert_array_equal(actual[category], expected[category])
+
+    def test_stacked_type_promotion(self):
+        class MixedLoad(ArrayLoad):
+            def __call__(self, file_name, id_, category, subject_id):
+                data, properties = super().__call__(file_name, id_, category, subject_id)
+                return (data.astype(np.float64) if id_ == 'T2' else data.astype(np.float16)), properties
+
+        subject_file = get_subject_files(1)[0]
+        actual = trav.process_subject(0, subject_file, ('images',), MixedLoad())
+        self.assertEqual(actual['images'].shape, (4, 5, 6, 2))
+        self.assertEqual(actual['images'].dtype, np.float64)
+
+
+class TestChunkedLayout(DatasetTestCase):
+
+    def test_slice_indexing(self):
+        layout = crt.ChunkedLayout.from_indexing_strategy(extr.SliceIndexing(1), compression='gzip',
+                                                          compression_level=2)
+        options = layout.get_options('data/images/0', (5, 6, 7, 2))
+        self.assertEqual(options, {'chunks': (5, 1, 7, 2), 'compression': 'gzip', 'compression_opts': 2,
+                                   'shuffle': True})
+
+    def test_patch_wise_indexing(self):
+        layout = crt.ChunkedLayout.from_indexing_strategy(extr.PatchWiseIndexing((2, 2, 10)), compression='lzf',
+                                                          shuffle=False)
+        options = layout.get_options('data/images/0', (5, 6, 7, 2))
+        self.assertEqual(options, {'chunks': (2, 2, 7, 2), 'compression': 'lzf', 'shuffle': False})
+
+    def test_unaligned_indexing(self):
+        self.assertRaises(ValueError, crt.ChunkedLayout.from_indexing_strategy, extr.VoxelWiseIndexing())
+
+    def test_meta_entries_unchanged(self):
+        layout = crt.ChunkedLayout.from_indexing_strategy(extr.SliceIndexing(0))
+        self.assertEqual(layout.get_options('meta/info/shapes', (10, 3)), {})
+        self.assertEqual(layout.get_options('data/images/0', ()), {})
+
+    def test_write(self):
+        layout = crt.ChunkedLayout.from_indexing_strategy(extr.SliceIndexing(0), compression='lzf')
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        data = np.random.rand(4, 5, 6).astype(np.float32)
+        with crt.Hdf5Writer(file_path, layout=layout) as writer:
+            writer.write('data/images/0', data, dtype=data.dtype)
+        with extr.Hdf5Reader(file_path) as reader:
+            self.assertEqual(reader.h5['data/images/0'].chunks, (1, 5, 6))
+            np.testing.assert_array_equal(reader.read('data/images/0'), data)
+
+
+class TestAppend(DatasetTestCase):
+
+    def test_append_equals_full_build(self):
+        subject_files = get_subject_files(6, '/data') + get_subject_files(5, '/other')
+        for extension in ('.h5', '.pymia'):
+            full_path = os.path.join(self.dir, 'full' + extension)
+            append_path = os.path.join(self.dir, 'append' + extension)
+            self.build(full_path, subject_files)
+            self.build(append_path, subject_files[:4])
+            self.build(append_path, subject_files[4:], subject_index_offset=4)
+
+            with extr.get_reader(full_path, direct_open=True) as expected, \
+                    extr.get_reader(append_path, direct_open=True) as actual:
+                self.assertEqual(actual.get_subject_entries(), expected.get_subject_entries())
+                self.assertEqual(actual.get_subjects(), expected.get_subjects())
+                for entry in ('meta/files/file_root', 'meta/files/images_files', 'meta/info/shapes',
+                              'meta/data/images/entries', 'meta/data/labels/shapes'):
+                    np.testing.assert_array_equal(actual.read(entry), expected.read(entry))
+                for entry in expected.get_subject_entries():
+                    np.testing.assert_array_equal(actual.read(entry), expected.read(entry))
+
+    def test_inconsistent_names(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(file_path, get_subject_files(2))
+        subject_files = [subj.SubjectFile('Subject_2', images={'T1': '/data/2/T1.mha', 'FLAIR': '/data/2/FLAIR.mha'},
+                                          labels={'GT': '/data/2/GT.mha'})]
+        self.assertRaises(ValueError, self.build, file_path, subject_files, subject_index_offset=2)
+
+    def test_inconsistent_offset(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(file_path, get_subject_files(2))
+        for subject_index_offset in (1, 3):
+            self.assertRaises(ValueError, self.build, file_path, get_subject_files(1),
+                              subject_index_offset=subject_index_offset)
+        with extr.get_reader(file_path, direct_open=True) as reader:
+            self.assertEqual(reader.get_subjects(), ['Subject_0', 'Subject_1'])
+            self.assertEqual(len(reader.get_subject_entries()), 2)
+
+
+class TestBufferedWrite(DatasetTestCase):
+
+    def test_flush_interval(self):
+        subject_files = get_subject_files(5)
+        full_path = os.path.join(self.dir, 'full.h5')
+        flushed_path = os.path.join(self.dir, 'flushed.h5')
+        self.build(full_path, subject_files)
+        self.build(flushed_path, subject_files,
+                   callback_fn=lambda writer: crt.get_default_callbacks(writer, flush_interval=2))
+
+        with extr.get_reader(full_path, direct_open=True) as expected, \
+                extr.get_reader(flushed_path, direct_open=True) as actual:
+            self.assertEqual(actual.get_subjects(), expected.get_subjects())
+            for entry in ('meta/files/images_files', 'meta/files/labels_files', 'meta/info/shapes',
+                          'meta/info/directions'):
+                np.testing.assert_array_equal(actual.read(entry), expected.read(entry))
+
+
+class TestProfile(DatasetTestCase):
+
+    def test_profile(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        summary_file = os.path.join(self.dir, 'profile.json')
+        with crt.get_writer(file_path) as writer:
+            callback = crt.ProfileCallback(crt.get_default_callbacks(writer), summary_file=summary_file,
+                                           verbose=False)
+            crt.PrefetchSubjectFileTraverser().traverse(get_subject_files(3), load=ArrayLoad(), callback=callback,
+                                                        transform=tfm.IntensityNormalization())
+        with open(summary_file) as f:
+            summary = json.load(f)
+        self.assertEqual(summary['subjects'], 3)
+        self.assertEqual(summary['peak_array_bytes'], 4 * 5 * 6 * 2 * 4)
+        for stage in ('load', 'concat', 'transform', 'wait', 'callback/WriteDataCallback'):
+            self.assertIn(stage, summary['stage_times'])
+
+    def test_sequential_wait(self):
+        with crt.get_writer(os.path.join(self.dir, 'dataset.h5')) as writer:
+            callback = crt.ProfileCallback(crt.get_default_callbacks(writer), verbose=False)
+            crt.SubjectFileTraverser().traverse(get_subject_files(2), load=SlowArrayLoad(), callback=callback)
+        self.assertGreaterEqual(callback.stage_times['load'], 2 * 3 * SlowArrayLoad.DELAY)
+        self.assertLess(callback.stage_times['wait'], SlowArrayLoad.DELAY)  # nothing is waited for
+
+    def test_profile_only_if_requested(self):
+        subject_file = get_subject_files(1)[0]
+        self.assertNotIn('profile', trav.process_subject(0, subject_file, ('images',), ArrayLoad()))
+        profile = trav.process_subject(0, subject_file, ('images',), ArrayLoad(), profile=True)['profile']
+        self.assertEqual(set(profile), {'load', 'concat', 'transform', 'bytes_read'})
+
+
+class TestSubjectEntryShapes(DatasetTestCase):
+
+    def test_all_shapes(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(file_path, get_subject_files(3))
+        with extr.get_reader(file_path, direct_open=True) as reader:
+            self.assertEqual(reader.get_subject_entries(), ['data/images/0', 'data/images/1', 'data/images/2'])
+            self.assertEqual(reader.get_all_shapes(), [(4, 5, 6, 2)] * 3)
+            reader.category = 'labels'
+            self.assertEqual(reader.get_all_shapes(), [(4, 5, 6)] * 3)
+
+        # datasets without the entry names and shapes
+        with crt.get_writer(file_path) as writer:
+            del writer.h5['meta/data']
+        with extr.get_reader(file_path, direct_open=True) as reader:
+            self.assertEqual(reader.get_subject_entries(), ['data/images/0', 'data/images/1', 'data/images/2'])
+            self.assertEqual(reader.get_all_shapes(), [(4, 5, 6, 2)] * 3)
+
+
+class CountingArrayLoad(ArrayLoad):
+    loaded = []  # class attribute, such that the build fingerprint does not change
+
+    def __call__(self, file_name: str, id_: str, category: str, subject_id: str):
+        CountingArrayLoad.loaded.append(subject_id)
+        return super().__call__(file_name, id_, category, subject_id)
+
+
+class TestBuildManifest(DatasetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.subject_files = get_subject_files(4, self.dir)
+        for subject_file in self.subject_files:
+            for category in subject_file.categories.values():
+                for file_path in category.entries.values():
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    open(file_path, 'w').close()
+        CountingArrayLoad.loaded = []
+
+    def build_with_manifest(self, file_path, previous_file_path=None, transform=None, fingerprint=None,
+                            callback_fn=crt.get_default_callbacks):
+        self.build(file_path, self.subject_files, load=CountingArrayLoad(), transform=transform,
+                   manifest=crt.BuildManifest(previous_file_path, fingerprint=fingerprint), callback_fn=callback_fn)
+
+    def test_unchanged_subjects_skipped(self):
+        first_path = os.path.join(self.dir, 'first.h5')
+        second_path = os.path.join(self.dir, 'second.h5')
+        self.build_with_manifest(first_path)
+        self.assertEqual(len(CountingArrayLoad.loaded), 4 * 3)
+
+        with open(self.subject_files[2].categories['images'].entries['T2'], 'w') as f:
+            f.write('changed')
+        CountingArrayLoad.loaded = []
+        self.build_with_manifest(second_path, first_path)
+        self.assertEqual(CountingArrayLoad.loaded, ['Subject_2'] * 3)
+
+        with extr.get_reader(first_path, direct_open=True) as expected, \
+                extr.get_reader(second_path, direct_open=True) as actual:
+            self.assertEqual(actual.get_subjects(), expected.get_subjects())
+            self.assertNotEqual(actual.read('meta/build/subject_hashes')[2],
+                                expected.read('meta/build/subject_hashes')[2])
+            for entry in expected.get_subject_entries():
+                np.testing.assert_array_equal(actual.read(entry), expected.read(entry))
+            np.testing.assert_array_equal(actual.read('meta/info/shapes'), expected.read('meta/info/shapes'))
+
+    def test_quantized_subjects_copied(self):
+        first_path = os.path.join(self.dir, 'first.h5')
+        second_path = os.path.join(self.dir, 'second.h5')
+        def callback_fn(writer):
+            return crt.get_default_callbacks(writer, dtypes={'images': np.int16})
+
+        self.build_with_manifest(first_path, callback_fn=callback_fn)
+        CountingArrayLoad.loaded = []
+        self.build_with_manifest(second_path, first_path, callback_fn=callback_fn)
+        self.assertEqual(CountingArrayLoad.loaded, [])
+
+        with extr.get_reader(first_path, direct_open=True, dequantize=False) as expected, \
+                extr.get_reader(second_path, direct_open=True, dequantize=False) as actual:
+            for entry in expected.get_subject_entries():
+                self.assertEqual(actual.read(entry).dtype, np.int16)
+                np.testing.assert_array_equal(actual.read(entry), expected.read(entry))
+            for entry in ('meta/quantization/images/scale', 'meta/quantization/images/offset', 'meta/info/spacing',
+                          'meta/info/origins'):
+                np.testing.assert_array_equal(actual.read(entry), expected.read(entry))
+
+    def test_not_picklable_configuration(self):
+        self.assertRaises(ValueError, crt.manifest.get_fingerprint, lambda x: x * 2)
+
+        first_path = os.path.join(self.dir, 'first.h5')
+        second_path = os.path.join(self.dir, 'second.h5')
+        transform = tfm.LambdaTransform(lambda x: x * 2)
+        with self.assertWarns(UserWarning):
+            self.build_with_manifest(first_path, transform=transform)
+        CountingArrayLoad.loaded = []
+        with self.assertWarns(UserWarning):
+            self.build_with_manifest(second_path, first_path, transform=transform)
+        self.assertEqual(len(CountingArrayLoad.loaded), 4 * 3)  # nothing skipped
+
+        # an explicit fingerprint allows skipping
+        versioned_path = os.path.join(self.dir, 'v1.h5')
+        self.build_with_manifest(versioned_path, transform=transform, fingerprint='v1')
+        CountingArrayLoad.loaded = []
+        self.build_with_manifest(os.path.join(self.dir, 'v1_again.h5'), versioned_path,
+                                 transform=transform, fingerprint='v1')
+        self.assertEqual(CountingArrayLoad.loaded, [])
+        CountingArrayLoad.loaded = []
+        self.build_with_manifest(os.path.join(self.dir, 'v2.h5'), versioned_path,
+                                 transform=transform, fingerprint='v2')
+        self.assertEqual(len(CountingArrayLoad.loaded), 4 * 3)
+
+
+class TestStatistics(DatasetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.subject_files = get_subject_files(5)
+
+    def build_with_statistics(self, file_path, subject_files, subject_index_offset=0):
+        self.build(file_path, subject_files, subject_index_offset=subject_index_offset,
+                   callback_fn=lambda writer: get_statistics_callbacks(writer, percentiles=(5, 50, 95)))
+
+    def test_statistics(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build_with_statistics(file_path, self.subject_files)
+
+        images = [trav.process_subject(i, s, ('images',), ArrayLoad())['images'].reshape(-1, 2)
+                  for i, s in enumerate(self.subject_files)]
+        all_images = np.concatenate(images).astype(np.float64)
+
+        dataset = extr.ParameterizableDataset(file_path, extr.SliceIndexing(), extr.StatisticsExtractor())
+        statistics = dataset.direct_extract(dataset.extractor, 3)['images_statistics']
+        dataset.close_reader()
+        np.testing.assert_allclose(statistics['mean'], all_images.mean(axis=0))
+        np.testing.assert_allclose(statistics['std'], all_images.std(axis=0))
+        np.testing.assert_allclose(statistics['min'], all_images.min(axis=0))
+        np.testing.assert_allclose(statistics['max'], all_images.max(axis=0))
+        np.testing.assert_allclose(statistics['percentiles'], np.percentile(all_images, (5, 50, 95), axis=0),
+                                   atol=2e-3)
+        np.testing.assert_allclose(statistics['subject_mean'], images[3].mean(axis=0, dtype=np.float64))
+        np.testing.assert_allclose(statistics['subject_percentiles'], np.percentile(images[3], (5, 50, 95), axis=0))
+
+        sample = {'images': images[3].reshape(4, 5, 6, 2), 'images_statistics': statistics}
+        normalized = tfm.StatisticsIntensityNormalization(level='subject')(sample)['images']
+        self.assertEqual(normalized.dtype, np.float32)
+        np.testing.assert_allclose(normalized.mean(axis=(0, 1, 2)), 0, atol=1e-5)
+        np.testing.assert_allclose(normalized.std(axis=(0, 1, 2)), 1, atol=1e-5)
+
+        sample = {'images': images[3].reshape(4, 5, 6, 2), 'images_statistics': statistics}
+        rescaled = tfm.StatisticsIntensityRescale(-1, 1)(sample)['images']
+        self.assertTrue(rescaled.min() >= -1 - 1e-6 and rescaled.max() <= 1 + 1e-6)
+
+    def test_normalization_of_constant_channel(self):
+        statistics = {'mean': np.array([2., 1.]), 'std': np.array([0., 2.]),
+                      'subject_mean': np.array([np.nan, 1.]), 'subject_std': np.array([np.nan, 2.])}
+        for level in ('dataset', 'subject'):
+            images = np.stack([np.full((3, 4), 2, np.float32), np.full((3, 4), 3, np.float32)], axis=-1)
+            sample = {'images': images, 'images_statistics': statistics}
+            normalized = tfm.StatisticsIntensityNormalization(level=level)(sample)['images']
+            self.assertTrue(np.all(np.isfinite(normalized)))
+            np.testing.assert_allclose(normalized[..., 1], 1)
+
+    def test_append_equals_full_build(self):
+        full_path = os.path.join(self.dir, 'full.h5')
+        append_path = os.path.join(self.dir, 'append.h5')
+        self.build_with_statistics(full_path, self.subject_files)
+        self.build_with_statistics(append_path, self.subject_files[:2])
+        self.build_with_statistics(append_path, self.subject_files[2:], subject_index_offset=2)
+
+        with extr.get_reader(full_path, direct_open=True) as expected, \
+                extr.get_reader(append_path, direct_open=True) as actual:
+            for statistic in ('mean', 'std', 'min', 'max', 'histogram', 'percentiles', 'subject_std'):
+                entry = 'meta/statistics/images/{}'.format(statistic)
+                np.testing.assert_allclose(actual.read(entry), expected.read(entry))
+
+
+class NegativeIndexing(extr.IndexingStrategy):
+    """Indexes slices and slabs along the third axis by negative indices."""
+
+    def __call__(self, shape):
+        return [expr.IndexExpression(index, axis=2) for index in (-6, -1, (-2, None), (-6, -4), (-1, None))]
+
+
+class TestForeground(DatasetTestCase):
+
+    def build_with_foreground(self, file_path):
+        self.build(file_path, get_subject_files(3), transform=get_sparse_labels_transform(),
+                   callback_fn=get_foreground_callbacks)
+
+    def test_select_foreground_indices(self):
+        for extension in ('.h5', '.pymia'):
+            file_path = os.path.join(self.dir, 'dataset' + extension)
+            self.build_with_foreground(file_path)
+
+            for indexing in (extr.SliceIndexing((0, 2)), extr.EmptyIndexing()):
+                dataset = extr.ParameterizableDataset(file_path, indexing, extr.DataExtractor(('labels',)))
+                expected = extr.select_indices(dataset, extr.WithForegroundSelection())
+                self.assertEqual(extr.select_foreground_indices(dataset, label_index=0), expected)
+                dataset.close_reader()
+
+            dataset = extr.ParameterizableDataset(file_path, extr.PatchWiseIndexing((2, 5, 2)),
+                                                  extr.DataExtractor(('labels',)))
+            expected = extr.select_indices(dataset, extr.WithForegroundSelection())
+            self.assertEqual(extr.select_foreground_indices(dataset), expected)
+
+            foreground = dataset.direct_extract(extr.ForegroundExtractor(), 1)['labels_foreground']
+            labels = dataset.direct_extract(extr.DataExtractor(('labels',)), 1)['labels']
+            dataset.close_reader()
+            self.assertEqual(foreground['counts'].tolist(), [labels.sum()])
+            self.assertEqual(foreground['bbox'][0, 2].tolist(), [0, 2])
+            np.testing.assert_array_equal(foreground['slice_counts'][1][0], labels.sum(axis=(0, 2)))
+
+    def test_select_foreground_indices_vectorized(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build_with_foreground(file_path)
+
+        for indexing in (NegativeIndexing(), extr.SliceIndexing(2)):
+            dataset = extr.ParameterizableDataset(file_path, indexing, extr.DataExtractor(('labels',)))
+            dataset.indices.ITER_CHUNK_SIZE = 4  # samples of a subject in several chunks
+            expected = extr.select_indices(dataset, extr.WithForegroundSelection())
+            self.assertEqual(extr.select_foreground_indices(dataset), expected)
+            dataset.close_reader()
+
+
+class TestQuantization(DatasetTestCase):
+
+    def test_quantize(self):
+        data = np.random.RandomState(1).rand(4, 5, 2).astype(np.float32) * [100, 1000]
+        quantized, scale, offset = crt.quantize(data, np.int16, channels=2)
+        self.assertEqual(quantized.dtype, np.int16)
+        np.testing.assert_allclose(quantized * scale + offset, data, atol=np.max(scale))
+
+        labels = np.arange(10, dtype=np.int64)
+        quantized, scale, offset = crt.quantize(labels, np.uint8)
+        self.assertEqual((quantized.dtype, scale, offset), (np.uint8, 1., 0.))
+        np.testing.assert_array_equal(quantized, labels)
+
+    def test_dequantize(self):
+        for extension in ('.h5', '.pymia'):
+            full_path = os.path.join(self.dir, 'full' + extension)
+            quantized_path = os.path.join(self.dir, 'quantized' + extension)
+            self.build(full_path, get_subject_files(3))
+            self.build(quantized_path, get_subject_files(3), callback_fn=lambda writer: crt.get_default_callbacks(
+                writer, dtypes={'images': np.uint16, 'labels': np.uint8}))
+
+            extractor = extr.DataExtractor(('images', 'labels'))
+            dataset = extr.ParameterizableDataset(full_path, extr.SliceIndexing(2), extractor)
+            expected = dataset[7]
+            dataset.close_reader()
+            dataset = extr.ParameterizableDataset(quantized_path, extr.SliceIndexing(2), extractor)
+            actual = dataset[7]
+            dataset.close_reader()
+            np.testing.assert_allclose(actual['images'], expected['images'], atol=1e-4)
+            self.assertEqual(actual['labels'].dtype, np.uint8)
+            np.testing.assert_array_equal(actual['labels'], expected['labels'])
+
+            dataset = extr.ParameterizableDataset(quantized_path, extr.SliceIndexing(2), extr.ComposeExtractor(
+                [extractor, extr.QuantizationExtractor()]), dequantize=False)
+            raw = dataset[7]
+            dataset.close_reader()
+            self.assertEqual(raw['images'].dtype, np.uint16)
+            np.testing.assert_allclose(raw['images'] * raw['images_scale'] + raw['images_offset'],
+                                       expected['images'], atol=1e-4)
+
+    def test_append_quantized(self):
+        subject_files = get_subject_files(3)
+        full_path = os.path.join(self.dir, 'full.h5')
+        append_path = os.path.join(self.dir, 'append.h5')
+        self.build(full_path, subject_files)
+        self.build(append_path, subject_files[:2])
+        # the existing labels are stored as uint8 without quantization entries
+        self.build(append_path, subject_files[2:], subject_index_offset=2,
+                   callback_fn=lambda writer: crt.get_default_callbacks(writer, dtypes={'labels': np.uint8}))
+
+        with extr.get_reader(full_path, direct_open=True) as expected, \
+                extr.get_reader(append_path, direct_open=True) as actual:
+            np.testing.assert_array_equal(actual.read(df.QUANTIZATION_PLACEHOLDER.format('labels', 'scale')),
+                                          np.ones((3, 1)))
+            np.testing.assert_array_equal(actual.read(df.QUANTIZATION_PLACEHOLDER.format('labels', 'offset')),
+                                          np.zeros((3, 1)))
+            for subject_index in range(3):
+                entry = '{}/{}'.format(df.DATA_PLACEHOLDER.format('labels'), subject_index)
+                self.assertEqual(actual.read(entry).dtype, np.uint8)
+                np.testing.assert_array_equal(actual.read(entry), expected.read(entry))
+
+        # the existing images are stored as float32
+        self.assertRaises(ValueError, self.build, append_path, get_subject_files(1), subject_index_offset=3,
+                          callback_fn=lambda writer: crt.get_default_callbacks(writer, dtypes={'images': np.uint16}))
+
+
+class TestImageProperties(DatasetTestCase):
+
+    def write_image(self, file_name, spacing=(1., 2., 3.)):
+        image = sitk.GetImageFromArray(np.zeros((4, 5, 6), dtype=np.int16))
+        image.SetSpacing(spacing)
+        image.SetOrigin((1., -2., 3.5))
+        file_path = os.path.join(self.dir, file_name)
+        sitk.WriteImage(image, file_path)
+        return file_path
+
+    def test_from_file(self):
+        file_path = self.write_image('image.mha')
+        expected = conv.ImageProperties(sitk.ReadImage(file_path))
+        actual = conv.ImageProperties.from_file(file_path)
+        self.assertEqual(actual, expected)
+        self.assertEqual(actual.pixel_id, expected.pixel_id)
+        self.assertEqual(actual.number_of_components_per_pixel, expected.number_of_components_per_pixel)
+
+    def test_check_subject_properties(self):
+        subject_file = subj.SubjectFile('Subject_1', images={'T1': self.write_image('T1.mha'),
+                                                             'T2': self.write_image('T2.mha')},
+                                        labels={'GT': self.write_image('GT.mha')})
+        crt.check_subject_properties([subject_file], num_threads=2)
+        properties = crt.load_subject_properties([subject_file], categories=('labels',))
+        self.assertEqual(list(properties[0].keys()), ['labels'])
+
+        subject_file.categories['labels'].entries['GT'] = self.write_image('GT2.mha', spacing=(1., 1., 1.))
+        self.assertRaises(ValueError, crt.check_subject_properties, [subject_file])
+
+    def test_write_image_information(self):
+        subject_files = [subj.SubjectFile('Subject_{}'.format(i), images={'T1': self.write_image('T1_{}.mha'.format(i),
+                                                                                                  (1., 2., i + 1.))},
+                                          labels={'GT': self.write_image('GT_{}.mha'.format(i), (1., 2., i + 1.))})
+                         for i in range(2)]
+        full_path = os.path.join(self.dir, 'full.h5')
+        with crt.get_writer(full_path) as writer:
+            crt.SubjectFileTraverser().traverse(subject_files, callback=crt.get_default_callbacks(writer))
+        header_path = os.path.join(self.dir, 'header.h5')
+        with crt.get_writer(header_path) as writer:
+            crt.write_image_information(writer, subject_files, num_threads=2)
+        callback_path = os.path.join(self.dir, 'callback.h5')
+        with crt.get_writer(callback_path) as writer:
+            callback = crt.WriteImageInformationCallback(writer, load=crt.LoadDefault())
+            crt.SubjectFileTraverser().traverse(subject_files, callback=callback)
+
+        with extr.get_reader(full_path, direct_open=True) as expected:
+            for file_path in (header_path, callback_path):
+                with extr.get_reader(file_path, direct_open=True) as actual:
+                    for entry in (df.INFO_SHAPE, df.INFO_ORIGIN, df.INFO_DIRECTION, df.INFO_SPACING):
+                        np.testing.assert_array_equal(actual.read(entry), expected.read(entry))
+
+
+class TestPyramid(DatasetTestCase):
+
+    def test_downsample(self):
+        data = np.arange(5 * 4 * 2, dtype=np.float32).reshape(5, 4, 2)
+        downsampled = crt.downsample(data, 2, 'mean', image_dimension=2)
+        self.assertEqual(downsampled.shape, (3, 2, 2))
+        self.assertEqual(downsampled[0, 0, 1], data[:2, :2, 1].mean())
+        self.assertEqual(downsampled[2, 1, 0], data[4, 2:, 0].mean())  # edge padded
+
+        labels = np.array([[1, 1, 0, 2], [1, 0, 2, 2]], dtype=np.uint8)
+        np.testing.assert_array_equal(crt.downsample(labels, 2, 'mode', image_dimension=2), [[1, 2]])
+        np.testing.assert_array_equal(crt.downsample(labels, 2, 'nearest', image_dimension=2), [[0, 2]])
+
+    def test_voxel_position_across_levels(self):
+        class PositionLoad(load.Load):
+            """Loads the voxel index along the first axis, i.e. the physical position in voxels."""
+
+            def __call__(self, file_name, id_, category, subject_id):
+                data = np.broadcast_to(np.arange(9)[:, None, None], (9, 4, 4)).astype(np.float32)
+                image = sitk.GetImageFromArray(data)
+                image.SetOrigin((-3., 5., 10.))
+                image.SetSpacing((1., 1., 0.5))
+                if category == 'labels':
+                    data = data.astype(np.uint8)
+                return data, conv.ImageProperties(image)
+
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(file_path, get_subject_files(1), load=PositionLoad(), concat_fn=lambda data: data[0],
+                   callback_fn=lambda writer: crt.ComposeCallback(
+                       [crt.get_default_callbacks(writer),
+                        crt.WritePyramidCallback(writer, factors=(2, 3), label_method='nearest')]))
+
+        with extr.get_reader(file_path, direct_open=True) as reader:
+            for factor in (2, 3):
+                images = reader.read('pyramid/{}/images/0'.format(factor))
+                labels = reader.read('pyramid/{}/labels/0'.format(factor))
+                origin_z = reader.read('meta/pyramid/{}/origins'.format(factor))[0, 2]
+                spacing_z = reader.read('meta/pyramid/{}/spacing'.format(factor))[0, 2]
+                for level_index in range(len(images) - 1):  # the last block is edge padded
+                    # the position (in voxels of the full resolution) of the level's voxel
+                    position = (origin_z + level_index * spacing_z - 10.) / 0.5
+                    self.assertAlmostEqual(images[level_index, 0, 0], position)
+                    self.assertLessEqual(abs(labels[level_index, 0, 0] - position), 0.5)
+
+    def test_extract_pyramid_level(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(file_path, get_subject_files(2), load=ArrayLoad((8, 8, 6)),
+                   callback_fn=lambda writer: crt.ComposeCallback(
+                       [crt.get_default_callbacks(writer), crt.WritePyramidCallback(writer, factors=(2, 4))]))
+
+        dataset = extr.ParameterizableDataset(file_path, extr.SliceIndexing(), extr.DataExtractor(('images',
+                                                                                                    'labels')))
+        full = dataset.direct_extract(dataset.extractor, 1)
+        sample = dataset.direct_extract(extr.DataExtractor(('images', 'labels'), pyramid_factor=2), 1,
+                                        expr.IndexExpression(5, 0))
+        with extr.get_reader(file_path, direct_open=True) as reader:
+            shapes = reader.read('meta/pyramid/4/shapes')
+            spacing = reader.read('meta/pyramid/4/spacing')
+        dataset.close_reader()
+
+        np.testing.assert_allclose(sample['images'], crt.downsample(full['images'], 2)[2], rtol=1e-6)
+        np.testing.assert_array_equal(sample['labels'], crt.downsample(full['labels'], 2, 'mode')[2])
+        np.testing.assert_array_equal(shapes[1], [2, 2, 2])
+        np.testing.assert_array_equal(spacing[1], [4, 4, 4])
+
+
+class TestShardedDataset(DatasetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.subject_files = get_subject_files(5)
+
+    def test_sharded_equals_single(self):
+        single_path = os.path.join(self.dir, 'single.h5')
+        self.build(single_path, self.subject_files, callback_fn=get_statistics_callbacks)
+        sharded_path = os.path.join(self.dir, 'dataset.shards')
+        shard_paths = crt.create_sharded_dataset(sharded_path, self.subject_files, 3, load=ArrayLoad(),
+                                                 callback_fn=get_statistics_callbacks)
+        self.assertEqual(len(shard_paths), 3)
+
+        with extr.get_reader(single_path, direct_open=True) as expected, \
+                extr.get_reader(sharded_path, direct_open=True) as actual:
+            self.assertIsInstance(actual, extr.ShardedReader)
+            self.assertEqual(actual.get_subjects(), expected.get_subjects())
+            self.assertEqual(actual.read(df.FILES_ROOT), expected.read(df.FILES_ROOT))
+            self.assertEqual(actual.read('meta/files/images_files'), expected.read('meta/files/images_files'))
+            np.testing.assert_array_equal(actual.read(df.INFO_SHAPE), expected.read(df.INFO_SHAPE))
+            for category in ('images', 'labels'):
+                entry = df.DATA_ENTRIES_PLACEHOLDER.format(category)
+                self.assertEqual(actual.read(entry), expected.read(entry))
+                self.assertEqual(tuple(actual.get_shape(entry)), tuple(expected.get_shape(entry)))
+                self.assertEqual(actual.read(entry, expr.IndexExpression(4)),
+                                 expected.read(entry, expr.IndexExpression(4)))
+            for statistic in ('count', 'mean', 'std', 'min', 'max', 'histogram', 'subject_std'):
+                entry = 'meta/statistics/images/{}'.format(statistic)
+                np.testing.assert_allclose(actual.read(entry), expected.read(entry))
+            np.testing.assert_allclose(actual.read('meta/statistics/images/percentiles'),
+                                       expected.read('meta/statistics/images/percentiles'), atol=1e-6)
+
+        single = extr.ParameterizableDataset(single_path, extr.SliceIndexing(),
+                                             extr.ComposeExtractor([extr.DataExtractor(('images', 'labels')),
+                                                                    extr.SubjectExtractor()]))
+        sharded = extr.ParameterizableDataset(sharded_path, extr.SliceIndexing(),
+                                              extr.ComposeExtractor([extr.DataExtractor(('images', 'labels')),
+                                                                     extr.SubjectExtractor()]))
+        self.assertEqual(len(sharded), len(single))
+        for i in (0, 7, len(single) - 1):
+            self.assertEqual(sharded[i]['subject'], single[i]['subject'])
+            np.testing.assert_array_equal(sharded[i]['images'], single[i]['images'])
+            np.testing.assert_array_equal(sharded[i]['labels'], single[i]['labels'])
+        single.close_reader()
+        sharded.close_reader()
+
+    def test_subject_entries_mapped_by_path(self):
+        class SubjectNamedEntryCallback(cb.Callback):
+            """Writes an entry outside the data groups that is named like a subject entry."""
+
+            def __init__(self, writer):
+                self.writer = writer
+
+            def on_end(self, params: dict):
+                self.writer.write('meta/custom/0', np.arange(3), dtype=np.int64)
+
+        sharded_path = os.path.join(self.dir, 'dataset.shards')
+        crt.create_sharded_dataset(sharded_path, self.subject_files, 2, load=ArrayLoad(),
+                                   callback_fn=lambda writer: crt.ComposeCallback(
+                                       [crt.get_default_callbacks(writer), SubjectNamedEntryCallback(writer)]))
+
+        with extr.get_reader(sharded_path, direct_open=True) as reader:
+            np.testing.assert_array_equal(reader.read('meta/custom/0'), np.arange(3))
+            self.assertEqual(reader.get_subject_entries(), ['data/images/{}'.format(i) for i in range(5)])
+            entries = reader.get_entries()
+            self.assertEqual(entries.count('meta/custom/0'), 1)
+            self.assertNotIn('meta/custom/3', entries)  # not mapped to the '0' of the second shard
+            for category in ('images', 'labels'):
+                for i in range(5):
+                    self.assertIn('data/{}/{}'.format(category, i), entries)
+                    self.assertTrue(reader.has('data/{}/{}'.format(category, i)))
+            self.assertEqual(reader.read('data/labels/4').dtype, np.uint8)
+
+    def test_cache_budget_split(self):
+        sharded_path = os.path.join(self.dir, 'dataset.shards')
+        crt.create_sharded_dataset(sharded_path, self.subject_files, 3, load=ArrayLoad())
+        volume_bytes = 4 * 5 * 6 * 2 * 4
+        with extr.get_reader(sharded_path, direct_open=True, cache_bytes=3 * volume_bytes) as reader:
+            self.assertEqual([shard.cache_bytes for shard in reader.shards], [volume_bytes] * 3)
+            for i in range(5):
+                for j in range(4):
+                    reader.read('data/images/{}'.format(i), expr.IndexExpression(j))
+            cached_bytes = sum(v.nbytes for shard in reader.shards for v in shard.volume_cache.values())
+            self.assertLessEqual(cached_bytes, 3 * volume_bytes)
+
+    def test_foreground(self):
+        single_path = os.path.join(self.dir, 'single.h5')
+        self.build(single_path, self.subject_files, transform=get_sparse_labels_transform(),
+                   callback_fn=get_foreground_callbacks)
+        sharded_path = os.path.join(self.dir, 'dataset.shards')
+        crt.create_sharded_dataset(sharded_path, self.subject_files, 2, load=ArrayLoad(),
+                                   transform=get_sparse_labels_transform(), callback_fn=get_foreground_callbacks)
+
+        for indexing in (extr.SliceIndexing((0, 2)), extr.PatchWiseIndexing((2, 5, 2))):
+            single = extr.ParameterizableDataset(single_path, indexing, extr.DataExtractor(('labels',)))
+            sharded = extr.ParameterizableDataset(sharded_path, indexing, extr.DataExtractor(('labels',)))
+            self.assertEqual(extr.select_foreground_indices(sharded), extr.select_foreground_indices(single))
+
+            for subject_index in range(len(self.subject_files)):
+                expected = single.direct_extract(extr.ForegroundExtractor(), subject_index)['labels_foreground']
+                actual = sharded.direct_extract(extr.ForegroundExtractor(), subject_index)['labels_foreground']
+                np.testing.assert_array_equal(actual['bbox'], expected['bbox'])
+                np.testing.assert_array_equal(actual['counts'], expected['counts'])
+                for actual_counts, expected_counts in zip(actual['slice_counts'], expected['slice_counts']):
+                    np.testing.assert_array_equal(actual_counts, expected_counts)
+            single.close_reader()
+            sharded.close_reader()
+
+
+class TestCachedLoad(DatasetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_paths = []
+        for i in range(3):
+            file_path = os.path.join(self.dir, 'image_{}.nii.gz'.format(i))
+            sitk.WriteImage(sitk.GetImageFromArray(np.full((4, 5, 6), i, dtype=np.int16)), file_path)
+            self.file_paths.append(file_path)
+
+    def test_cached_load(self):
+        cached_load = crt.CachedLoad(crt.LoadDefault(), os.path.join(self.dir, 'cache'))
+        expected_data, expected_properties = crt.LoadDefault()(self.file_paths[1], 'T1', 'images', 'Subject_1')
+        for _ in range(2):
+            data, properties = cached_load(self.file_paths[1], 'T1', 'images', 'Subject_1')
+            np.testing.assert_array_equal(data, expected_data)
+            self.assertEqual(data.dtype, expected_data.dtype)
+            self.assertEqual(properties, expected_properties)
+            self.assertEqual(properties.pixel_id, expected_properties.pixel_id)
+        self.assertEqual((cached_load.hits, cached_load.misses), (1, 1))
+        self.assertEqual(cached_load.load_properties(self.file_paths[1], 'T1', 'images', 'Subject_1'),
+                         expected_properties)
+
+        # modified files are loaded again
+        sitk.WriteImage(sitk.GetImageFromArray(np.full((4, 5, 7), 9, dtype=np.int16)), self.file_paths[1])
+        data, _ = cached_load(self.file_paths[1], 'T1', 'images', 'Subject_1')
+        self.assertEqual(data.shape, (4, 5, 7))
+        self.assertEqual(cached_load.misses, 2)
+
+    def test_loader_state_in_key(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        for scale in (1, 2):
+            data, _ = crt.CachedLoad(ScaledLoad(scale), cache_dir)(self.file_paths[1], 'T1', 'images', 'Subject_1')
+            np.testing.assert_array_equal(data, np.full((4, 5, 6), scale))
+
+        # the version replaces the fingerprint, e.g. of loaders that are not picklable
+        lambda_load = ScaledLoad(3)
+        lambda_load.fn = lambda x: x
+        self.assertRaises(ValueError, crt.CachedLoad, lambda_load, cache_dir)
+        cached_load = crt.CachedLoad(lambda_load, cache_dir, version='1')
+        for _ in range(2):
+            cached_load(self.file_paths[1], 'T1', 'images', 'Subject_1')
+        self.assertEqual((cached_load.hits, cached_load.misses), (1, 1))
+
+    def test_eviction(self):
+        entry_size = np.zeros((4, 5, 6), dtype=np.int16).nbytes + 128  # data and .npy header
+        cached_load = crt.CachedLoad(crt.LoadDefault(), os.path.join(self.dir, 'cache'), max_bytes=2 * entry_size)
+        for file_path in self.file_paths:
+            cached_load(file_path, 'T1', 'images', 'Subject_1')
+        self.assertLessEqual(cached_load.get_size(), 2 * entry_size)
+
+        cached_load(self.file_paths[2], 'T1', 'images', 'Subject_1')
+        self.assertEqual(cached_load.hits, 1)
+        cached_load(self.file_paths[0], 'T1', 'images', 'Subject_1')  # least recently used, thus evicted
+        self.assertEqual(cached_load.misses, 4)
+
+        cached_load.clear()
+        self.assertEqual(cached_load.get_size(), 0)
+
+
+class TestVolumeCache(DatasetTestCase):
+
+    def test_cached_reads(self):
+        for extension in ('.h5', '.pymia'):
+            file_path = os.path.join(self.dir, 'dataset' + extension)
+            self.build(file_path, get_subject_files(3))
+
+            volume_bytes = 4 * 5 * 6 * 2 * 4
+            with extr.get_reader(file_path, direct_open=True) as expected, \
+                    extr.get_reader(file_path, direct_open=True, cache_bytes=2 * volume_bytes) as actual:
+                entries = actual.get_subject_entries()
+                for entry in entries[:2] + entries[:1] + entries[2:] + entries[:1]:
+                    for i in range(2):
+                        index = expr.IndexExpression(i)
+                        data = actual.read(entry, index)
+                        np.testing.assert_array_equal(data, expected.read(entry, index))
+                        data[:] = 0  # returned data must not alias the cache
+                # the third subject evicts the least recently used second subject only
+                self.assertEqual(list(actual.volume_cache.keys()), [entries[2], entries[0]])
+                self.assertEqual((actual.cache_hits, actual.cache_misses), (7, 3))
+                np.testing.assert_array_equal(actual.read(entries[0]), expected.read(entries[0]))
+
+                actual.clear_cache()
+                self.assertEqual((len(actual.volume_cache), actual.cache_hits, actual.cache_misses), (0, 0, 0))
+
+    def test_requires_init_reader_once(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(file_path, get_subject_files(1))
+        extractor = extr.DataExtractor(('images',))
+        with self.assertRaises(ValueError):
+            extr.ParameterizableDataset(file_path, extr.SliceIndexing(), extractor, init_reader_once=False,
+                                        cache_bytes=1024)
+        with self.assertRaises(ValueError):
+            extr.ParameterizableDataset(file_path, extr.SliceIndexing(), extractor, init_reader_once=False,
+                                        in_memory=True)
+
+
+class TestInMemoryReader(DatasetTestCase):
+
+    def test_in_memory(self):
+        file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(file_path, get_subject_files(3),
+                   callback_fn=lambda writer: crt.get_default_callbacks(writer, dtypes={'images': 'uint16'}))
+
+        with extr.get_reader(file_path, direct_open=True) as expected, \
+                extr.get_reader(file_path, direct_open=True, in_memory=True) as actual:
+            self.assertIsInstance(actual, extr.InMemoryReader)
+            self.assertEqual(sorted(actual.get_entries()), sorted(expected.get_entries()))
+            self.assertEqual(actual.get_subject_entries(), expected.get_subject_entries())
+            self.assertEqual(actual.get_subjects(), expected.get_subjects())
+            self.assertEqual(actual.read(df.FILES_ROOT), expected.read(df.FILES_ROOT))
+            self.assertTrue(actual.has('meta/info') and not actual.has('meta/unknown'))
+            for entry in expected.get_subject_entries():
+                self.assertEqual(tuple(actual.get_shape(entry)), tuple(expected.get_shape(entry)))
+                np.testing.assert_array_equal(actual.read(entry, expr.IndexExpression(1)),
+                                              expected.read(entry, expr.IndexExpression(1)))
+
+        extractor = extr.ComposeExtractor([extr.DataExtractor(('images', 'labels')), extr.SubjectExtractor(),
+                                           extr.ImagePropertiesExtractor()])
+        expected = extr.ParameterizableDataset(file_path, extr.SliceIndexing(), extractor)
+        actual = extr.ParameterizableDataset(file_path, extr.SliceIndexing(), extractor, in_memory=True)
+        for i in (0, 5, len(expected) - 1):
+            self.assertEqual(actual[i]['subject'], expected[i]['subject'])
+            self.assertEqual(actual[i]['properties'], expected[i]['properties'])
+            np.testing.assert_array_equal(actual[i]['images'], expected[i]['images'])
+            np.testing.assert_array_equal(actual[i]['labels'], expected[i]['labels'])
+        self.assertIsInstance(actual.reader, extr.InMemoryReader)
+        expected.close_reader()
+        actual.close_reader()
+
+
+class TestSharedVolumeCache(DatasetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(self.file_path, get_subject_files(3))
+
+    def test_shared_cache(self):
+        volume_bytes = 4 * 5 * 6 * 2 * 4
+        cache = extr.SharedVolumeCache('test', 2 * volume_bytes + 256, root=self.dir)  # two volumes and headers
+        extractor = extr.DataExtractor(('images', 'labels'))
+        expected = extr.ParameterizableDataset(self.file_path, extr.SliceIndexing(), extractor)
+        actual = extr.ParameterizableDataset(self.file_path, extr.SliceIndexing(), extractor, shared_cache=cache)
+        for i in (0, 1, 2):
+            sample, expected_sample = actual[i], expected[i]
+            np.testing.assert_array_equal(sample['images'], expected_sample['images'])
+            np.testing.assert_array_equal(sample['labels'], expected_sample['labels'])
+        self.assertEqual((cache.hits, cache.misses), (4, 2))
+
+        # another process (i.e. a copy of the cache) reads the cached volumes
+        actual.close_reader()
+        worker = pickle.loads(pickle.dumps(actual))
+        np.testing.assert_array_equal(worker[1]['images'], expected[1]['images'])
+        self.assertEqual(worker.shared_cache.hits, 6)
+        self.assertIsNot(worker.shared_cache, cache)
+
+        # reading the other subjects evicts the least recently used volumes
+        for i in (4, 8):
+            np.testing.assert_array_equal(actual[i]['images'], expected[i]['images'])
+        self.assertLessEqual(cache.get_size(), cache.max_bytes)
+        # the volumes mapped by a process are limited as well, i.e. the evicted volumes are unmapped
+        for i in (0, 4, 8, 0, 4, 8):
+            actual[i]
+        self.assertLessEqual(sum(volume.nbytes for _, volume in cache._volumes.values()), cache.max_bytes)
+        self.assertTrue(all(os.path.isfile(path) for path in cache._volumes))
+
+        cache.clear()
+        self.assertEqual(cache.get_size(), 0)
+        expected.close_reader()
+        actual.close_reader()
+        worker.close_reader()
+
+    def test_without_init_reader_once(self):
+        cache = extr.SharedVolumeCache('test', 4 * 5 * 6 * 2 * 4 + 256, root=self.dir)
+        extractor = extr.DataExtractor(('images',))
+        actual = extr.ParameterizableDataset(self.file_path, extr.SliceIndexing(), extractor, init_reader_once=False,
+                                             shared_cache=cache)
+        actual[0]
+        actual[1]
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertIsNone(actual.reader)
+        cache.clear()
+
+
+class TestBatchExtraction(DatasetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(self.file_path, get_subject_files(3))
+
+    def test_batch_region(self):
+        index_exprs = [expr.IndexExpression(i) for i in (1, 3, 2)] + [expr.IndexExpression((2, 4), axis=1)]
+        with extr.get_reader(self.file_path, direct_open=True) as reader:
+            entry = reader.get_subject_entries()[1]
+            expected = [reader.read(entry, index_expr) for index_expr in index_exprs]
+            with reader.batch(index_exprs):
+                for index_expr, expected_data in zip(index_exprs, expected):
+                    np.testing.assert_array_equal(reader.read(entry, index_expr), expected_data)
+                bounds, region = reader.batch_regions[entry]
+                self.assertEqual(bounds, [(0, 4), (0, 5), (0, 6), (0, 2)])
+                # reads outside of the region are read directly
+                other = reader.read(reader.get_subject_entries()[0], expr.IndexExpression(0))
+                np.testing.assert_array_equal(other[..., 0], ArrayLoad()('/data/0/T1.mha', 'T1', 'images', '')[0][0])
+            self.assertEqual(reader.batch_regions, {})
+
+    def test_sparse_batch_read_per_sample(self):
+        index_exprs = [expr.IndexExpression(i) for i in (0, 3)]  # the region would be twice the samples
+        with extr.get_reader(self.file_path, direct_open=True) as reader:
+            entry = reader.get_subject_entries()[1]
+            expected = [reader.read(entry, index_expr) for index_expr in index_exprs]
+            for max_batch_region_ratio, is_region_read in ((2., True), (1.5, False)):
+                reader.max_batch_region_ratio = max_batch_region_ratio
+                with reader.batch(index_exprs):
+                    for index_expr, expected_data in zip(index_exprs, expected):
+                        np.testing.assert_array_equal(reader.read(entry, index_expr), expected_data)
+                    self.assertEqual(reader.batch_regions[entry] is not None, is_region_read)
+
+    def test_getitems(self):
+        extractor = extr.ComposeExtractor([extr.DataExtractor(('images', 'labels')), extr.SubjectExtractor(),
+                                           extr.IndexingExtractor()])
+        dataset = extr.ParameterizableDataset(self.file_path, extr.SliceIndexing(), extractor, batch_reads=True)
+        items = [5, 0, 1, 6, 11, 2]
+        batch = dataset.__getitems__(items)
+        for item, sample in zip(items, batch):
+            expected = dataset[item]
+            self.assertEqual(sample['subject'], expected['subject'])
+            self.assertEqual(sample['index_expr'].expression, expected['index_expr'].expression)
+            np.testing.assert_array_equal(sample['images'], expected['images'])
+            np.testing.assert_array_equal(sample['labels'], expected['labels'])
+
+        loader = extr.DataLoader(dataset, batch_size=4, collate_fn=lambda samples: samples)
+        self.assertEqual(sum(len(samples) for samples in loader), len(dataset))
+        dataset.close_reader()
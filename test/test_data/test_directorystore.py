@@ -0,0 +1,113 @@
+import shutil
+import tempfile
+import unittest
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import numpy as np
+
+import pymia.data.directorystore as ds
+
+
+class TestDirectoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_read_regions(self):
+        data = np.random.rand(5, 6, 7).astype(np.float32)
+        store = ds.DirectoryStore(self.root, mode='a')
+        store.open()
+        store.create('data/images/0', data.shape, data.dtype, chunks=(2, 4), compression_level=4, shuffle=True)
+        store.write('data/images/0', data)
+        store.close()
+
+        store = ds.DirectoryStore(self.root)
+        store.open()
+        np.testing.assert_array_equal(store.read('data/images/0'), data)
+        for expression in ((3,), (slice(1, 4), 5), (slice(None), slice(2, 6), 0), (4, 5, 6), ()):
+            np.testing.assert_array_equal(store.read('data/images/0', expression), data[expression])
+        self.assertEqual(store.keys('data'), ['images'])
+        self.assertTrue(store.has('data/images'))
+        self.assertFalse(store.has('data/labels'))
+
+    def test_partial_writes(self):
+        expected = np.zeros((4, 3), dtype=np.uint16)
+        store = ds.DirectoryStore(self.root, mode='a')
+        store.open()
+        store.create('meta/info/shapes', expected.shape, expected.dtype, chunks=(3, 2))
+        for i in range(4):
+            expected[i] = (i, i + 1, i + 2)
+            store.write('meta/info/shapes', expected[i], (i,))
+            np.testing.assert_array_equal(store.read('meta/info/shapes'), expected)
+
+    def test_strings(self):
+        store = ds.DirectoryStore(self.root, mode='a')
+        store.open()
+        store.create('meta/subjects', (2,), ds.STRING_DTYPE)
+        store.write('meta/subjects', 'Subject_1', (1,))
+        store.create('meta/files/file_root', (), ds.STRING_DTYPE)
+        store.write('meta/files/file_root', '/data')
+        store.close()
+
+        store = ds.DirectoryStore(self.root)
+        store.open()
+        self.assertEqual(store.read('meta/subjects').tolist(), ['', 'Subject_1'])
+        self.assertEqual(store.read('meta/files/file_root'), '/data')
+
+
+class TestNpyMemmapStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_read_views(self):
+        data = np.random.rand(5, 6, 7).astype(np.float32)
+        store = ds.NpyMemmapStore(self.root, mode='a')
+        store.open()
+        store.create('data/images/0', data.shape, data.dtype)
+        store.write('data/images/0', data)
+        store.create('meta/info/shapes', (2, 3), np.uint16)
+        store.write('meta/info/shapes', (5, 6, 7), (1,))
+        store.close()
+
+        store = ds.NpyMemmapStore(self.root)
+        store.open()
+        for expression in ((3,), (slice(1, 4), 5), ()):
+            sample = store.read('data/images/0', expression)
+            self.assertIsInstance(sample, np.memmap)
+            self.assertFalse(sample.flags.writeable)
+            np.testing.assert_array_equal(sample, data[expression])
+        np.testing.assert_array_equal(store.read('meta/info/shapes'), [[0, 0, 0], [5, 6, 7]])
+        self.assertEqual(store.keys('data/images'), ['0'])
+
+    @unittest.skipIf(resource is None, 'requires the resource module')
+    def test_more_entries_than_open_files(self):
+        soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+        limit = 128
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard_limit))
+        try:
+            store = ds.NpyMemmapStore(self.root, mode='a')
+            store.open()
+            for i in range(2 * limit):
+                store.create('data/images/{}'.format(i), (2, 3), np.float32)
+                store.write('data/images/{}'.format(i), np.full((2, 3), i, np.float32))
+            store.close()
+
+            store = ds.NpyMemmapStore(self.root)
+            store.open()
+            for i in range(2 * limit):
+                np.testing.assert_array_equal(store.read('data/images/{}'.format(i)), np.full((2, 3), i))
+            self.assertLessEqual(len(store.memmaps), store.MAX_MEMMAPS)
+            store.close()
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft_limit, hard_limit))
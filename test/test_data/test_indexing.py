@@ -0,0 +1,147 @@
+import os
+import unittest
+
+import numpy as np
+
+import pymia.data.extraction as extr
+import pymia.data.extraction.indexing as idx
+import pymia.data.indexexpression as expr
+from .helpers import DatasetTestCase, get_subject_files
+
+
+class ListIndexing(extr.IndexingStrategy):
+    """Indexes the first two slices, without vectorized or lazy index arrays."""
+
+    def __call__(self, shape):
+        return [expr.IndexExpression((1, 3), axis=1), expr.IndexExpression(shape[0] - 1)]
+
+
+class StrideIndexing(extr.IndexingStrategy):
+    """Indexes every n-th slice along the first axis."""
+
+    def __init__(self, stride) -> None:
+        self.stride = stride
+
+    def __call__(self, shape):
+        return [expr.IndexExpression(i) for i in range(0, shape[0], self.stride)]
+
+
+class TestIndexTable(unittest.TestCase):
+
+    def test_equals_index_expressions(self):
+        shapes = ((4, 6, 3, 2), (5, 6, 7, 2), (4, 6, 3, 2))
+        for strategy in (extr.EmptyIndexing(), extr.SliceIndexing((0, 2)), extr.VoxelWiseIndexing(),
+                         extr.PatchWiseIndexing((2, 4, 3), ignore_incomplete=False), ListIndexing()):
+            table = extr.IndexTable(strategy)
+            for subject, shape in enumerate(shapes):
+                table.append(subject, shape)
+            expected = [(s, e) for s, shape in enumerate(shapes) for e in strategy(shape)]
+            self.assertEqual(len(table), len(expected), strategy)
+            for (subject, index_expr), (expected_subject, expected_expr) in zip(table, expected):
+                self.assertEqual(subject, expected_subject)
+                self.assertEqual(index_expr.expression, expected_expr.expression, strategy)
+            for item in (0, len(expected) // 2, -1):
+                subject, index_expr = table[item]
+                self.assertEqual((subject, index_expr.expression), (expected[item][0], expected[item][1].expression))
+            np.testing.assert_array_equal(table.get_subject_indices(), [s for s, _ in expected])
+            np.testing.assert_array_equal(strategy.get_index_array(shapes[1]), idx.to_index_array(strategy(shapes[1])))
+
+    def test_compact(self):
+        table = extr.IndexTable(extr.VoxelWiseIndexing())
+        for subject in range(100):
+            table.append(subject, (64, 64, 64 + subject))  # every subject has a different shape
+        self.assertEqual(len(table), 64 * 64 * sum(64 + subject for subject in range(100)))
+        self.assertEqual(len(table.arrays), 0)
+        self.assertLessEqual(table.nbytes, 100 * (table.SEGMENT_DTYPE.itemsize + 3 * 8))
+        offset = 64 * 64 * sum(64 + subject for subject in range(42))
+        self.assertEqual(table[offset + 64 + 42 + 1][0], 42)
+        self.assertEqual(table[offset + 64 + 42 + 1][1].expression, (0, 1, 1))
+        self.assertRaises(IndexError, table.__getitem__, len(table))
+
+    def test_custom_strategy(self):
+        table = extr.IndexTable(ListIndexing())
+        for subject, shape in enumerate(((4, 5), (6, 5), (4, 5))):
+            table.append(subject, shape)
+        self.assertEqual(len(table.arrays), 2)  # stored once per shape
+        self.assertEqual([e.expression for _, e in table][-2:], [(slice(None), slice(1, 3)), (3,)])
+
+
+class TestIndexArray(unittest.TestCase):
+
+    def test_round_trip(self):
+        expressions = [(slice(-1, None), ), (slice(0, -2), ), (-1, slice(2, 4)), (slice(None, -3), 0),
+                       (0, slice(None), 1), (slice(1, 3, 1), )]
+        expected = [(slice(-1, None), ), (slice(0, -2), ), (-1, slice(2, 4)), (slice(None, -3), 0),
+                    (0, slice(None), 1), (slice(1, 3), )]
+        index_exprs = []
+        for expression in expressions:
+            index_exprs.append(expr.IndexExpression())
+            index_exprs[-1].expression = expression
+        index_array = idx.to_index_array(index_exprs)
+        self.assertEqual([idx.to_index_expression(row).expression for row in index_array], expected)
+
+    def test_non_tuple_expressions(self):
+        index_exprs = [expr.IndexExpression(), expr.IndexExpression(), expr.IndexExpression()]
+        index_exprs[1].expression = slice(2, 4)
+        index_exprs[2].expression = 3
+        index_array = idx.to_index_array(index_exprs)
+        self.assertEqual([idx.to_index_expression(row).expression for row in index_array],
+                         [slice(None), (slice(2, 4), ), (3, )])
+
+    def test_unsupported_expressions(self):
+        for expression in ((slice(0, 4, 2), ), (None, 1), (Ellipsis, ), ([1, 2], ), (2 ** 40, )):
+            index_expr = expr.IndexExpression()
+            index_expr.expression = expression
+            self.assertRaises(ValueError, idx.to_index_array, [index_expr])
+
+
+class TestIndexCache(DatasetTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.file_path = os.path.join(self.dir, 'dataset.h5')
+        self.build(self.file_path, get_subject_files(3))
+
+    def test_index_cache(self):
+        cache_dir = os.path.join(self.dir, 'index_cache')
+        expected = extr.ParameterizableDataset(self.file_path, extr.PatchWiseIndexing((2, 5, 3)))
+        built = extr.ParameterizableDataset(self.file_path, extr.PatchWiseIndexing((2, 5, 3)),
+                                            index_cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        loaded = extr.ParameterizableDataset(self.file_path, extr.PatchWiseIndexing((2, 5, 3)),
+                                             index_cache_dir=cache_dir)
+        self.assertEqual(loaded.indices.arrays, [])
+        for dataset in (built, loaded):
+            self.assertEqual(len(dataset), len(expected))
+            for (subject, index_expr), (expected_subject, expected_expr) in zip(dataset.indices, expected.indices):
+                self.assertEqual((subject, index_expr.expression), (expected_subject, expected_expr.expression))
+
+        # other strategies and subsets are cached separately
+        extr.ParameterizableDataset(self.file_path, extr.PatchWiseIndexing((2, 5, 2)), index_cache_dir=cache_dir)
+        subset = extr.ParameterizableDataset(self.file_path, extr.PatchWiseIndexing((2, 5, 3)),
+                                             subject_subset=['Subject_1'], index_cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+        self.assertEqual(len(subset), len(expected) // 3)
+        self.assertEqual(subset.indices[0][0], 1)
+
+    def test_custom_strategy(self):
+        cache_dir = os.path.join(self.dir, 'index_cache')
+        expected = extr.ParameterizableDataset(self.file_path, ListIndexing())
+        extr.ParameterizableDataset(self.file_path, ListIndexing(), index_cache_dir=cache_dir)
+        loaded = extr.ParameterizableDataset(self.file_path, ListIndexing(), index_cache_dir=cache_dir)
+        self.assertEqual(len(loaded.indices.arrays), 1)
+        self.assertEqual([(s, e.expression) for s, e in loaded.indices],
+                         [(s, e.expression) for s, e in expected.indices])
+
+    def test_strategy_parameters_in_key(self):
+        cache_dir = os.path.join(self.dir, 'index_cache')
+        for stride in (1, 2, 1):
+            dataset = extr.ParameterizableDataset(self.file_path, StrideIndexing(stride), index_cache_dir=cache_dir)
+            self.assertEqual(len(dataset), 3 * len(range(0, 4, stride)))
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        with self.assertWarns(UserWarning):
+            dataset = extr.ParameterizableDataset(self.file_path, StrideIndexing(np.int64(2)),
+                                                  index_cache_dir=cache_dir)
+        self.assertEqual(len(dataset), 6)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pymia.data.loading as load
+
+
+class FilePathGenerator(load.FilePathGenerator):
+
+    @staticmethod
+    def get_full_file_path(id_: str, root_dir: str, file_key, file_extension: str) -> str:
+        return os.path.join(root_dir, file_key + file_extension)
+
+
+class TestFileSystemDataCrawler(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root_dir = os.path.join(self.dir, 'root')
+        for subject in ('Subject_1', 'Subject_2', 'Subject_3'):
+            self.create_files(subject, ('T1.mha', 'GT.mha'))
+        os.makedirs(os.path.join(self.root_dir, 'NoData'))
+        self.cache_file = os.path.join(self.dir, 'cache.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def create_files(self, subject, file_names):
+        os.makedirs(os.path.join(self.root_dir, subject), exist_ok=True)
+        for file_name in file_names:
+            open(os.path.join(self.root_dir, subject, file_name), 'w').close()
+
+    def crawl(self, **kwargs):
+        return load.FileSystemDataCrawler(self.root_dir, ['T1', 'GT'], FilePathGenerator(), file_extension='.mha',
+                                          **kwargs).data
+
+    def test_parallel_cached_equals_serial(self):
+        expected = self.crawl()
+        self.assertEqual(sorted(expected.keys()), ['Subject_1', 'Subject_2', 'Subject_3'])
+        self.assertEqual(self.crawl(num_threads=4, cache_file=self.cache_file, check_files=True), expected)
+        self.assertEqual(self.crawl(num_threads=4, cache_file=self.cache_file, check_files=True), expected)
+
+    def test_cache_rescans_modified_directories(self):
+        self.crawl(cache_file=self.cache_file)
+        with open(self.cache_file) as f:
+            cache = json.load(f)
+        # tamper the cache of an unmodified directory to verify that it is not scanned again
+        cache['directories']['Subject_1'][1] = ['T1.mha']
+        with open(self.cache_file, 'w') as f:
+            json.dump(cache, f)
+
+        self.create_files('NoData', ('T1.mha', 'GT.mha'))
+        data = self.crawl(cache_file=self.cache_file)
+        self.assertIn('NoData', data)
+        self.assertRaises(ValueError, self.crawl, cache_file=self.cache_file, check_files=True)  # Subject_1/GT.mha
+
+    def test_check_files(self):
+        os.remove(os.path.join(self.root_dir, 'Subject_2', 'GT.mha'))
+        self.assertRaises(ValueError, self.crawl, check_files=True)
+        self.assertIn('Subject_2', self.crawl())